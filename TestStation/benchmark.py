@@ -0,0 +1,463 @@
+import os
+import tempfile
+import time
+import timeit
+from firefly.production.binary import FDBinary
+from firefly.production.capture import RecordingTransport
+from firefly.production.capture import ReplayTransport
+from firefly.production.capture import read_capture
+from firefly.production.discovery import DiscoveryCache
+from firefly.production.binary import decode_packet_header
+from firefly.production.binary import decode_varuints
+from firefly.production.binary import encode_packet_header
+from firefly.production.binary import encode_varuints
+from firefly.production.instruments import Detour
+from firefly.production.instruments import DetourSource
+from firefly.production.instruments import InstrumentManager
+from firefly.production.instruments import SerialWireDebugBatch
+from firefly.production.instruments import SerialWireDebugTransfer
+from firefly.production.instruments import SerialWireInstrument
+from firefly.production.instruments import StorageInstrument
+from firefly.production.simulator import SimulatedSerialWire
+from firefly.production.simulator import SimulatedTransport
+from firefly.production.storage import FileSystem
+
+
+def report(name, function, count):
+    seconds = min(timeit.repeat(function, number=count, repeat=5))
+    print(f"{name}: {seconds / count * 1e6:.3f} us")
+
+
+def put_varuint_bytewise(binary, value):
+    # the original byte at a time encoder, kept here as the baseline
+    remainder = value
+    while remainder != 0:
+        if remainder <= 0x7f:
+            break
+        byte = (remainder & 0x7f) | 0x80
+        binary.put_uint8(byte)
+        remainder = remainder >> 7
+    byte = remainder
+    binary.put_uint8(byte)
+
+
+def benchmark_varuint(count=100000):
+    # identifier, api and content length of a 4 KB storage write packet
+    header = (4, 2, 4101)
+
+    def bytewise():
+        binary = FDBinary()
+        for value in header:
+            put_varuint_bytewise(binary, value)
+
+    def single():
+        binary = FDBinary()
+        for value in header:
+            binary.put_varuint(value)
+
+    def batched():
+        binary = FDBinary()
+        binary.put_varuints(header)
+
+    report("varuint packet header (byte at a time)", bytewise, count)
+    report("varuint packet header (put_varuint)", single, count)
+    report("varuint packet header (put_varuints)", batched, count)
+
+    data = FDBinary()
+    data.put_varuints(header)
+
+    def decode_single():
+        binary = FDBinary(data.data)
+        binary.get_varuint()
+        binary.get_varuint()
+        binary.get_varuint()
+
+    def decode_batched():
+        binary = FDBinary(data.data)
+        binary.get_varuints(3)
+
+    report("varuint packet header decode (get_varuint)", decode_single, count)
+    report("varuint packet header decode (get_varuints)", decode_batched, count)
+
+    # the header paths of InstrumentManager.write_packet and reassemble, for a small invoke, a storage write and a
+    # transfer too long for the one and two byte length paths
+    headers = (("invoke", (40, 3, 12)), ("storage write", header), ("64 KB transfer", (2, 14, 1 << 16)))
+    for name, (identifier, api, length) in headers:
+        payload = memoryview(bytes(encode_varuints((identifier, api, length))) + bytes(16))
+
+        def encode_single():
+            binary = FDBinary()
+            binary.put_varuint(identifier)
+            binary.put_varuint(api)
+            binary.put_varuint(length)
+
+        def decode_single():
+            binary = FDBinary(payload)
+            binary.get_varuint()
+            binary.get_varuint()
+            binary.get_varuint()
+
+        report(f"{name} header (put_varuint)", encode_single, count)
+        report(f"{name} header (encode_varuints)", lambda: encode_varuints((identifier, api, length)), count)
+        report(f"{name} header (encode_packet_header)", lambda: encode_packet_header(identifier, api, length), count)
+        report(f"{name} header decode (get_varuint)", decode_single, count)
+        report(f"{name} header decode (decode_varuints)", lambda: decode_varuints(payload, 0, 3), count)
+        report(f"{name} header decode (decode_packet_header)", lambda: decode_packet_header(payload, 0), count)
+
+    values = [(i * 37) & 0x3fff for i in range(1000)]
+    sequence = FDBinary()
+    sequence.put_varuints(values)
+
+    def sequence_bytewise():
+        binary = FDBinary()
+        for value in values:
+            put_varuint_bytewise(binary, value)
+
+    def sequence_batched():
+        binary = FDBinary()
+        binary.put_varuints(values)
+
+    def sequence_decode_single():
+        binary = FDBinary(sequence.data)
+        for _ in range(len(values)):
+            binary.get_varuint()
+
+    def sequence_decode_batched():
+        binary = FDBinary(sequence.data)
+        binary.get_varuints(len(values))
+
+    report("varuint x1000 (byte at a time)", sequence_bytewise, count // 100)
+    report("varuint x1000 (put_varuints)", sequence_batched, count // 100)
+    report("varuint x1000 decode (get_varuint)", sequence_decode_single, count // 100)
+    report("varuint x1000 decode (get_varuints)", sequence_decode_batched, count // 100)
+
+
+def reports_concatenated(identifier, api, content):
+    # the original framing, building a new report by concatenation for every 63 bytes, kept here as the baseline
+    packet = FDBinary()
+    packet.put_varuints((identifier, api, len(content)))
+    packet.put_bytes(content)
+    binary = FDBinary()
+    binary.put_varuint(len(packet.data))
+    binary.put_bytes(packet.data)
+    data = binary.data
+    sequence_number = 0
+    offset = 0
+    remaining = len(data)
+    while remaining > 0:
+        sublength = 63 if remaining >= 63 else remaining
+        yield bytearray([sequence_number]) + data[offset:offset + sublength] + bytes(63 - sublength)
+        sequence_number += 1
+        offset += sublength
+        remaining -= sublength
+
+
+def benchmark_framing(count=10000):
+    detour_source = DetourSource()
+
+    def write_report(report):
+        pass
+    for length in (8, 4096):
+        content = bytes(length)
+
+        def concatenated():
+            for _ in reports_concatenated(4, 2, content):
+                pass
+
+        def preallocated():
+            header = encode_packet_header(4, 2, len(content))
+            detour_source.write(header, content, write_report)
+
+        report(f"frame {length} byte packet (concatenated)", concatenated, count)
+        report(f"frame {length} byte packet (preallocated)", preallocated, count)
+
+
+def reassemble_list(reports):
+    # the original reassembly, extending a list per report and parsing through another FDBinary, kept as the baseline
+    buffer = []
+    length = 0
+    for report in reports:
+        binary = FDBinary(report)
+        if binary.get_varuint() == 0:
+            length = binary.get_varuint()
+            buffer = []
+        data = binary.get_remaining_data()
+        buffer.extend(data[0:length - len(buffer)])
+    binary = FDBinary(buffer)
+    binary.get_varuint()
+    binary.get_varuint()
+    count = binary.get_varuint()
+    return binary.get_bytes(count)
+
+
+def reassemble_preallocated(reports):
+    detour = Detour()
+    for report in reports:
+        detour.event(report)
+    payload = detour.payload()
+    (_, _, count), index = decode_varuints(payload, 0, 3)
+    return payload[index:index + count]
+
+
+def benchmark_reassembly(count=10000):
+    for length in (8, 4096):
+        reports = []
+        header = encode_varuints((4, 3, length))
+        DetourSource().write(header, bytes(length), lambda report: reports.append(bytes(report)))
+
+        report(f"reassemble {length} byte packet (list)", lambda: reassemble_list(reports), count)
+        report(f"reassemble {length} byte packet (preallocated)", lambda: reassemble_preallocated(reports), count)
+
+
+def simulated_manager(latency=0.001):
+    manager = InstrumentManager(SimulatedTransport(latency=latency))
+    manager.open()
+    manager.discover_instruments()
+    return manager
+
+
+def report_elapsed(name, function):
+    start = time.perf_counter()
+    function()
+    print(f"{name}: {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+
+def benchmark_pipeline(latency=0.001):
+    for depth in (1, 4):
+        manager = simulated_manager(latency)
+        manager.pipeline_depth = depth
+        storage_instrument = manager.get_instrument(4)
+        serial_wire_instrument = manager.get_instrument(2)
+        report_elapsed(
+            f"storage read 64 KB (pipeline depth {depth})",
+            lambda: storage_instrument.read_lots(0, 1 << 16)
+        )
+        report_elapsed(
+            f"serial wire read 16 KB (pipeline depth {depth})",
+            lambda: serial_wire_instrument.read_memory(0x20000000, 1 << 14)
+        )
+        serial_wire_instrument.max_count = 64
+        report_elapsed(
+            f"serial wire read 4 KB in 64 byte chunks (pipeline depth {depth})",
+            lambda: serial_wire_instrument.read_memory(0x20000000, 1 << 12)
+        )
+
+
+def benchmark_discovery(latency=0.001):
+    # a cold start waits for the discovery round trip, a warm start builds the instruments from the cache and returns
+    path = os.path.join(tempfile.mkdtemp(), 'discovery.json')
+    for start in ('cold', 'warm'):
+        manager = InstrumentManager(SimulatedTransport(latency=latency))
+        manager.open()
+
+        def discover():
+            manager.discover_instruments(DiscoveryCache(path))
+            for identifier in (1, 2, 3, 4, 41, 48, 50, 51):
+                manager.get_instrument(identifier)
+
+        report_elapsed(f"discover instruments ({start} start)", discover)
+        manager.echo([0xbe, 0xef])
+        manager.close()
+
+
+def benchmark_coalescing(latency=0.001):
+    for coalesce in (False, True):
+        manager = simulated_manager(latency)
+        manager.set_coalescing(coalesce)
+        relays = [manager.get_instrument(identifier) for identifier in range(41, 48)]
+
+        def sequence():
+            for step in range(10):
+                for relay in relays:
+                    relay.set((step & 1) == 0)
+            manager.echo([0xbe, 0xef])
+
+        report_elapsed(f"70 relay invokes and an echo (coalesce {coalesce})", sequence)
+        manager.close()
+
+
+def report_throughput(name, length, function):
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    print(f"{name}: {length / seconds / 1024:.1f} KB/s")
+
+
+def write_echo_every_chunk(storage_instrument, address, data):
+    # the original flow control, a blocking echo after every chunk, kept here as the baseline
+    offset = 0
+    while offset < len(data):
+        length = min(len(data) - offset, StorageInstrument.maxTransferLength)
+        storage_instrument.invoke_api(
+            StorageInstrument.apiWrite, address + offset, length, data[offset:offset + length]
+        )
+        storage_instrument.manager.echo([0xbe, 0xef])
+        offset += length
+
+
+# program_time is a SPI NOR flash page program (about 0.7 ms for 256 bytes), so the fixture is busy programming each
+# chunk while the next one could be crossing the link.
+def benchmark_storage_throughput(latency=0.001, length=1 << 18, program_time=0.7e-3 / 256):
+    data = bytes(range(256)) * (length // 256)
+    manager = simulated_manager(latency)
+    manager.transport.instruments[4].program_time = program_time
+    storage_instrument = manager.get_instrument(4)
+    report_throughput(
+        "storage write (echo every chunk)", length, lambda: write_echo_every_chunk(storage_instrument, 0, data)
+    )
+    for window in (1, 2, 4, 8):
+        storage_instrument.write_window = window
+        report_throughput(f"storage write (window {window})", length, lambda: storage_instrument.write(0, data))
+    storage_instrument.write_window = StorageInstrument.writeWindow
+    report_throughput(
+        f"storage write (default window {StorageInstrument.writeWindow})", length,
+        lambda: storage_instrument.write(0, data)
+    )
+
+    file_system = FileSystem(storage_instrument)
+    file_system.scan()
+    report_throughput("FileSystem.write", length, lambda: file_system.allocate('benchmark.bin', data, 0))
+
+    try:
+        from firefly.production import scripts
+    except ImportError as error:
+        print(f"Flasher.setup_firmware staging: skipped ({error})")
+        return
+
+    class StagedFirmware:
+
+        def __init__(self, name):
+            self.data = data
+
+    # stage a generated image rather than loading one from an ELF file
+    scripts.Firmware = StagedFirmware
+    install = scripts.Flasher.Install('benchmark', 'benchmark.bin')
+    flasher = scripts.Flasher(None, manager.get_instrument(2), 'NRF53', [install], storage_instrument)
+    storage_instrument.file_mkfs()
+    report_throughput("Flasher.setup_firmware staging", length, lambda: flasher.setup_firmware(install))
+
+
+def storage_run(manager, data):
+    manager.discover_instruments()
+    storage_instrument = manager.get_instrument(4)
+    storage_instrument.write(0, data)
+    storage_instrument.read(0, len(data))
+
+
+def benchmark_replay(latency=0.001, length=1 << 16):
+    # record a storage write and read against the simulator, then replay it without delays so only the host side
+    # (framing, reassembly and the instrument calls) is timed
+    data = bytes(range(256)) * (length // 256)
+    path = os.path.join(tempfile.mkdtemp(), 'storage.cap')
+    transport = RecordingTransport(SimulatedTransport(latency=latency), path)
+    start = time.perf_counter()
+    storage_run(InstrumentManager(transport), data)
+    elapsed = time.perf_counter() - start
+    transport.close()
+    records = read_capture(path)
+    print(f"storage run (simulated): {elapsed * 1e3:.1f} ms, {len(records)} reports, {os.path.getsize(path)} bytes")
+    report_elapsed(
+        "storage run (replayed, host side)",
+        lambda: storage_run(InstrumentManager(ReplayTransport(records, scale=0.0, check=True)), data)
+    )
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+# Answers serial wire transfers from a simulated serial wire without going through a transport, so only the host
+# side of a transfer is timed.
+class TransferManager:
+
+    shadowing = False
+
+    def __init__(self):
+        self.serial_wire = SimulatedSerialWire(2)
+        self.responses = {}
+
+    def call(self, identifier, api, content=None):
+        content = bytes(content)
+        response = self.responses.get(content)
+        if response is None:
+            response = bytes(self.serial_wire.api_transfer(content))
+            self.responses[content] = response
+        return response
+
+
+# An SPI style batch: clock and data writes with a read of the input port after every bit.
+def build_transfer_list(count):
+    transfers = []
+    for i in range(count):
+        transfers.append(SerialWireDebugTransfer.write_memory(0x50000508, 1 << (i & 31)))
+        transfers.append(SerialWireDebugTransfer.write_memory(0x5000050c, 1 << 3))
+        transfers.append(SerialWireDebugTransfer.read_memory(0x20000000 + 4 * (i & 63)))
+        transfers.append(SerialWireDebugTransfer.write_memory(0x50000508, 1 << 3))
+    return transfers
+
+
+def build_transfer_batch(count):
+    batch = SerialWireDebugBatch()
+    for i in range(count):
+        batch.write_memory(0x50000508, 1 << (i & 31))
+        batch.write_memory(0x5000050c, 1 << 3)
+        batch.read_memory(0x20000000 + 4 * (i & 63))
+        batch.write_memory(0x50000508, 1 << 3)
+    return batch
+
+
+# The same transfers with the bulk builders: the pattern repeats every 64 bits, so it is built once and extended.
+def build_transfer_batch_bulk(count):
+    cycle = build_transfer_batch(min(count, 64))
+    batch = SerialWireDebugBatch()
+    batch.extend(cycle, count // 64)
+    if count > 64:
+        batch.extend(build_transfer_batch(count % 64))
+    return batch
+
+
+def benchmark_serial_wire_transfers(count=2048, repeat=10):
+    # host side only: the simulator's responses are cached, so only building, encoding and decoding are timed
+    serial_wire_instrument = SerialWireInstrument(TransferManager(), 2)
+    serial_wire_instrument.transfer(build_transfer_list(count))
+    serial_wire_instrument.transfer(build_transfer_batch(count))
+    report(f"serial wire transfers x{4 * count} build (list)", lambda: build_transfer_list(count), repeat)
+    report(f"serial wire transfers x{4 * count} build (batch)", lambda: build_transfer_batch(count), repeat)
+    report(f"serial wire transfers x{4 * count} build (batch, bulk)", lambda: build_transfer_batch_bulk(count), repeat)
+    transfers = build_transfer_list(count)
+    batch = build_transfer_batch_bulk(count)
+    report(
+        f"serial wire transfers x{4 * count} encode and decode (list)",
+        lambda: serial_wire_instrument.transfer(transfers), repeat
+    )
+    report(
+        f"serial wire transfers x{4 * count} encode and decode (batch)",
+        lambda: serial_wire_instrument.transfer(batch), repeat
+    )
+    reads = [transfer.data for transfer in transfers if transfer.type == SerialWireDebugTransfer.typeReadMemory]
+    if reads != batch.data:
+        raise IOError('serial wire batch mismatch')
+
+    # the whole exchange through SimulatedTransport: framing into reports, reassembly, and the simulated fixture
+    # decoding the transfers and answering
+    manager = simulated_manager(0.0)
+    serial_wire_instrument = manager.get_instrument(2)
+    report(
+        f"serial wire transfers x{4 * count} through the simulator (list)",
+        lambda: serial_wire_instrument.transfer(build_transfer_list(count)), repeat
+    )
+    report(
+        f"serial wire transfers x{4 * count} through the simulator (batch, bulk)",
+        lambda: serial_wire_instrument.transfer(build_transfer_batch_bulk(count)), repeat
+    )
+    manager.close()
+
+
+if __name__ == '__main__':
+    benchmark_varuint()
+    benchmark_framing()
+    benchmark_reassembly()
+    benchmark_pipeline()
+    benchmark_discovery()
+    benchmark_coalescing()
+    benchmark_storage_throughput()
+    benchmark_replay()
+    benchmark_serial_wire_transfers()
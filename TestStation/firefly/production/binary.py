@@ -1,4 +1,92 @@
+import array
 import struct
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+uint16_struct = struct.Struct('<H')
+uint32_struct = struct.Struct('<I')
+uint64_struct = struct.Struct('<Q')
+float16_struct = struct.Struct('<e')
+float32_struct = struct.Struct('<f')
+float64_struct = struct.Struct('<d')
+
+# array.array uses native byte order, the wire format is little endian
+array_byteswap = sys.byteorder != 'little'
+uint32_typecode = 'I' if array.array('I').itemsize == 4 else 'L'
+
+
+def encode_varuints(values, data=None):
+    if data is None:
+        data = bytearray()
+    append = data.append
+    for value in values:
+        while value > 0x7f:
+            append((value & 0x7f) | 0x80)
+            value >>= 7
+        append(value)
+    return data
+
+
+def decode_varuints(data, index, count):
+    values = []
+    append = values.append
+    try:
+        for _ in range(count):
+            byte = data[index]
+            index += 1
+            if byte < 0x80:
+                append(byte)
+                continue
+            value = byte & 0x7f
+            shift = 7
+            while True:
+                byte = data[index]
+                index += 1
+                value |= (byte & 0x7f) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+                if shift > 63:
+                    raise IOError('varuint invalid representation')
+            if value > 0xffffffffffffffff:
+                raise IOError('varuint invalid representation')
+            append(value)
+    except IndexError:
+        raise IOError('varuint out of bounds')
+    return values, index
+
+
+# A packet header is three varuints (identifier, api and content length).  The identifier and api are one byte, and
+# the length is one byte for an invoke and two for a storage chunk or frame (under 16 KB), so those are handled
+# without the general loop.
+def encode_packet_header(identifier, api, length):
+    if (identifier | api) < 0x80:
+        if length < 0x80:
+            return bytes((identifier, api, length))
+        if length < 0x4000:
+            return bytes((identifier, api, (length & 0x7f) | 0x80, length >> 7))
+    return encode_varuints((identifier, api, length))
+
+
+# Returns (identifier, api, length) and the index after the header.
+def decode_packet_header(data, index):
+    end = len(data)
+    if end >= index + 3:
+        identifier, api, length = data[index], data[index + 1], data[index + 2]
+        if (identifier | api) < 0x80:
+            if length < 0x80:
+                return (identifier, api, length), index + 3
+            if end > index + 3:
+                high = data[index + 3]
+                if high < 0x80:
+                    return (identifier, api, (length & 0x7f) | (high << 7)), index + 4
+            (length,), index = decode_varuints(data, index + 2, 1)
+            return (identifier, api, length), index
+    return decode_varuints(data, index, 3)
 
 
 class FDBinary:
@@ -7,9 +95,16 @@ class FDBinary:
     FLAG_INVALID_REPRESENTATION = 0x00000002
     FLAG_OUT_OF_BOUNDS = 0x00000004
 
+    # Data is held in a bytearray so that puts append in place.  Bytes-like data (bytes, bytearray, memoryview) is used
+    # as is, anything else (such as a list of ints) is copied, and read only data is copied into a bytearray by the
+    # first put.  Gets return read only memoryviews: slices without copying when the data is read only, and views of
+    # a copy when it is a bytearray (which can not be resized while a view of it is alive, so a view would make the
+    # next put fail).
     def __init__(self, data=None, limit=None):
-        if not data:
-            data = []
+        if data is None:
+            data = bytearray()
+        elif not isinstance(data, (bytearray, bytes, memoryview)):
+            data = bytearray(data)
         self.data = data
         self.limit = limit
         self.get_index = 0
@@ -20,7 +115,7 @@ class FDBinary:
         self.flags = 0
 
     def remove(self, index, length):
-        self.data = self.data[0:index] + self.data[index + length:]
+        self.data = bytearray(self.data[0:index]) + self.data[index + length:]
         if self.get_index > (index + length):
             self.get_index -= length
         elif self.get_index > index:
@@ -40,10 +135,15 @@ class FDBinary:
 
     def get_bytes(self, length):
         if not self.get_check(length):
-            return []
-        result = self.data[self.get_index:self.get_index + length]
-        self.get_index += length
-        return result
+            return memoryview(b'')
+        index = self.get_index
+        self.get_index = index + length
+        return self.view(index, length)
+
+    def view(self, index, length):
+        if isinstance(self.data, bytearray):
+            return memoryview(self.data[index:index + length]).toreadonly()
+        return memoryview(self.data)[index:index + length]
 
     def get_uint8(self):
         if not self.get_check(1):
@@ -55,66 +155,91 @@ class FDBinary:
     def get_uint16(self):
         if not self.get_check(2):
             return 0
-        b0 = self.data[self.get_index]
-        b1 = self.data[self.get_index + 1]
-        result = (b1 << 8) | b0
+        result = uint16_struct.unpack_from(self.data, self.get_index)[0]
         self.get_index += 2
         return result
 
     def get_uint24(self):
         if not self.get_check(3):
             return 0
-        b0 = self.data[self.get_index]
-        b1 = self.data[self.get_index + 1]
-        b2 = self.data[self.get_index + 2]
-        result = (b2 << 16) | (b1 << 8) | b0
+        low = uint16_struct.unpack_from(self.data, self.get_index)[0]
+        result = (self.data[self.get_index + 2] << 16) | low
         self.get_index += 3
         return result
 
     def get_uint32(self):
         if not self.get_check(4):
             return 0
-        b0 = self.data[self.get_index]
-        b1 = self.data[self.get_index + 1]
-        b2 = self.data[self.get_index + 2]
-        b3 = self.data[self.get_index + 3]
-        result = (b3 << 24) | (b2 << 16) | (b1 << 8) | b0
+        result = uint32_struct.unpack_from(self.data, self.get_index)[0]
         self.get_index += 4
         return result
 
     def get_uint64(self):
         if not self.get_check(8):
             return 0
-        buffer = bytes(self.data[self.get_index:self.get_index + 8])
-        result = struct.unpack('<Q', buffer)[0]
+        result = uint64_struct.unpack_from(self.data, self.get_index)[0]
         self.get_index += 8
         return result
 
     def get_float16(self):
         if not self.get_check(2):
             return 0
-        buffer = bytes(self.data[self.get_index:self.get_index + 2])
-        result = struct.unpack('<e', buffer)[0]
+        result = float16_struct.unpack_from(self.data, self.get_index)[0]
         self.get_index += 2
         return result
 
     def get_float32(self):
         if not self.get_check(4):
             return 0
-        buffer = bytes(self.data[self.get_index:self.get_index + 4])
-        result = struct.unpack('<f', buffer)[0]
+        result = float32_struct.unpack_from(self.data, self.get_index)[0]
         self.get_index += 4
         return result
 
     def get_float64(self):
         if not self.get_check(8):
             return 0
-        buffer = bytes(self.data[self.get_index:self.get_index + 8])
-        result = struct.unpack('<d', buffer)[0]
+        result = float64_struct.unpack_from(self.data, self.get_index)[0]
         self.get_index += 8
         return result
 
+    # Bulk getters decode count values in one call, either into an array.array or (with as_numpy) a read only
+    # numpy view onto the underlying data (or a copy of it when the data is a bytearray).
+    def get_array(self, typecode, dtype, size, count, as_numpy=False):
+        length = size * count
+        if not self.get_check(length):
+            count = 0
+            length = 0
+        view = self.view(self.get_index, length)
+        self.get_index += length
+        if as_numpy:
+            if numpy is None:
+                raise ImportError("numpy is not available")
+            return numpy.frombuffer(view, dtype=dtype, count=count)
+        values = array.array(typecode)
+        values.frombytes(view)
+        if array_byteswap:
+            values.byteswap()
+        return values
+
+    def get_uint16_array(self, count, as_numpy=False):
+        return self.get_array('H', '<u2', 2, count, as_numpy)
+
+    def get_uint32_array(self, count, as_numpy=False):
+        return self.get_array(uint32_typecode, '<u4', 4, count, as_numpy)
+
+    def get_float32_array(self, count, as_numpy=False):
+        return self.get_array('f', '<f4', 4, count, as_numpy)
+
+    def get_float64_array(self, count, as_numpy=False):
+        return self.get_array('d', '<f8', 8, count, as_numpy)
+
     def get_varuint(self):
+        index = self.get_index
+        if index < len(self.data):
+            byte = self.data[index]
+            if byte < 0x80:
+                self.get_index = index + 1
+                return byte
         value = 0
         remaining = len(self.data) - self.get_index
         index = 0
@@ -123,14 +248,28 @@ class FDBinary:
             self.get_index += 1
             value |= (byte & 0x7f) << (index * 7)
             if (byte & 0x80) == 0:
+                if value > 0xffffffffffffffff:
+                    break
                 return value
-            if (value & 0xe000000000000000) != 0:
-                self.flags |= FDBinary.FLAG_INVALID_REPRESENTATION
-                return 0
             index += 1
-        self.flags |= FDBinary.FLAG_OUT_OF_BOUNDS
+            # a 64 bit value takes at most ten bytes
+            if index == 10:
+                break
+        else:
+            self.flags |= FDBinary.FLAG_OUT_OF_BOUNDS
+            return 0
+        self.flags |= FDBinary.FLAG_INVALID_REPRESENTATION
         return 0
 
+    def get_varuints(self, count):
+        try:
+            values, self.get_index = decode_varuints(self.data, self.get_index, count)
+        except IOError:
+            self.flags |= FDBinary.FLAG_OUT_OF_BOUNDS
+            self.get_index = len(self.data)
+            return [0] * count
+        return values
+
     def get_varint(self):
         zig_zag = self.get_varuint()
         if (zig_zag & 0x0000000000000001) != 0:
@@ -145,12 +284,18 @@ class FDBinary:
         if remaining < length:
             self.flags |= FDBinary.FLAG_INVALID_REPRESENTATION
             length = 0
-        buffer = self.data[self.get_index:self.get_index + length]
-        string = bytes(buffer).decode('utf-8')
+        string = str(memoryview(self.data)[self.get_index:self.get_index + length], 'utf-8')
         self.get_index += length
         return string
 
+    def writable(self):
+        data = self.data
+        if not isinstance(data, bytearray):
+            data = self.data = bytearray(data)
+        return data
+
     def put_check(self, length):
+        self.writable()
         if not self.limit or ((len(self.data) + length) <= self.limit):
             return True
         self.flags |= FDBinary.FLAG_OVERFLOW
@@ -158,50 +303,76 @@ class FDBinary:
 
     def put_bytes(self, data):
         if self.put_check(len(data)):
-            self.data += data
+            self.data.extend(data)
 
     def put_uint8(self, value):
         if self.put_check(1):
-            self.data += [value]
+            self.data.append(value)
 
     def put_uint16(self, value):
         if self.put_check(2):
-            self.data += [value & 0xff, value >> 8]
+            self.data += uint16_struct.pack(value & 0xffff)
 
     def put_uint24(self, value):
         if self.put_check(3):
-            self.data += [value & 0xff, (value >> 8) & 0xff, value >> 16]
+            self.data += uint32_struct.pack(value & 0xffffff)[0:3]
 
     def put_uint32(self, value):
         if self.put_check(4):
-            self.data += [value & 0xff, (value >> 8) & 0xff, (value >> 16) & 0xff, value >> 24]
+            self.data += uint32_struct.pack(value & 0xffffffff)
 
     def put_uint64(self, value):
         if self.put_check(8):
-            self.data += struct.pack("<Q", value)
+            self.data += uint64_struct.pack(value)
 
     def put_float16(self, value):
         if self.put_check(2):
-            self.data += struct.pack("<e", value)
+            self.data += float16_struct.pack(value)
 
     def put_float32(self, value):
         if self.put_check(4):
-            self.data += struct.pack("<f", value)
+            self.data += float32_struct.pack(value)
 
     def put_float64(self, value):
-        if self.put_check(4):
-            self.data += struct.pack("<d", value)
+        if self.put_check(8):
+            self.data += float64_struct.pack(value)
+
+    def put_array(self, typecode, format, size, values):
+        count = len(values)
+        if not self.put_check(size * count):
+            return
+        if isinstance(values, array.array) and (values.typecode == typecode) and not array_byteswap:
+            self.data += values
+        else:
+            self.data += struct.pack(f"<{count}{format}", *values)
+
+    def put_uint16_array(self, values):
+        self.put_array('H', 'H', 2, values)
+
+    def put_uint32_array(self, values):
+        self.put_array(uint32_typecode, 'I', 4, values)
+
+    def put_float32_array(self, values):
+        self.put_array('f', 'f', 4, values)
+
+    def put_float64_array(self, values):
+        self.put_array('d', 'd', 8, values)
 
     def put_varuint(self, value):
-        remainder = value
-        while remainder != 0:
-            if remainder <= 0x7f:
-                break
-            byte = (remainder & 0x7f) | 0x80
-            self.put_uint8(byte)
-            remainder = remainder >> 7
-        byte = remainder
-        self.put_uint8(byte)
+        if self.limit:
+            self.put_bytes(encode_varuints((value,)))
+            return
+        data = self.writable()
+        while value > 0x7f:
+            data.append((value & 0x7f) | 0x80)
+            value >>= 7
+        data.append(value)
+
+    def put_varuints(self, values):
+        if self.limit:
+            self.put_bytes(encode_varuints(values))
+        else:
+            encode_varuints(values, self.writable())
 
     def put_varint(self, value):
         if value < 0:
@@ -211,6 +382,6 @@ class FDBinary:
         self.put_varuint(zig_zag)
 
     def put_string(self, string):
-        buffer = list(string.encode('utf-8'))
+        buffer = string.encode('utf-8')
         self.put_varuint(len(buffer))
         self.put_bytes(buffer)
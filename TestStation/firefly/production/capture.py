@@ -0,0 +1,163 @@
+import struct
+import threading
+import time
+from .transport import Transport
+
+
+# Capture file: the magic, then one record per report.  Each record is the direction (0 written by the host, 1 read
+# by the host), the microseconds since the previous record (uint32, saturating) and the report length (uint16),
+# followed by the report itself.
+captureMagic = b'FDCAP\x00\x00\x01'
+captureRecord = struct.Struct('<BIH')
+
+directionWrite = 0
+directionRead = 1
+
+
+class CaptureWriter:
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(captureMagic)
+        self.lock = threading.Lock()
+        self.time = time.monotonic()
+
+    def record(self, direction, report):
+        with self.lock:
+            now = time.monotonic()
+            delta = min(int((now - self.time) * 1e6), 0xffffffff)
+            self.time = now
+            self.file.write(captureRecord.pack(direction, delta, len(report)))
+            self.file.write(report)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+# Returns the records of a capture file as (direction, seconds since the first record, report) tuples.
+def read_capture(path):
+    with open(path, 'rb') as file:
+        data = file.read()
+    if data[0:len(captureMagic)] != captureMagic:
+        raise IOError(f'{path} is not a capture file')
+    records = []
+    index = len(captureMagic)
+    seconds = 0.0
+    while index < len(data):
+        if index + captureRecord.size > len(data):
+            raise IOError('truncated capture')
+        direction, delta, length = captureRecord.unpack_from(data, index)
+        index += captureRecord.size
+        if index + length > len(data):
+            raise IOError('truncated capture')
+        seconds += delta / 1e6
+        records.append((direction, seconds if records else 0.0, data[index:index + length]))
+        index += length
+    return records
+
+
+# Passes reports through to another transport, recording each one written and read to a capture file.
+class RecordingTransport(Transport):
+
+    def __init__(self, transport, path):
+        self.transport = transport
+        self.writer = CaptureWriter(path)
+
+    def write_report(self, report):
+        self.writer.record(directionWrite, report)
+        self.transport.write_report(report)
+
+    def read_report(self, timeout=None):
+        report = self.transport.read_report(timeout)
+        if report is not None:
+            self.writer.record(directionRead, report)
+        return report
+
+    def fileno(self):
+        return self.transport.fileno()
+
+    def identity(self):
+        return self.transport.identity()
+
+    def close(self):
+        self.transport.close()
+        self.writer.close()
+
+
+# Plays back the reports read in a capture.  Each one becomes available once the host has written as many reports as
+# it had when the report was captured, after the same delay (times scale, at most max_gap seconds) that followed the
+# record before it.  A scale of 0 replays without any delays.  With check set, the reports written are compared
+# to the capture.
+class ReplayTransport(Transport):
+
+    def __init__(self, records, scale=1.0, max_gap=None, check=False):
+        if isinstance(records, str):
+            records = read_capture(records)
+        self.scale = scale
+        self.max_gap = max_gap
+        self.check = check
+        self.written = [report for direction, _, report in records if direction == directionWrite]
+        # for each report read: (reports written before it, delay after the previous record, report)
+        self.reads = []
+        writes = 0
+        previous = 0.0
+        for direction, seconds, report in records:
+            if direction == directionWrite:
+                writes += 1
+            else:
+                self.reads.append((writes, seconds - previous, report))
+            previous = seconds
+        self.condition = threading.Condition()
+        self.reports_written = 0
+        self.reports_read = 0
+        self.time = time.monotonic()
+
+    def delay(self, gap):
+        delay = gap * self.scale
+        if (self.max_gap is not None) and (delay > self.max_gap):
+            delay = self.max_gap
+        return delay
+
+    def write_report(self, report):
+        with self.condition:
+            if self.check:
+                if self.reports_written >= len(self.written):
+                    raise IOError('report written past the end of the capture')
+                if bytes(report) != self.written[self.reports_written]:
+                    raise IOError(f'report {self.reports_written} differs from the capture')
+            self.reports_written += 1
+            self.time = time.monotonic()
+            self.condition.notify_all()
+
+    def read_report(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            if self.reports_read >= len(self.reads):
+                raise IOError('end of capture')
+            writes, gap, report = self.reads[self.reports_read]
+            while self.reports_written < writes:
+                if deadline is None:
+                    self.condition.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    self.condition.wait(remaining)
+            ready_time = self.time + self.delay(gap)
+            if (deadline is not None) and (ready_time > deadline):
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+                return None
+            self.reports_read += 1
+            self.time = max(ready_time, time.monotonic())
+        delay = ready_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return report
+
+    def close(self):
+        pass
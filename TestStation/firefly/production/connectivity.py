@@ -0,0 +1,115 @@
+from collections import namedtuple
+from .binary import numpy
+from .gpio import GpioBank
+from .instruments import GpioInstrument
+from .instruments import SerialWireDebugBatch
+
+
+ConnectivityFault = namedtuple('ConnectivityFault', ['kind', 'nets'])
+ConnectivityResult = namedtuple('ConnectivityResult', ['passed', 'faults', 'steps', 'observed'])
+
+
+# The code each of count nets drives over the steps of a test: a counting ('binary') or 'gray' code that is never
+# all zeros or all ones (followed by its complement, so every net is seen both low and high), or 'walking' ones.
+# Returns the codes and the number of steps.
+def connectivity_codes(count, kind='binary'):
+    if kind == 'walking':
+        return [1 << index for index in range(count)], count
+    width = (count + 1).bit_length()
+    if kind == 'binary':
+        codes = [index + 1 for index in range(count)]
+    elif kind == 'gray':
+        codes = [(index + 1) ^ ((index + 1) >> 1) for index in range(count)]
+    else:
+        raise IOError(f"unknown connectivity pattern {kind}")
+    ones = (1 << width) - 1
+    return [code | ((code ^ ones) << width) for code in codes], 2 * width
+
+
+# The mask of nets driven high at each step.
+def connectivity_patterns(codes, steps):
+    return [sum(1 << net for net, code in enumerate(codes) if (code >> step) & 1) for step in range(steps)]
+
+
+# Transposes the mask read at each step into the code each net was seen with.
+def connectivity_signatures(masks, count):
+    if (numpy is not None) and (count <= 64) and (len(masks) <= 64):
+        steps = numpy.array(masks, dtype=numpy.uint64)
+        bits = (steps[:, None] >> numpy.arange(count, dtype=numpy.uint64)) & numpy.uint64(1)
+        weights = numpy.left_shift(numpy.uint64(1), numpy.arange(len(masks), dtype=numpy.uint64))
+        return [int(signature) for signature in (bits * weights[:, None]).sum(axis=0, dtype=numpy.uint64)]
+    signatures = [0] * count
+    for step, mask in enumerate(masks):
+        for net in range(count):
+            if (mask >> net) & 1:
+                signatures[net] |= 1 << step
+    return signatures
+
+
+# Compares the codes seen with the codes driven: a net seen always low or always high is stuck (or open, depending
+# on the pull), nets seen with the same wrong code or with the code of a net that reads correctly are shorted together,
+# and two nets seen with each other's codes are swapped.
+def connectivity_faults(codes, steps, signatures, names):
+    ones = (1 << steps) - 1
+    net_by_code = {code: net for net, code in enumerate(codes)}
+    faults = []
+    shorted = {}
+    for net, (code, signature) in enumerate(zip(codes, signatures)):
+        if signature == code:
+            continue
+        if signature == 0:
+            faults.append(ConnectivityFault('stuck low', [names[net]]))
+        elif signature == ones:
+            faults.append(ConnectivityFault('stuck high', [names[net]]))
+        elif signature in net_by_code:
+            other = net_by_code[signature]
+            if signatures[other] == codes[net]:
+                if net < other:
+                    faults.append(ConnectivityFault('swapped', [names[net], names[other]]))
+            else:
+                # the other net drove this one as well
+                faults.append(ConnectivityFault('shorted', [names[net], names[other]]))
+        else:
+            shorted.setdefault(signature, []).append(names[net])
+    for nets in shorted.values():
+        faults.append(ConnectivityFault('shorted' if len(nets) > 1 else 'unexpected', nets))
+    return faults
+
+
+# Checks the wiring from DUT ios to fixture gpios.  nets is a list of (SOC.IO, fixture gpio name).  The DUT drives
+# every net at each step (through one serial wire transfer, writing only the nets that change) and the fixture reads
+# them all in one exchange, so a binary or gray test takes 2 * ceil(log2(N + 2)) steps for N nets.
+class ConnectivityTest:
+
+    def __init__(self, soc, manager, gpio_instrument_by_name, nets, kind='binary'):
+        self.soc = soc
+        self.nets = nets
+        self.names = [name for _, name in nets]
+        self.bank = GpioBank(manager, [gpio_instrument_by_name[name] for name in self.names], self.names)
+        self.codes, self.steps = connectivity_codes(len(nets), kind)
+        self.patterns = connectivity_patterns(self.codes, self.steps)
+
+    def run(self):
+        self.bank.configure(direction=GpioInstrument.Direction.input, pull=GpioInstrument.Pull.down)
+        observed = []
+        previous = None
+        for pattern in self.patterns:
+            transactions = SerialWireDebugBatch()
+            for net, (io, _) in enumerate(self.nets):
+                value = bool((pattern >> net) & 1)
+                if previous is None:
+                    self.soc.append_configure_output_transactions(transactions, io, value)
+                elif value != bool((previous >> net) & 1):
+                    self.soc.append_set_output_transactions(transactions, io, value)
+            if transactions:
+                self.soc.serial_wire_instrument.transfer(transactions)
+            observed.append(self.bank.read())
+            previous = pattern
+        transactions = SerialWireDebugBatch()
+        for io, _ in self.nets:
+            self.soc.append_configure_default_transactions(transactions, io)
+        self.soc.serial_wire_instrument.transfer(transactions)
+        self.bank.configure()
+        signatures = connectivity_signatures(observed, len(self.nets))
+        faults = connectivity_faults(self.codes, self.steps, signatures, self.names)
+        return ConnectivityResult(not faults, faults, self.steps, observed)
@@ -0,0 +1,54 @@
+import json
+import os
+from collections import namedtuple
+
+
+# digest is the sha1 (hex) of the discovery response, instruments a list of (category, identifier)
+DiscoveryEntry = namedtuple('DiscoveryEntry', ['digest', 'instruments'])
+
+
+# Discovery results kept in a json file, keyed by the identity of the transport (device serial number or path).
+class DiscoveryCache:
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = None
+
+    def load(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        try:
+            with open(self.path) as file:
+                content = json.load(file)
+        except (OSError, ValueError):
+            return
+        for key, value in content.items():
+            instruments = [(category, identifier) for category, identifier in value['instruments']]
+            self.entries[key] = DiscoveryEntry(value['digest'], instruments)
+
+    def save(self):
+        content = {}
+        for key, entry in self.entries.items():
+            content[key] = {'digest': entry.digest, 'instruments': [list(item) for item in entry.instruments]}
+        # write a new file and rename it over the old one, so an interrupted save never leaves a partial cache
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(content, file)
+        os.replace(temporary, self.path)
+
+    def get(self, key):
+        self.load()
+        return self.entries.get(key)
+
+    def put(self, key, entry):
+        self.load()
+        if self.entries.get(key) == entry:
+            return
+        self.entries[key] = entry
+        self.save()
+
+    def remove(self, key):
+        self.load()
+        if self.entries.pop(key, None) is not None:
+            self.save()
@@ -0,0 +1,92 @@
+from .instruments import GpioInstrument
+
+
+# A group of gpio instruments read, driven and configured together.  Bit i of a mask is the pin instruments[i], and
+# each operation sends one packet per pin in a single frame (so a whole bank takes one exchange, not one per pin).
+class GpioBank:
+
+    def __init__(self, manager, instruments, names=None):
+        self.manager = manager
+        self.instruments = list(instruments)
+        self.names = list(names) if names is not None else [str(instrument.identifier) for instrument in instruments]
+        self.all = (1 << len(self.instruments)) - 1
+        api = GpioInstrument.apiGetDigitalInput
+        self.read_calls = [
+            (instrument.identifier, api.type, api.arguments.encode(()), api.results.decode)
+            for instrument in self.instruments
+        ]
+        api = GpioInstrument.apiGetAnalogInput
+        self.read_analog_calls = [
+            (instrument.identifier, api.type, api.arguments.encode(()), api.results.decode)
+            for instrument in self.instruments
+        ]
+
+    def __len__(self):
+        return len(self.instruments)
+
+    def bit(self, name):
+        return 1 << self.names.index(name)
+
+    def mask(self, names):
+        mask = 0
+        for name in names:
+            mask |= self.bit(name)
+        return mask
+
+    # The pins whose names start with prefix (such as 'IOA', 'DIO' or 'IOR') as a bank of their own.
+    def port(self, prefix):
+        pins = [(instrument, name) for instrument, name in zip(self.instruments, self.names) if name.startswith(prefix)]
+        return GpioBank(self.manager, [pin[0] for pin in pins], [pin[1] for pin in pins])
+
+    def selected(self, pins):
+        if pins is None:
+            pins = self.all
+        return [(index, instrument) for index, instrument in enumerate(self.instruments) if pins & (1 << index)]
+
+    def read(self):
+        futures = self.manager.call_batch(self.read_calls)
+        mask = 0
+        for index, future in enumerate(futures):
+            if future.result().value:
+                mask |= 1 << index
+        return mask
+
+    def read_analog(self):
+        futures = self.manager.call_batch(self.read_analog_calls)
+        return [future.result().value for future in futures]
+
+    # Drives the pins selected by pins (all when None) to the matching bits of mask.
+    def write(self, mask, pins=None):
+        api = GpioInstrument.apiSetDigitalOutput
+        self.manager.write_batch([
+            (instrument.identifier, api.type, api.arguments.encode((bool(mask & (1 << index)),)))
+            for index, instrument in self.selected(pins)
+        ])
+
+    def configure(
+        self, domain=GpioInstrument.Domain.digital, direction=GpioInstrument.Direction.input,
+        drive=GpioInstrument.Drive.push_pull, pull=GpioInstrument.Pull.none, pins=None
+    ):
+        api = GpioInstrument.apiSetConfiguration
+        values = (domain.value, direction.value, drive.value, pull.value)
+        content = api.arguments.encode(values)
+        packets = []
+        written = []
+        for _, instrument in self.selected(pins):
+            # pins whose shadow shows the configuration already set are left alone
+            if (instrument.shadow is not None) and (instrument.shadow.get(api.type) == values):
+                continue
+            packets.append((instrument.identifier, api.type, content))
+            written.append(instrument)
+        if packets:
+            self.manager.write_batch(packets)
+        # only once the batch is written, so a failed write leaves the shadows as they were
+        for instrument in written:
+            instrument.update_shadow(api.type, values)
+
+    def reset(self):
+        for instrument in self.instruments:
+            instrument.invalidate_shadow()
+        self.manager.write_batch(
+            [(instrument.identifier, GpioInstrument.apiTypeReset, b'') for instrument in self.instruments]
+        )
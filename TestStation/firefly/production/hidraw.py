@@ -0,0 +1,169 @@
+import fcntl
+import os
+import select
+import struct
+from .transport import Transport
+from .transport import outputReportId
+
+
+# ioctls from linux/hidraw.h: _IOR('H', 0x01, int) and _IOR('H', 0x02, struct hidraw_report_descriptor)
+hidiocgrdescsize = 0x80044801
+hidiocgrdesc = 0x90044802
+hidMaxDescriptorSize = 4096
+
+
+# The report IDs in effect at the first Input and the first Output main items of a HID report descriptor, each 0 when
+# the descriptor has no report IDs (None when it has no such report).
+def descriptor_report_ids(descriptor):
+    report_id = 0
+    input_report_id = None
+    output_report_id = None
+    index = 0
+    while index < len(descriptor):
+        prefix = descriptor[index]
+        if prefix == 0xfe:
+            # long item: data size, long item tag, then the data
+            index += 3 + (descriptor[index + 1] if index + 1 < len(descriptor) else 0)
+            continue
+        size = (0, 1, 2, 4)[prefix & 0x03]
+        tag = prefix & 0xfc
+        data = int.from_bytes(bytes(descriptor[index + 1:index + 1 + size]), 'little')
+        if tag == 0x84:
+            report_id = data
+        elif (tag == 0x80) and (input_report_id is None):
+            input_report_id = report_id
+        elif (tag == 0x90) and (output_report_id is None):
+            output_report_id = report_id
+        index += 1 + size
+    return input_report_id, output_report_id
+
+
+class HidrawDevice:
+
+    def __init__(self):
+        self.path = None
+        self.bus = None
+        self.vendor_id = None
+        self.product_id = None
+        self.name = None
+        self.serial = None
+
+
+# Linux HID transport using /dev/hidraw* directly: reports are read from a non blocking file descriptor
+# (waiting with poll) on the calling thread, so there is no reader thread or queue between the device and the caller.
+class HidrawTransport(Transport):
+
+    sysfs_path = '/sys/class/hidraw'
+
+    # report_id is the report number written in front of each output report (0 for devices without numbered
+    # reports), and input_report_id says whether reads start with a report number (hidraw adds one when the input
+    # report is numbered).  When None they are taken from the device's report descriptor, so they match what the
+    # firmware declares.  If the descriptor can not be read they are outputReportId, the number the macOS transport
+    # writes with, and a numbered input report to match.
+    def __init__(self, path, report_size=64, report_id=None, serial=None, input_report_id=None):
+        self.path = path
+        self.serial = serial
+        self.report_size = report_size
+        self.fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+        if (report_id is None) or (input_report_id is None):
+            input_id, output_id = HidrawTransport.descriptor_report_ids(self.fd)
+            report_id = output_id if report_id is None else report_id
+            input_report_id = input_id if input_report_id is None else input_report_id
+        self.input_report_id = input_report_id
+        self.poll = select.poll()
+        self.poll.register(self.fd, select.POLLIN)
+        # hidraw takes the report number and the report in a single write, so they share one preallocated buffer
+        self.output = bytearray(1 + report_size)
+        self.output[0] = report_id
+
+    @staticmethod
+    def read_descriptor(fd):
+        size = bytearray(4)
+        fcntl.ioctl(fd, hidiocgrdescsize, size)
+        (length,) = struct.unpack('<I', size)
+        buffer = bytearray(struct.pack('<I', length) + bytes(hidMaxDescriptorSize))
+        fcntl.ioctl(fd, hidiocgrdesc, buffer)
+        return bytes(buffer[4:4 + length])
+
+    @staticmethod
+    def descriptor_report_ids(fd):
+        try:
+            input_report_id, output_report_id = descriptor_report_ids(HidrawTransport.read_descriptor(fd))
+        except OSError:
+            input_report_id, output_report_id = None, None
+        if input_report_id is None:
+            input_report_id = outputReportId
+        if output_report_id is None:
+            output_report_id = outputReportId
+        return input_report_id, output_report_id
+
+    @staticmethod
+    def enumerate():
+        devices = []
+        if not os.path.isdir(HidrawTransport.sysfs_path):
+            return devices
+        for name in sorted(os.listdir(HidrawTransport.sysfs_path)):
+            try:
+                with open(os.path.join(HidrawTransport.sysfs_path, name, 'device', 'uevent')) as file:
+                    lines = file.read().splitlines()
+            except OSError:
+                continue
+            device = HidrawDevice()
+            device.path = os.path.join('/dev', name)
+            for line in lines:
+                key, _, value = line.partition('=')
+                if key == 'HID_ID':
+                    bus, vendor_id, product_id = value.split(':')
+                    device.bus = int(bus, 16)
+                    device.vendor_id = int(vendor_id, 16)
+                    device.product_id = int(product_id, 16)
+                elif key == 'HID_NAME':
+                    device.name = value
+                elif key == 'HID_UNIQ':
+                    device.serial = value
+            devices.append(device)
+        return devices
+
+    @staticmethod
+    def open(vendor_id, product_id, serial=None):
+        for device in HidrawTransport.enumerate():
+            if (device.vendor_id == vendor_id) and (device.product_id == product_id):
+                if (serial is None) or (device.serial == serial):
+                    return HidrawTransport(device.path, serial=device.serial)
+        raise IOError('Device not found')
+
+    def write_report(self, report):
+        length = len(report)
+        if length > self.report_size:
+            raise IOError('report too long')
+        output = self.output
+        output[1:1 + length] = report
+        if length < self.report_size:
+            output[1 + length:] = bytes(self.report_size - length)
+        os.write(self.fd, output)
+
+    def read_report(self, timeout=None):
+        milliseconds = None if timeout is None else int(timeout * 1000)
+        while True:
+            try:
+                if self.input_report_id:
+                    return os.read(self.fd, 1 + self.report_size)[1:]
+                return os.read(self.fd, self.report_size)
+            except BlockingIOError:
+                pass
+            if not self.poll.poll(milliseconds):
+                return None
+
+    def fileno(self):
+        return self.fd
+
+    def identity(self):
+        if self.serial:
+            return f'hidraw:{self.serial}'
+        return f'hidraw:{self.path}'
+
+    def close(self):
+        if self.fd is not None:
+            self.poll.unregister(self.fd)
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,124 @@
+import math
+from collections import deque
+from collections import namedtuple
+from statistics import NormalDist
+from .snapshot import snapshotConversions
+
+
+# Running mean and variance (Welford), updated one sample at a time.
+class RunningStatistics:
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+    def standard_deviation(self):
+        return math.sqrt(self.variance())
+
+    def standard_error(self):
+        if self.count == 0:
+            return math.inf
+        return self.standard_deviation() / math.sqrt(self.count)
+
+
+MeasurementResult = namedtuple('MeasurementResult', [
+    'mean', 'standard_deviation', 'half_width', 'count', 'rejected', 'converged'
+])
+
+
+# Adds samples until the mean is known well enough: the confidence interval (mean +/- half_width) is entirely inside
+# or entirely outside [low, high] (so the pass/fail decision can not change), or half_width is within tolerance.
+# Once min_samples are in, samples more than outlier_sigma standard deviations (and more than outlier_floor, which
+# defaults to tolerance) from the mean are rejected.  Nothing is rejected while that distance is 0, such as after
+# identical samples.  The interval uses the normal distribution, so min_samples should not be too small.
+# Only accepted samples count toward max_samples; the measurement also stops once max_samples have been rejected.
+class AdaptiveMeasurement:
+
+    def __init__(
+        self, low=None, high=None, tolerance=None, confidence=0.95, min_samples=16, max_samples=1000,
+        outlier_sigma=None, outlier_floor=None
+    ):
+        self.low = low
+        self.high = high
+        self.tolerance = tolerance
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.outlier_sigma = outlier_sigma
+        self.outlier_floor = outlier_floor if outlier_floor is not None else (tolerance or 0.0)
+        self.statistics = RunningStatistics()
+        self.rejected = 0
+        self.converged = False
+
+    def half_width(self):
+        return self.z * self.statistics.standard_error()
+
+    def decided(self):
+        statistics = self.statistics
+        if statistics.count < self.min_samples:
+            return False
+        half_width = self.half_width()
+        if (self.tolerance is not None) and (half_width <= self.tolerance):
+            return True
+        if (self.low is None) and (self.high is None):
+            return False
+        lower = statistics.mean - half_width
+        upper = statistics.mean + half_width
+        if (self.low is not None) and (upper < self.low):
+            return True
+        if (self.high is not None) and (lower > self.high):
+            return True
+        return ((self.low is None) or (lower >= self.low)) and ((self.high is None) or (upper <= self.high))
+
+    # Adds the value unless it is an outlier, returning whether it was added.
+    def accept(self, value):
+        statistics = self.statistics
+        if (self.outlier_sigma is not None) and (statistics.count >= self.min_samples):
+            distance = max(self.outlier_sigma * statistics.standard_deviation(), self.outlier_floor)
+            if (distance > 0) and (abs(value - statistics.mean) > distance):
+                self.rejected += 1
+                return False
+        statistics.add(value)
+        return True
+
+    # Returns True once the measurement is done (decided, or max_samples accepted or rejected).
+    def add(self, value):
+        if self.accept(value) and self.decided():
+            self.converged = True
+            return True
+        return (self.statistics.count >= self.max_samples) or (self.rejected >= self.max_samples)
+
+    def result(self):
+        statistics = self.statistics
+        return MeasurementResult(
+            statistics.mean, statistics.standard_deviation(), self.half_width(), statistics.count, self.rejected,
+            self.converged
+        )
+
+
+# Measures a Current, Battery or Voltage instrument, keeping the manager's pipeline of conversions full until the
+# measurement is done.  The conversions still in flight then are added too.  Takes the AdaptiveMeasurement options.
+def measure(instrument, **options):
+    api, field = snapshotConversions[type(instrument)]
+    measurement = AdaptiveMeasurement(**options)
+    in_flight = deque()
+    done = False
+    while not done:
+        while len(in_flight) < instrument.manager.pipeline_depth:
+            in_flight.append(instrument.call_api_pipelined(api))
+        done = measurement.add(getattr(in_flight.popleft().result(), field))
+    while in_flight:
+        measurement.accept(getattr(in_flight.popleft().result(), field))
+    return measurement.result()
@@ -0,0 +1,152 @@
+import math
+import sys
+import threading
+import time
+from collections import namedtuple
+
+
+# Latency histogram with four buckets per octave starting at one microsecond (each bucket is about 19% wide), so
+# recording is one log2 and percentiles are read back as the upper edge of the bucket they fall in.
+class Histogram:
+
+    buckets_per_octave = 4
+    bucket_count = 4 * 32
+
+    def __init__(self):
+        self.counts = [0] * Histogram.bucket_count
+
+    def record(self, seconds):
+        microseconds = seconds * 1e6
+        if microseconds <= 1.0:
+            index = 0
+        else:
+            index = min(int(math.log2(microseconds) * Histogram.buckets_per_octave), Histogram.bucket_count - 1)
+        self.counts[index] += 1
+
+    def percentile(self, fraction):
+        total = sum(self.counts)
+        if total == 0:
+            return 0.0
+        threshold = fraction * total
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return 2.0 ** ((index + 1) / Histogram.buckets_per_octave) / 1e6
+        return 2.0 ** (Histogram.bucket_count / Histogram.buckets_per_octave) / 1e6
+
+
+class ApiMetrics:
+
+    def __init__(self):
+        self.count = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.reports_sent = 0
+        self.reports_received = 0
+        self.seconds = 0.0
+        self.histogram = Histogram()
+
+
+ApiSnapshot = namedtuple('ApiSnapshot', [
+    'category', 'kind', 'api', 'count', 'bytes_sent', 'bytes_received', 'reports_sent', 'reports_received',
+    'seconds', 'fraction', 'p50', 'p95', 'p99'
+])
+
+
+# Counts, bytes, reports and latency per (instrument category, 'write' or 'call', api).  The manager only records
+# when metrics are enabled (InstrumentManager.enable_metrics), otherwise the cost is one attribute check per packet.
+class Metrics:
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.lock = threading.Lock()
+        self.apis = {}
+        self.dump_timer = None
+
+    def clear(self):
+        with self.lock:
+            self.apis = {}
+
+    def record(self, kind, identifier, api, bytes_sent, bytes_received, reports_sent, reports_received, seconds):
+        key = (kind, identifier, api)
+        with self.lock:
+            metrics = self.apis.get(key)
+            if metrics is None:
+                metrics = ApiMetrics()
+                self.apis[key] = metrics
+            metrics.count += 1
+            metrics.bytes_sent += bytes_sent
+            metrics.bytes_received += bytes_received
+            metrics.reports_sent += reports_sent
+            metrics.reports_received += reports_received
+            metrics.seconds += seconds
+            metrics.histogram.record(seconds)
+
+    # Totals per (category, kind, api), merging instruments of the same category, busiest first.
+    def snapshot(self):
+        merged = {}
+        with self.lock:
+            for (kind, identifier, api), metrics in self.apis.items():
+                category = self.manager.get_category(identifier)
+                key = (category, kind, self.manager.get_api_name(identifier, api))
+                total = merged.get(key)
+                if total is None:
+                    total = ApiMetrics()
+                    merged[key] = total
+                total.count += metrics.count
+                total.bytes_sent += metrics.bytes_sent
+                total.bytes_received += metrics.bytes_received
+                total.reports_sent += metrics.reports_sent
+                total.reports_received += metrics.reports_received
+                total.seconds += metrics.seconds
+                total.histogram.counts = [a + b for a, b in zip(total.histogram.counts, metrics.histogram.counts)]
+        seconds = sum(metrics.seconds for metrics in merged.values())
+        snapshots = []
+        for (category, kind, api), metrics in merged.items():
+            snapshots.append(ApiSnapshot(
+                category, kind, api, metrics.count, metrics.bytes_sent, metrics.bytes_received,
+                metrics.reports_sent, metrics.reports_received, metrics.seconds,
+                metrics.seconds / seconds if seconds > 0 else 0.0,
+                metrics.histogram.percentile(0.50), metrics.histogram.percentile(0.95),
+                metrics.histogram.percentile(0.99)
+            ))
+        snapshots.sort(key=lambda snapshot: snapshot.seconds, reverse=True)
+        return snapshots
+
+    def format(self):
+        lines = [
+            f"{'category':<12} {'kind':<5} {'api':<32} {'count':>8} {'sent':>10} {'received':>10} {'reports':>9}"
+            f" {'time':>9} {'share':>6} {'p50':>9} {'p95':>9} {'p99':>9}"
+        ]
+        for snapshot in self.snapshot():
+            lines.append(
+                f"{snapshot.category:<12} {snapshot.kind:<5} {snapshot.api:<32} {snapshot.count:>8}"
+                f" {snapshot.bytes_sent:>10} {snapshot.bytes_received:>10}"
+                f" {snapshot.reports_sent + snapshot.reports_received:>9}"
+                f" {snapshot.seconds:>8.3f}s {snapshot.fraction * 100:>5.1f}%"
+                f" {snapshot.p50 * 1e3:>7.3f}ms {snapshot.p95 * 1e3:>7.3f}ms {snapshot.p99 * 1e3:>7.3f}ms"
+            )
+        return '\n'.join(lines)
+
+    def dump(self, file=None):
+        file = file if file is not None else sys.stdout
+        print(time.strftime('%Y-%m-%d %H:%M:%S'), file=file)
+        print(self.format(), file=file)
+        file.flush()
+
+    def start_dump(self, interval=10.0, file=None):
+        self.stop_dump()
+
+        def dump():
+            self.dump(file)
+            self.start_dump(interval, file)
+
+        self.dump_timer = threading.Timer(interval, dump)
+        self.dump_timer.daemon = True
+        self.dump_timer.start()
+
+    def stop_dump(self):
+        if self.dump_timer is not None:
+            self.dump_timer.cancel()
+            self.dump_timer = None
@@ -0,0 +1,164 @@
+import time
+from collections import namedtuple
+from .instruments import BatteryInstrument
+from .instruments import RelayInstrument
+from .snapshot import Snapshot
+
+
+# A check of a snapshot channel (voltage_battery, voltage_supercap, current_usb or current_battery) against limits.
+PowerCheck = namedtuple('PowerCheck', ['channel', 'low', 'high'])
+
+PowerStepResult = namedtuple('PowerStepResult', ['state', 'record', 'failures'])
+PowerPlanResult = namedtuple('PowerPlanResult', ['passed', 'steps', 'elapsed'])
+
+# Relay settings (fixture relay names without the relay_ prefix) that power the DUT each way.
+powerModes = {
+    'off': {'vusb_to_dut': False, 'battery_to_dut': False, 'supercap_to_dut': False},
+    'usb': {'vusb_to_dut': True, 'battery_to_dut': False, 'supercap_to_dut': False},
+    'battery': {'vusb_to_dut': False, 'battery_to_dut': True, 'supercap_to_dut': False},
+    'supercap': {'vusb_to_dut': False, 'battery_to_dut': False, 'supercap_to_dut': True},
+}
+
+
+# One state of a power plan: the relays to set (name: closed), the battery voltage and enable (None leaves them as
+# they are), how long to let it settle, and the checks to make once settled.
+class PowerState:
+
+    def __init__(self, relays=None, battery_voltage=None, battery_enabled=None, settle=0.0, checks=()):
+        self.relays = dict(relays) if relays is not None else {}
+        self.battery_voltage = battery_voltage
+        self.battery_enabled = battery_enabled
+        self.settle = settle
+        self.checks = list(checks)
+
+    @staticmethod
+    def mode(name, settle=0.0, checks=(), **options):
+        return PowerState(powerModes[name], settle=settle, checks=checks, **options)
+
+
+# A step of a compiled plan: the packets written together in one frame, the time to settle after them, and the
+# checks (with their state) to start once settled.
+class PowerStep:
+
+    def __init__(self):
+        self.writes = []
+        self.settle = 0.0
+        self.snapshot = None
+        self.checks = []
+        self.state = None
+
+
+# Runs a list of PowerStates on a fixture.  States are compiled into as few steps as possible: each state's writes
+# (relays opened before any are closed) go out in a single frame, states without settle time or checks are merged
+# into the next state's frame, and settle times with nothing written in between add up.  The checks of a state are
+# written once it has settled and are collected while the next state settles.
+class PowerPlan:
+
+    def __init__(self, fixture, states):
+        self.fixture = fixture
+        self.states = list(states)
+        self.steps = self.compile()
+
+    def relay(self, name):
+        relay = getattr(self.fixture, f'relay_{name}', None)
+        if relay is None:
+            raise IOError(f"unknown relay {name}")
+        return relay
+
+    # Returns the writes for a state, each (instrument, api type, values, content, shadowed).
+    def writes(self, state):
+        writes = []
+        # open relays first so nothing is connected to two supplies at once
+        for name, closed in sorted(state.relays.items(), key=lambda item: item[1]):
+            values = (bool(closed),)
+            content = RelayInstrument.apiSetState.arguments.encode(values)
+            writes.append((self.relay(name), RelayInstrument.apiTypeSetState, values, content, True))
+        battery = self.fixture.battery_instrument
+        if state.battery_voltage is not None:
+            values = (state.battery_voltage,)
+            content = BatteryInstrument.apiSetVoltage.arguments.encode(values)
+            writes.append((battery, BatteryInstrument.apiTypeSetVoltage, values, content, False))
+        if state.battery_enabled is not None:
+            values = (state.battery_enabled,)
+            content = BatteryInstrument.apiSetEnabled.arguments.encode(values)
+            writes.append((battery, BatteryInstrument.apiTypeSetEnabled, values, content, False))
+        return writes
+
+    def compile(self):
+        steps = []
+        step = PowerStep()
+        for state in self.states:
+            writes = self.writes(state)
+            if writes and (step.settle > 0):
+                steps.append(step)
+                step = PowerStep()
+            step.writes.extend(writes)
+            step.settle += state.settle
+            step.state = state
+            if state.checks:
+                channels = sorted(set(check.channel for check in state.checks))
+                step.snapshot = self.fixture_snapshot(channels)
+                step.checks = state.checks
+                steps.append(step)
+                step = PowerStep()
+        if step.writes or (step.settle > 0):
+            steps.append(step)
+        return steps
+
+    def fixture_snapshot(self, channels):
+        fixture = self.fixture
+        instruments = {
+            'voltage_battery': fixture.voltage_battery_instrument,
+            'voltage_supercap': fixture.voltage_supercap_instrument,
+            'current_usb': fixture.current_usb_instrument,
+            'current_battery': fixture.battery_instrument,
+        }
+        return Snapshot(fixture.manager, [(channel, instruments[channel]) for channel in channels])
+
+    @staticmethod
+    def evaluate(step, record):
+        failures = []
+        for check in step.checks:
+            value = getattr(record, check.channel)
+            if ((check.low is not None) and (value < check.low)) or ((check.high is not None) and (value > check.high)):
+                failures.append((check, value))
+        return PowerStepResult(step.state, record, failures)
+
+    def write(self, step):
+        packets = []
+        written = []
+        for instrument, api, values, content, shadowed in step.writes:
+            if shadowed:
+                # relays whose shadow (see Instrument.set_shadowing) shows them already set are skipped
+                if (instrument.shadow is not None) and (instrument.shadow.get(api) == values):
+                    continue
+                written.append((instrument, api, values))
+            packets.append((instrument.identifier, api, content))
+        if packets:
+            self.fixture.manager.write_batch(packets)
+        # only once the batch is written, so a failed write leaves the shadows as they were
+        for instrument, api, values in written:
+            instrument.update_shadow(api, values)
+
+    def run(self):
+        start = time.monotonic()
+        results = []
+        started = None
+        for step in self.steps:
+            self.write(step)
+            deadline = time.monotonic() + step.settle
+            if started is not None:
+                # the checks of the last step come back while this one settles
+                last, snapshot_started = started
+                results.append(PowerPlan.evaluate(last, last.snapshot.finish(snapshot_started)))
+                started = None
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            if step.snapshot is not None:
+                started = (step, step.snapshot.start())
+        if started is not None:
+            last, snapshot_started = started
+            results.append(PowerPlan.evaluate(last, last.snapshot.finish(snapshot_started)))
+        passed = all(not result.failures for result in results)
+        return PowerPlanResult(passed, results, time.monotonic() - start)
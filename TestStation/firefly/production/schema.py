@@ -0,0 +1,255 @@
+import struct
+from collections import namedtuple
+from .binary import encode_varuints
+from .binary import decode_varuints
+
+
+class Type:
+
+    # struct format character for fixed width types, None for variable length types
+    format = None
+
+    # Variable length types append value to data, and return (value, index after it) from data at index.  Fixed width
+    # types are coded by the Schema's struct instead.
+    def encode(self, data, value):
+        raise NotImplementedError
+
+    def decode(self, data, index):
+        raise NotImplementedError
+
+
+class FixedType(Type):
+
+    def __init__(self, format):
+        self.format = format
+
+
+class VarUIntType(Type):
+
+    def encode(self, data, value):
+        encode_varuints((value,), data)
+
+    def decode(self, data, index):
+        values, index = decode_varuints(data, index, 1)
+        return values[0], index
+
+
+class VarIntType(Type):
+
+    def encode(self, data, value):
+        zig_zag = ((-value << 1) | 1) if value < 0 else (value << 1)
+        encode_varuints((zig_zag,), data)
+
+    def decode(self, data, index):
+        values, index = decode_varuints(data, index, 1)
+        zig_zag = values[0]
+        value = -(zig_zag >> 1) if (zig_zag & 1) != 0 else zig_zag >> 1
+        return value, index
+
+
+class StringType(Type):
+
+    def encode(self, data, value):
+        buffer = value.encode('utf-8')
+        encode_varuints((len(buffer),), data)
+        data += buffer
+
+    def decode(self, data, index):
+        values, index = decode_varuints(data, index, 1)
+        end = index + values[0]
+        if end > len(data):
+            raise IOError("string out of bounds")
+        return str(data[index:end], 'utf-8'), end
+
+
+# Raw bytes: written as is when encoding, and when decoding everything that remains (as a memoryview).
+# The length, when the protocol needs one, is a separate field.
+class RemainingType(Type):
+
+    def encode(self, data, value):
+        data.extend(value)
+
+    def decode(self, data, index):
+        return memoryview(data)[index:], len(data)
+
+
+# A varuint count then that many records of fields, decoded as a list of namedtuples.
+class RepeatedType(Type):
+
+    def __init__(self, fields):
+        self.schema = Schema(fields)
+
+    def encode(self, data, value):
+        encode_varuints((len(value),), data)
+        for record in value:
+            self.schema.encode_into(data, record)
+
+    def decode(self, data, index):
+        values, index = decode_varuints(data, index, 1)
+        records = []
+        for _ in range(values[0]):
+            record, index = self.schema.decode_from(data, index)
+            records.append(record)
+        return records, index
+
+
+uint8 = FixedType('B')
+uint16 = FixedType('H')
+uint32 = FixedType('I')
+uint64 = FixedType('Q')
+float16 = FixedType('e')
+float32 = FixedType('f')
+float64 = FixedType('d')
+boolean = FixedType('?')
+varuint = VarUIntType()
+varint = VarIntType()
+string = StringType()
+remaining = RemainingType()
+
+
+def fixed_bytes(length):
+    return FixedType(f"{length}s")
+
+
+def repeated(fields):
+    return RepeatedType(fields)
+
+
+# A Schema is a list of (name, type) fields compiled once into a list of encode and decode steps.
+# Runs of fixed width fields share one precomputed struct.Struct and runs of varuints are coded in one call.
+# Decoding returns a namedtuple with the field names.
+class Schema:
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.record = namedtuple('Record', [name for name, _ in fields])
+        self.pack = None
+        self.unpack_from = None
+        self.size = 0
+        self.encoders = []
+        self.decoders = []
+        self.compile()
+
+    @staticmethod
+    def runs(fields):
+        runs = []
+        for index, (_, type) in enumerate(fields):
+            kind = 'fixed' if type.format is not None else type
+            if runs and (runs[-1][0] == kind) and ((kind == 'fixed') or (kind is varuint)):
+                runs[-1][2] = index + 1
+            else:
+                runs.append([kind, index, index + 1])
+        return runs
+
+    def compile(self):
+        runs = Schema.runs(self.fields)
+        for kind, start, stop in runs:
+            if kind == 'fixed':
+                fixed = struct.Struct('<' + ''.join(type.format for _, type in self.fields[start:stop]))
+                self.encoders.append(Schema.fixed_encoder(fixed, start, stop))
+                self.decoders.append(Schema.fixed_decoder(fixed))
+            elif kind is varuint:
+                self.encoders.append(Schema.varuint_encoder(start, stop))
+                self.decoders.append(Schema.varuint_decoder(stop - start))
+            else:
+                self.encoders.append(Schema.type_encoder(kind, start))
+                self.decoders.append(Schema.type_decoder(kind))
+        if (len(runs) == 1) and (runs[0][0] == 'fixed'):
+            fixed = struct.Struct('<' + ''.join(type.format for _, type in self.fields))
+            self.pack = fixed.pack
+            self.unpack_from = fixed.unpack_from
+            self.size = fixed.size
+
+    @staticmethod
+    def fixed_encoder(fixed, start, stop):
+        pack = fixed.pack
+
+        def encode(data, values):
+            data += pack(*values[start:stop])
+        return encode
+
+    @staticmethod
+    def fixed_decoder(fixed):
+        unpack_from = fixed.unpack_from
+        size = fixed.size
+
+        def decode(data, index, values):
+            values.extend(unpack_from(data, index))
+            return index + size
+        return decode
+
+    @staticmethod
+    def varuint_encoder(start, stop):
+        def encode(data, values):
+            encode_varuints(values[start:stop], data)
+        return encode
+
+    @staticmethod
+    def varuint_decoder(count):
+        def decode(data, index, values):
+            decoded, index = decode_varuints(data, index, count)
+            values.extend(decoded)
+            return index
+        return decode
+
+    @staticmethod
+    def type_encoder(type, index):
+        type_encode = type.encode
+
+        def encode(data, values):
+            type_encode(data, values[index])
+        return encode
+
+    @staticmethod
+    def type_decoder(type):
+        type_decode = type.decode
+
+        def decode(data, index, values):
+            value, index = type_decode(data, index)
+            values.append(value)
+            return index
+        return decode
+
+    def encode(self, values):
+        if self.pack is not None:
+            return self.pack(*values)
+        data = bytearray()
+        for encoder in self.encoders:
+            encoder(data, values)
+        return data
+
+    def encode_into(self, data, values):
+        if self.pack is not None:
+            data += self.pack(*values)
+            return
+        for encoder in self.encoders:
+            encoder(data, values)
+
+    def decode(self, data):
+        if self.unpack_from is not None:
+            if len(data) < self.size:
+                raise IOError("response too short")
+            return self.record._make(self.unpack_from(data))
+        return self.decode_from(data, 0)[0]
+
+    # Returns the record starting at index and the index after it.
+    def decode_from(self, data, index):
+        if self.unpack_from is not None:
+            if len(data) < index + self.size:
+                raise IOError("response too short")
+            return self.record._make(self.unpack_from(data, index)), index + self.size
+        values = []
+        try:
+            for decoder in self.decoders:
+                index = decoder(data, index, values)
+        except struct.error:
+            raise IOError("response too short")
+        return self.record._make(values), index
+
+
+class Api:
+
+    def __init__(self, type, arguments=None, results=None):
+        self.type = type
+        self.arguments = Schema(arguments if arguments is not None else [])
+        self.results = Schema(results if results is not None else [])
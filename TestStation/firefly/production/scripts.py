@@ -3,10 +3,13 @@ import hashlib
 import time
 from collections import namedtuple
 from .bundle import Bundle
+from .gpio import GpioBank
 from .instruments import InstrumentManager
 from .instruments import SerialWireInstrument
+from .instruments import SerialWireDebugBatch
 from .instruments import SerialWireDebugTransfer
 from .instruments import StorageInstrument
+from .snapshot import Snapshot
 from elftools.elf.elffile import ELFFile
 from elftools.elf.constants import SH_FLAGS
 from intelhex import IntelHex
@@ -23,6 +26,8 @@ class Fixture:
         self.storage_instrument = None
         self.gpio_instruments = []
         self.gpio_instrument_by_name = {}
+        self.gpio_bank = None
+        self.gpio_ports = {}
         self.battery_instrument = None
         self.relay_sense = None
         self.relay_battery_to_dut = None
@@ -34,15 +39,34 @@ class Fixture:
         self.voltage_battery_instrument = None
         self.voltage_supercap_instrument = None
         self.current_usb_instrument = None
+        self.snapshots = {}
 
-    def setup(self):
-        self.manager = InstrumentManager()
+    # With a discovery_cache (see DiscoveryCache) a warm start builds the instruments from the cache and returns
+    # without waiting for the discovery response.  The response is checked when it is read: if the fixture's
+    # instruments changed, the cache is updated and the next call raises (see InstrumentManager.discovered).
+    def setup(self, transport=None, discovery_cache=None):
+        self.manager = InstrumentManager(transport)
         self.manager.open()
-        self.manager.discover_instruments()
+        self.manager.discover_instruments(discovery_cache)
 
-        self.indicator_instrument = self.manager.get_instrument(1)
+        try:
+            self.get_instruments()
+        except IOError:
+            # a stale cache entry can be missing instruments, so wait for the discovery response
+            if self.manager.validate_discovery():
+                raise
+            self.get_instruments()
         self.indicator_instrument.set(0.0, 0.0, 1.0)
 
+    def get_instruments(self):
+        self.snapshots = {}
+        self.indicator_instrument = self.manager.get_instrument(1)
+
+        self.serial_wire_instruments = []
+        self.voltage_serial_wire_instruments = []
+        self.gpio_instruments = []
+        self.gpio_instrument_by_name = {}
+
         self.relay_vusb_to_dut = self.manager.get_instrument(41)
         self.relay_dusb_to_dut = self.manager.get_instrument(42)
         self.relay_sense = self.manager.get_instrument(43)
@@ -99,6 +123,26 @@ class Fixture:
             name = gpio_names[index]
             self.gpio_instrument_by_name[name] = instrument
             index += 1
+        self.gpio_bank = GpioBank(self.manager, self.gpio_instruments, gpio_names)
+        self.gpio_ports = {prefix: self.gpio_bank.port(prefix) for prefix in ('IOA', 'DIO', 'IOR')}
+
+    # Reads the power rails (and the digital inputs of the named gpios) in one exchange, returning a record with time
+    # and a field for each: voltage_battery, voltage_supercap, current_usb, current_battery and the gpio names.
+    def snapshot(self, gpio_names=()):
+        key = tuple(gpio_names)
+        snapshot = self.snapshots.get(key)
+        if snapshot is None:
+            channels = [
+                ('voltage_battery', self.voltage_battery_instrument),
+                ('voltage_supercap', self.voltage_supercap_instrument),
+                ('current_usb', self.current_usb_instrument),
+                ('current_battery', self.battery_instrument),
+            ]
+            for name in gpio_names:
+                channels.append((name, self.gpio_instrument_by_name[name]))
+            snapshot = Snapshot(self.manager, channels)
+            self.snapshots[key] = snapshot
+        return snapshot.read()
 
 
 class Script:
@@ -755,7 +799,7 @@ class SOC:
         self.serial_wire_instrument = serial_wire_instrument
 
     def configure_default(self, io):
-        transactions = []
+        transactions = SerialWireDebugBatch()
         self.append_configure_default_transactions(transactions, io)
         self.serial_wire_instrument.transfer(transactions)
 
@@ -763,7 +807,7 @@ class SOC:
         raise IOError("unimplemented")
 
     def configure_output(self, io, value):
-        transactions = []
+        transactions = SerialWireDebugBatch()
         self.append_configure_output_transactions(transactions, io, value)
         self.serial_wire_instrument.transfer(transactions)
 
@@ -771,7 +815,7 @@ class SOC:
         raise IOError("unimplemented")
 
     def configure_output_open_drain(self, io, value):
-        transactions = []
+        transactions = SerialWireDebugBatch()
         self.append_configure_output_open_drain_transactions(transactions, io, value)
         self.serial_wire_instrument.transfer(transactions)
 
@@ -779,7 +823,7 @@ class SOC:
         raise IOError("unimplemented")
 
     def set_output(self, io, value):
-        transactions = []
+        transactions = SerialWireDebugBatch()
         self.append_set_output_transactions(transactions, io, value)
         self.serial_wire_instrument.transfer(transactions)
 
@@ -787,7 +831,7 @@ class SOC:
         raise IOError("unimplemented")
 
     def configure_input(self, io):
-        transactions = []
+        transactions = SerialWireDebugBatch()
         self.append_configure_input_transactions(transactions, io)
         self.serial_wire_instrument.transfer(transactions)
 
@@ -795,7 +839,7 @@ class SOC:
         raise IOError("unimplemented")
 
     def get_input(self, io):
-        transactions = []
+        transactions = SerialWireDebugBatch()
         get = self.append_get_input_transactions(transactions, io)
         self.serial_wire_instrument.transfer(transactions)
         return get()
@@ -958,13 +1002,13 @@ class KL0(SOC):
             self.pddr = self.pddr | (1 << io.pin)
         else:
             self.pddr = self.pddr & ~(1 << io.pin)
-        transactions.append(SerialWireDebugTransfer.write_memory(fgpio.r_pddr, self.pddr))
+        transactions.write_memory(fgpio.r_pddr, self.pddr)
 
         port = self.port[io.port]
         pcr = 0x00000100 if connected else 0x00000000
         if pullup:
             pcr |= 0b11
-        transactions.append(SerialWireDebugTransfer.write_memory(port.r_pcr[io.pin], pcr))
+        transactions.write_memory(port.r_pcr[io.pin], pcr)
 
     def append_configure_default_transactions(self, transactions, io):
         self.append_configure_io_transactions(transactions, io, connected=False)
@@ -979,16 +1023,15 @@ class KL0(SOC):
     def append_set_output_transactions(self, transactions, io, value):
         fgpio = self.fgpio[io.port]
         address = fgpio.r_psor if value else fgpio.r_pcor
-        transactions.append(SerialWireDebugTransfer.write_memory(address, 1 << io.pin))
+        transactions.write_memory(address, 1 << io.pin)
 
     def append_configure_input_transactions(self, transactions, io):
         self.append_configure_io_transactions(transactions, io, output=False)
 
     def append_get_input_transactions(self, transactions, io):
         fgpio = self.fgpio[io.port]
-        transaction = SerialWireDebugTransfer.read_memory(fgpio.r_pdir)
-        transactions.append(transaction)
-        return lambda: (transaction.data & (1 << io.pin)) != 0
+        index = transactions.read_memory(fgpio.r_pdir)
+        return lambda: (transactions.data[index] & (1 << io.pin)) != 0
 
 
 class NRF53(SOC):
@@ -1149,31 +1192,30 @@ class NRF53(SOC):
     def append_configure_output_transactions(self, transactions, io, value):
         p_s = self.application.p_s[io.port]
         pin_cnf = p_s.r_pin_cnf[io.pin]
-        transactions.append(SerialWireDebugTransfer.write_memory(pin_cnf, 0x00000001))
+        transactions.write_memory(pin_cnf, 0x00000001)
         self.append_set_output_transactions(transactions, io, value)
 
     def append_configure_output_open_drain_transactions(self, transactions, io, value):
         p_s = self.application.p_s[io.port]
         pin_cnf = p_s.r_pin_cnf[io.pin]
-        transactions.append(SerialWireDebugTransfer.write_memory(pin_cnf, 0x00000601))
+        transactions.write_memory(pin_cnf, 0x00000601)
         self.append_set_output_transactions(transactions, io, value)
 
     def append_set_output_transactions(self, transactions, io, value):
         p_s = self.application.p_s[io.port]
         address = p_s.r_outset if value else p_s.r_outclr
         data = 1 << io.pin
-        transactions.append(SerialWireDebugTransfer.write_memory(address, data))
+        transactions.write_memory(address, data)
 
     def append_configure_input_transactions(self, transactions, io):
         p_s = self.application.p_s[io.port]
         pin_cnf = p_s.r_pin_cnf[io.pin]
-        transactions.append(SerialWireDebugTransfer.write_memory(pin_cnf, 0x00000000))
+        transactions.write_memory(pin_cnf, 0x00000000)
 
     def append_get_input_transactions(self, transactions, io):
         p_s = self.application.p_s[io.port]
-        transaction = SerialWireDebugTransfer.read_memory(p_s.r_in)
-        transactions.append(transaction)
-        return lambda: (transaction.data & (1 << io.pin)) != 0
+        index = transactions.read_memory(p_s.r_in)
+        return lambda: (transactions.data[index] & (1 << io.pin)) != 0
 
     def read_events_lfclkstarted(self):
         clock_s = self.application.clock_s
@@ -1312,7 +1354,7 @@ class I2CM:
             self.delay()
 
     def start(self):
-        transactions = []
+        transactions = SerialWireDebugBatch()
         # self.set_scl(True)
         self.soc.append_set_output_transactions(transactions, self.scl, True)
         # self.set_sda(True)
@@ -1327,7 +1369,7 @@ class I2CM:
         self.soc.serial_wire_instrument.transfer(transactions)
     
     def stop(self):
-        transactions = []
+        transactions = SerialWireDebugBatch()
         # self.set_sda(False)
         self.soc.append_set_output_transactions(transactions, self.sda, False)
         self.delay()
@@ -1363,7 +1405,7 @@ class I2CM:
         return get
     
     def write_byte(self, byte) -> bool:
-        transactions = []
+        transactions = SerialWireDebugBatch()
         for _ in range(8):
             self.write_bit(transactions, (byte & 0x80) != 0)
             byte <<= 1
@@ -1380,7 +1422,7 @@ class I2CM:
         return ack is False
     
     def read_byte(self, ack: bool) -> int:
-        transactions = []
+        transactions = SerialWireDebugBatch()
         # self.configure_in()
         self.soc.append_configure_input_transactions(transactions, self.sda)
         get_bits = []
@@ -1447,7 +1489,7 @@ class I2CM:
         return ack
     
     def initialize(self):
-        transactions = []
+        transactions = SerialWireDebugBatch()
         self.soc.append_configure_output_open_drain_transactions(transactions, self.scl, True)
         self.soc.append_configure_output_open_drain_transactions(transactions, self.sda, True)
         self.clear_bus(transactions)
@@ -1544,7 +1586,7 @@ class SPI:
         if skip is None:
             skip = len(tx)
 
-        transactions = []
+        transactions = SerialWireDebugBatch()
         self.soc.append_configure_output_transactions(transactions, self.d0, True)
         if self.d1 is not None:
             self.soc.append_configure_input_transactions(transactions, self.d1)
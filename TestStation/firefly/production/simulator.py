@@ -0,0 +1,996 @@
+import hashlib
+import os
+import struct
+import threading
+import time
+from collections import deque
+from .binary import FDBinary
+from .binary import decode_varuints
+from .binary import encode_varuints
+from .instruments import BatteryInstrument
+from .instruments import CurrentInstrument
+from .instruments import Detour
+from .instruments import GpioInstrument
+from .instruments import IndicatorInstrument
+from .instruments import InstrumentManager
+from .instruments import RelayInstrument
+from .instruments import SerialWireDebugTransfer
+from .instruments import SerialWireInstrument
+from .instruments import StorageInstrument
+from .instruments import VoltageInstrument
+from .transport import Transport
+
+
+# An in process stand in for the fixture firmware.  Each simulated instrument decodes the same packets the fixture
+# does and answers the calls the host waits on.  Packets are read and written field by field with FDBinary in the
+# firmware's layout, not with the host's Api schemas, so a schema that does not match the firmware fails here.
+class SimulatedInstrument:
+
+    category = None
+
+    def __init__(self, identifier):
+        self.identifier = identifier
+        self.transport = None
+        self.handlers = {0: self.api_reset}
+
+    # Raises unless the arguments were all read, as the firmware rejects a packet of the wrong length.
+    def check(self, arguments):
+        if (arguments.flags != 0) or (arguments.remaining_length() != 0):
+            raise IOError(f"{self.category} {self.identifier}: invalid arguments")
+
+    @staticmethod
+    def boolean(value):
+        return b'\x01' if value else b'\x00'
+
+    # the remaining data of a packet that ends with a varuint length and then the data
+    def get_data(self, arguments, length):
+        data = arguments.get_remaining_data()
+        if (arguments.flags != 0) or (len(data) < length):
+            raise IOError(f"{self.category} {self.identifier}: invalid arguments")
+        return data[0:length]
+
+    def api_reset(self, content):
+        self.reset()
+
+    def reset(self):
+        pass
+
+    def handle(self, api, content):
+        handler = self.handlers.get(api)
+        if handler is None:
+            raise IOError(f"{self.category} {self.identifier}: unknown api {api}")
+        return handler(content)
+
+    # The time in seconds the firmware spends on a packet after receiving it, before it handles the next one.
+    def busy_time(self, api, content):
+        return 0.0
+
+
+class SimulatedRelay(SimulatedInstrument):
+
+    category = 'Relay'
+
+    def __init__(self, identifier):
+        super().__init__(identifier)
+        self.handlers[RelayInstrument.apiTypeSetState] = self.api_set_state
+        self.state = False
+
+    def reset(self):
+        self.state = False
+
+    def api_set_state(self, content):
+        arguments = FDBinary(content)
+        self.state = arguments.get_uint8() != 0
+        self.check(arguments)
+
+
+class SimulatedIndicator(SimulatedInstrument):
+
+    category = 'Indicator'
+
+    def __init__(self, identifier):
+        super().__init__(identifier)
+        self.handlers[IndicatorInstrument.apiTypeSetRGB] = self.api_set_rgb
+        self.rgb = (0.0, 0.0, 0.0)
+
+    def reset(self):
+        self.rgb = (0.0, 0.0, 0.0)
+
+    def api_set_rgb(self, content):
+        arguments = FDBinary(content)
+        self.rgb = (arguments.get_float32(), arguments.get_float32(), arguments.get_float32())
+        self.check(arguments)
+
+
+class SimulatedVoltage(SimulatedInstrument):
+
+    category = 'Voltage'
+
+    def __init__(self, identifier, voltage=0.0):
+        super().__init__(identifier)
+        self.handlers[VoltageInstrument.apiTypeConvertVoltage] = self.api_convert_voltage
+        self.voltage = voltage
+
+    def api_convert_voltage(self, content):
+        self.check(FDBinary(content))
+        results = FDBinary()
+        results.put_float32(self.voltage)
+        return results.data
+
+
+class SimulatedCurrent(SimulatedInstrument):
+
+    category = 'Current'
+
+    def __init__(self, identifier, current=0.0):
+        super().__init__(identifier)
+        self.handlers[CurrentInstrument.apiTypeConvertCurrent] = self.api_convert_current
+        self.current = current
+
+    def api_convert_current(self, content):
+        self.check(FDBinary(content))
+        results = FDBinary()
+        results.put_float32(self.current)
+        return results.data
+
+
+class SimulatedBattery(SimulatedInstrument):
+
+    category = 'Battery'
+
+    def __init__(self, identifier, current=0.0):
+        super().__init__(identifier)
+        self.handlers[BatteryInstrument.apiTypeConvertCurrent] = self.api_convert_current
+        self.handlers[BatteryInstrument.apiTypeSetVoltage] = self.api_set_voltage
+        self.handlers[BatteryInstrument.apiTypeSetEnabled] = self.api_set_enabled
+        self.handlers[BatteryInstrument.apiTypeConvertCurrentContinuous] = self.api_convert_current_continuous
+        self.current = current
+        self.voltage = 0.0
+        self.enabled = False
+        self.conversion_timer = None
+
+    def reset(self):
+        self.voltage = 0.0
+        self.enabled = False
+
+    def api_convert_current(self, content):
+        self.check(FDBinary(content))
+        results = FDBinary()
+        results.put_float32(self.current)
+        return results.data
+
+    def api_set_voltage(self, content):
+        arguments = FDBinary(content)
+        self.voltage = arguments.get_float32()
+        self.check(arguments)
+
+    def api_set_enabled(self, content):
+        arguments = FDBinary(content)
+        self.enabled = arguments.get_uint8() != 0
+        self.check(arguments)
+
+    # Stores the means in the storage instrument and sends the complete packet once the conversion time has passed.
+    def api_convert_current_continuous(self, content):
+        arguments = FDBinary(content)
+        rate = arguments.get_float32()
+        decimation = arguments.get_varuint()
+        samples = arguments.get_varuint()
+        address = arguments.get_uint32()
+        self.check(arguments)
+        storages = [
+            instrument for instrument in self.transport.instruments.values() if isinstance(instrument, SimulatedStorage)
+        ]
+        results = FDBinary()
+        if (rate <= 0) or (decimation == 0) or not storages:
+            results.put_varuint(1)
+            return results.data
+        storage = storages[0]
+
+        def complete():
+            self.conversion_timer = None
+            means = struct.pack(f'<{samples}f', *([self.current] * samples))
+            storage.write(address, means)
+            self.transport.send(self.identifier, BatteryInstrument.apiTypeConvertCurrentContinuousComplete, b'')
+
+        self.conversion_timer = threading.Timer(samples * decimation / rate, complete)
+        self.conversion_timer.daemon = True
+        self.conversion_timer.start()
+        results.put_varuint(0)
+        return results.data
+
+
+class SimulatedGpio(SimulatedInstrument):
+
+    category = 'Gpio'
+
+    def __init__(self, identifier, capabilities=0):
+        super().__init__(identifier)
+        self.handlers.update({
+            GpioInstrument.apiTypeGetCapabilities: self.api_get_capabilities,
+            GpioInstrument.apiTypeGetConfiguration: self.api_get_configuration,
+            GpioInstrument.apiTypeSetConfiguration: self.api_set_configuration,
+            GpioInstrument.apiTypeGetDigitalInput: self.api_get_digital_input,
+            GpioInstrument.apiTypeSetDigitalOutput: self.api_set_digital_output,
+            GpioInstrument.apiTypeGetAnalogInput: self.api_get_analog_input,
+            GpioInstrument.apiTypeSetAnalogOutput: self.api_set_analog_output,
+            GpioInstrument.apiTypeGetAuxiliaryConfiguration: self.api_get_auxiliary_configuration,
+            GpioInstrument.apiTypeSetAuxiliaryConfiguration: self.api_set_auxiliary_configuration,
+            GpioInstrument.apiTypeGetAuxiliaryInput: self.api_get_auxiliary_input,
+            GpioInstrument.apiTypeSetAuxiliaryOutput: self.api_set_auxiliary_output,
+        })
+        self.capabilities = capabilities
+        # level seen on the pin when it is an input with no pull (None reads as low)
+        self.input = None
+        self.analog_input = 0.0
+        self.reset()
+
+    def reset(self):
+        self.configuration = (0, 0, 0, 0)
+        self.output = False
+        self.analog_output = 0.0
+        self.auxiliary_configuration = (0, 0, 0, 0)
+        self.auxiliary_output = False
+
+    def get_digital_input(self):
+        domain, direction, drive, pull = self.configuration
+        if direction == GpioInstrument.Direction.output.value:
+            return self.output
+        if self.input is not None:
+            return self.input
+        return pull == GpioInstrument.Pull.up.value
+
+    # configurations are (domain, direction, drive, pull), one byte each
+    def get_configuration(self, content):
+        arguments = FDBinary(content)
+        configuration = (arguments.get_uint8(), arguments.get_uint8(), arguments.get_uint8(), arguments.get_uint8())
+        self.check(arguments)
+        return configuration
+
+    def put_configuration(self, content, configuration):
+        self.check(FDBinary(content))
+        results = FDBinary()
+        for value in configuration:
+            results.put_uint8(value)
+        return results.data
+
+    def get_bool(self, content):
+        arguments = FDBinary(content)
+        value = arguments.get_uint8() != 0
+        self.check(arguments)
+        return value
+
+    def get_float32(self, content):
+        arguments = FDBinary(content)
+        value = arguments.get_float32()
+        self.check(arguments)
+        return value
+
+    def put_bool(self, content, value):
+        self.check(FDBinary(content))
+        return self.boolean(value)
+
+    def api_get_capabilities(self, content):
+        self.check(FDBinary(content))
+        results = FDBinary()
+        results.put_uint32(self.capabilities)
+        return results.data
+
+    def api_get_configuration(self, content):
+        return self.put_configuration(content, self.configuration)
+
+    def api_set_configuration(self, content):
+        self.configuration = self.get_configuration(content)
+
+    def api_get_digital_input(self, content):
+        return self.put_bool(content, self.get_digital_input())
+
+    def api_set_digital_output(self, content):
+        self.output = self.get_bool(content)
+
+    def api_get_analog_input(self, content):
+        self.check(FDBinary(content))
+        results = FDBinary()
+        results.put_float32(self.analog_input)
+        return results.data
+
+    def api_set_analog_output(self, content):
+        self.analog_output = self.get_float32(content)
+
+    def api_get_auxiliary_configuration(self, content):
+        return self.put_configuration(content, self.auxiliary_configuration)
+
+    def api_set_auxiliary_configuration(self, content):
+        self.auxiliary_configuration = self.get_configuration(content)
+
+    def api_get_auxiliary_input(self, content):
+        return self.put_bool(content, self.auxiliary_output)
+
+    def api_set_auxiliary_output(self, content):
+        self.auxiliary_output = self.get_bool(content)
+
+
+class SimulatedFile:
+
+    def __init__(self, name):
+        self.name = name
+        self.address = None
+        self.capacity = 0
+        self.size = 0
+        self.date = 0
+        self.time = 0
+
+
+# Storage backed by a bytearray.  The raw flash api (erase, write, read, hash) works on the whole memory.  Files are
+# allocated contiguously (as f_expand does) from file_base up, so file_address, hash and write_from_storage line up.
+# program_time is the time in seconds programming each byte written keeps the fixture busy.
+class SimulatedStorage(SimulatedInstrument):
+
+    category = 'Storage'
+
+    def __init__(self, identifier, size=1 << 22, file_base=1 << 21, program_time=0.0):
+        super().__init__(identifier)
+        self.program_time = program_time
+        self.handlers.update({
+            StorageInstrument.apiTypeErase: self.api_erase,
+            StorageInstrument.apiTypeWrite: self.api_write,
+            StorageInstrument.apiTypeRead: self.api_read,
+            StorageInstrument.apiTypeHash: self.api_hash,
+            StorageInstrument.apiTypeFileMkfs: self.api_file_mkfs,
+            StorageInstrument.apiTypeFileList: self.api_file_list,
+            StorageInstrument.apiTypeFileOpen: self.api_file_open,
+            StorageInstrument.apiTypeFileUnlink: self.api_file_unlink,
+            StorageInstrument.apiTypeFileAddress: self.api_file_address,
+            StorageInstrument.apiTypeFileExpand: self.api_file_expand,
+            StorageInstrument.apiTypeFileWrite: self.api_file_write,
+            StorageInstrument.apiTypeFileRead: self.api_file_read,
+        })
+        self.memory = bytearray(b'\xff') * size
+        self.file_base = file_base
+        self.file_next = file_base
+        self.files = {}
+
+    def read(self, address, length):
+        if address + length > len(self.memory):
+            raise IOError('storage address out of range')
+        return self.memory[address:address + length]
+
+    def write(self, address, data):
+        if address + len(data) > len(self.memory):
+            raise IOError('storage address out of range')
+        self.memory[address:address + len(data)] = data
+
+    def busy_time(self, api, content):
+        if api in (StorageInstrument.apiTypeWrite, StorageInstrument.apiTypeFileWrite):
+            return len(content) * self.program_time
+        return 0.0
+
+    def get_range(self, content):
+        arguments = FDBinary(content)
+        address = arguments.get_varuint()
+        length = arguments.get_varuint()
+        self.check(arguments)
+        return address, length
+
+    def api_erase(self, content):
+        address, length = self.get_range(content)
+        self.write(address, b'\xff' * length)
+
+    def api_write(self, content):
+        arguments = FDBinary(content)
+        address = arguments.get_varuint()
+        length = arguments.get_varuint()
+        self.write(address, self.get_data(arguments, length))
+
+    def api_read(self, content):
+        arguments = FDBinary(content)
+        address = arguments.get_varuint()
+        length = arguments.get_varuint()
+        sublength = arguments.get_varuint()
+        substride = arguments.get_varuint()
+        self.check(arguments)
+        if sublength == 0:
+            sublength = length
+        if (substride == 0) or (sublength >= length):
+            return self.read(address, length)
+        data = bytearray()
+        while len(data) < length:
+            data += self.read(address, min(sublength, length - len(data)))
+            address += substride
+        return data
+
+    def api_hash(self, content):
+        address, length = self.get_range(content)
+        return hashlib.sha1(self.read(address, length)).digest()
+
+    def allocate(self, file, capacity):
+        if capacity <= file.capacity:
+            return True
+        if self.file_next + capacity > len(self.memory):
+            return False
+        address = self.file_next
+        if file.size > 0:
+            self.write(address, self.read(file.address, file.size))
+        file.address = address
+        file.capacity = capacity
+        self.file_next += capacity
+        return True
+
+    def api_file_mkfs(self, content):
+        self.files = {}
+        self.file_next = self.file_base
+        return self.boolean(True)
+
+    def api_file_list(self, content):
+        binary = FDBinary()
+        binary.put_varuint(len(self.files))
+        for file in self.files.values():
+            binary.put_string(file.name)
+            binary.put_uint32(file.size)
+            binary.put_uint32(file.date)
+            binary.put_uint32(file.time)
+        return binary.data
+
+    def api_file_open(self, content):
+        arguments = FDBinary(content)
+        name = arguments.get_string()
+        mode = arguments.get_varuint()
+        self.check(arguments)
+        file = self.files.get(name)
+        if mode & StorageInstrument.FA_CREATE_ALWAYS:
+            file = SimulatedFile(name)
+            self.files[file.name] = file
+        elif mode & StorageInstrument.FA_CREATE_NEW:
+            if file is not None:
+                return self.boolean(False)
+            file = SimulatedFile(name)
+            self.files[file.name] = file
+        elif (mode & StorageInstrument.FA_OPEN_ALWAYS) and (file is None):
+            file = SimulatedFile(name)
+            self.files[file.name] = file
+        return self.boolean(file is not None)
+
+    def api_file_unlink(self, content):
+        arguments = FDBinary(content)
+        name = arguments.get_string()
+        self.check(arguments)
+        return self.boolean(self.files.pop(name, None) is not None)
+
+    def api_file_address(self, content):
+        arguments = FDBinary(content)
+        name = arguments.get_string()
+        self.check(arguments)
+        file = self.files.get(name)
+        binary = FDBinary()
+        if (file is None) or (file.address is None):
+            binary.put_uint8(0)
+            binary.put_uint32(0)
+        else:
+            binary.put_uint8(1)
+            binary.put_uint32(file.address)
+        return binary.data
+
+    def api_file_expand(self, content):
+        arguments = FDBinary(content)
+        name = arguments.get_string()
+        size = arguments.get_uint32()
+        self.check(arguments)
+        file = self.files.get(name)
+        result = (file is not None) and self.allocate(file, size)
+        if result:
+            file.size = size
+        return self.boolean(result)
+
+    def api_file_write(self, content):
+        arguments = FDBinary(content)
+        name = arguments.get_string()
+        offset = arguments.get_uint32()
+        length = arguments.get_uint32()
+        data = self.get_data(arguments, length)
+        file = self.files.get(name)
+        end = offset + length
+        result = (file is not None) and self.allocate(file, end)
+        if result:
+            self.write(file.address + offset, data)
+            file.size = max(file.size, end)
+        return self.boolean(result)
+
+    def api_file_read(self, content):
+        arguments = FDBinary(content)
+        name = arguments.get_string()
+        offset = arguments.get_uint32()
+        size = arguments.get_uint32()
+        self.check(arguments)
+        file = self.files.get(name)
+        binary = FDBinary()
+        if file is None:
+            binary.put_uint8(0)
+            return binary.data
+        size = max(0, min(size, file.size - offset))
+        binary.put_uint8(1)
+        binary.put_uint32(size)
+        if size > 0:
+            binary.put_bytes(self.read(file.address + offset, size))
+        return binary.data
+
+
+# Sparse little endian memory made of lazily allocated zero filled pages.
+class SimulatedMemory:
+
+    page_size = 1 << 12
+
+    def __init__(self):
+        self.pages = {}
+
+    def read(self, address, length):
+        data = bytearray()
+        while length > 0:
+            page = self.pages.get(address // SimulatedMemory.page_size)
+            offset = address % SimulatedMemory.page_size
+            count = min(length, SimulatedMemory.page_size - offset)
+            if page is None:
+                data += bytes(count)
+            else:
+                data += page[offset:offset + count]
+            address += count
+            length -= count
+        return data
+
+    def write(self, address, data):
+        view = memoryview(data).cast('B')
+        index = 0
+        while index < len(view):
+            number = address // SimulatedMemory.page_size
+            page = self.pages.get(number)
+            if page is None:
+                page = bytearray(SimulatedMemory.page_size)
+                self.pages[number] = page
+            offset = address % SimulatedMemory.page_size
+            count = min(len(view) - index, SimulatedMemory.page_size - offset)
+            page[offset:offset + count] = view[index:index + count]
+            address += count
+            index += count
+
+
+# A serial wire debug port attached to a simulated Cortex-M: memory, core registers, the debug port and a memory
+# access port (CSW, TAR, DRW, banked data and IDR), and DHCSR halt / run control.
+# Running the core calls the procedure registered for the PC (procedures maps address -> callable(serial_wire) which
+# returns r0), or just sets r0 to 0, and then halts again, so remote procedure calls complete immediately.
+class SimulatedSerialWire(SimulatedInstrument):
+
+    category = 'SerialWire'
+
+    memory_dhcsr = 0xe000edf0
+    dhcsr_dbgkey = 0xa05f0000
+    dhcsr_stat_halt = 1 << 17
+    dhcsr_stat_regrdy = 1 << 16
+    dhcsr_ctrl_halt = 1 << 1
+    dhcsr_ctrl_debugen = 1 << 0
+
+    register_r0 = 0
+    register_pc = 15
+
+    dp_idcode = 0x00
+    dp_ctrl_stat = 0x04
+    dp_select = 0x08
+    dp_rdbuff = 0x0c
+    dp_ctrl_powerup_requests = (1 << 30) | (1 << 28)
+
+    ap_csw = 0x00
+    ap_tar = 0x04
+    ap_drw = 0x0c
+    ap_idr = 0xfc
+    ap_csw_addrinc_single = 0x00000010
+
+    def __init__(self, identifier, dpid=0x0ba01477, ap_id=0x24770011):
+        super().__init__(identifier)
+        self.handlers.update({
+            SerialWireInstrument.apiTypeSetOutputs: self.api_set_outputs,
+            SerialWireInstrument.apiTypeGetInputs: self.api_get_inputs,
+            SerialWireInstrument.apiTypeShiftOutBits: self.api_ignore,
+            SerialWireInstrument.apiTypeShiftOutData: self.api_ignore,
+            SerialWireInstrument.apiTypeShiftInBits: self.api_ignore,
+            SerialWireInstrument.apiTypeShiftInData: self.api_ignore,
+            SerialWireInstrument.apiTypeSetEnabled: self.api_set_enabled,
+            SerialWireInstrument.apiTypeWriteMemory: self.api_write_memory,
+            SerialWireInstrument.apiTypeReadMemory: self.api_read_memory,
+            SerialWireInstrument.apiTypeWriteFromStorage: self.api_write_from_storage,
+            SerialWireInstrument.apiTypeCompareToStorage: self.api_compare_to_storage,
+            SerialWireInstrument.apiTypeTransfer: self.api_transfer,
+            SerialWireInstrument.apiTypeSetHalfBitDelay: self.api_ignore,
+            SerialWireInstrument.apiTypeSetTargetId: self.api_ignore,
+            SerialWireInstrument.apiTypeSetAccessPortId: self.api_ignore,
+            SerialWireInstrument.apiTypeConnect: self.api_connect,
+        })
+        self.dpid = dpid
+        self.ap_id = ap_id
+        self.procedures = {}
+        self.memory = SimulatedMemory()
+        self.registers = {}
+        self.reset()
+
+    def reset(self):
+        self.enabled = False
+        self.outputs = 0
+        self.dhcsr = 0
+        self.dp = {}
+        self.ap = {}
+        self.rdbuff = 0
+
+    def read_uint32(self, address):
+        if address == SimulatedSerialWire.memory_dhcsr:
+            return self.dhcsr
+        return int.from_bytes(self.memory.read(address, 4), 'little')
+
+    def write_uint32(self, address, value):
+        if address == SimulatedSerialWire.memory_dhcsr:
+            self.write_dhcsr(value)
+        else:
+            self.memory.write(address, value.to_bytes(4, 'little'))
+
+    def read_memory(self, address, length):
+        data = self.memory.read(address, length)
+        dhcsr = SimulatedSerialWire.memory_dhcsr
+        if (address <= dhcsr) and (dhcsr + 4 <= address + length):
+            data[dhcsr - address:dhcsr - address + 4] = self.dhcsr.to_bytes(4, 'little')
+        return data
+
+    def write_memory(self, address, data):
+        dhcsr = SimulatedSerialWire.memory_dhcsr
+        if (address <= dhcsr) and (dhcsr + 4 <= address + len(data)):
+            self.write_dhcsr(int.from_bytes(data[dhcsr - address:dhcsr - address + 4], 'little'))
+        self.memory.write(address, data)
+
+    def write_dhcsr(self, value):
+        if (value & 0xffff0000) != SimulatedSerialWire.dhcsr_dbgkey:
+            return
+        control = value & 0x0000ffff
+        self.dhcsr = control | SimulatedSerialWire.dhcsr_stat_regrdy
+        if control & SimulatedSerialWire.dhcsr_ctrl_halt:
+            self.dhcsr |= SimulatedSerialWire.dhcsr_stat_halt
+        elif control & SimulatedSerialWire.dhcsr_ctrl_debugen:
+            self.run()
+
+    def run(self):
+        pc = self.registers.get(SimulatedSerialWire.register_pc, 0) & ~0x00000001
+        procedure = self.procedures.get(pc)
+        r0 = procedure(self) if procedure is not None else 0
+        self.registers[SimulatedSerialWire.register_r0] = r0 & 0xffffffff
+        self.dhcsr |= SimulatedSerialWire.dhcsr_ctrl_halt | SimulatedSerialWire.dhcsr_stat_halt
+
+    def read_port(self, port, register):
+        if port == SerialWireDebugTransfer.portDebug:
+            if register == SimulatedSerialWire.dp_idcode:
+                return self.dpid
+            if register == SimulatedSerialWire.dp_ctrl_stat:
+                control = self.dp.get(register, 0)
+                return control | ((control & SimulatedSerialWire.dp_ctrl_powerup_requests) << 1)
+            if register == SimulatedSerialWire.dp_rdbuff:
+                return self.rdbuff
+            return self.dp.get(register, 0)
+        self.rdbuff = self.read_access_port(register)
+        return self.rdbuff
+
+    def write_port(self, port, register, data):
+        if port == SerialWireDebugTransfer.portDebug:
+            self.dp[register] = data
+        else:
+            self.write_access_port(register, data)
+
+    def increment_tar(self):
+        if (self.ap.get(SimulatedSerialWire.ap_csw, 0) & 0x30) == SimulatedSerialWire.ap_csw_addrinc_single:
+            self.ap[SimulatedSerialWire.ap_tar] = (self.ap.get(SimulatedSerialWire.ap_tar, 0) + 4) & 0xffffffff
+
+    def read_access_port(self, register):
+        if register == SimulatedSerialWire.ap_idr:
+            return self.ap_id
+        tar = self.ap.get(SimulatedSerialWire.ap_tar, 0)
+        if register == SimulatedSerialWire.ap_drw:
+            value = self.read_uint32(tar)
+            self.increment_tar()
+            return value
+        if 0x10 <= register <= 0x1c:
+            return self.read_uint32((tar & ~0xf) + (register - 0x10))
+        return self.ap.get(register, 0)
+
+    def write_access_port(self, register, data):
+        tar = self.ap.get(SimulatedSerialWire.ap_tar, 0)
+        if register == SimulatedSerialWire.ap_drw:
+            self.write_uint32(tar, data)
+            self.increment_tar()
+        elif 0x10 <= register <= 0x1c:
+            self.write_uint32((tar & ~0xf) + (register - 0x10), data)
+        else:
+            self.ap[register] = data
+
+    def api_ignore(self, content):
+        pass
+
+    def api_set_enabled(self, content):
+        arguments = FDBinary(content)
+        self.enabled = arguments.get_uint8() != 0
+        self.check(arguments)
+
+    def api_set_outputs(self, content):
+        arguments = FDBinary(content)
+        bits = arguments.get_uint8()
+        values = arguments.get_uint8()
+        self.check(arguments)
+        self.outputs = (self.outputs & ~bits) | (values & bits)
+
+    def api_get_inputs(self, content):
+        arguments = FDBinary(content)
+        bits = arguments.get_uint8()
+        self.check(arguments)
+        results = FDBinary()
+        results.put_varuint(self.outputs & bits)
+        return results.data
+
+    def api_write_memory(self, content):
+        arguments = FDBinary(content)
+        address = arguments.get_varuint()
+        length = arguments.get_varuint()
+        self.write_memory(address, self.get_data(arguments, length))
+        results = FDBinary()
+        results.put_varuint(0)
+        return results.data
+
+    def api_read_memory(self, content):
+        arguments = FDBinary(content)
+        address = arguments.get_varuint()
+        length = arguments.get_varuint()
+        self.check(arguments)
+        results = FDBinary()
+        results.put_varuint(0)
+        results.put_bytes(self.read_memory(address, length))
+        return results.data
+
+    def storage(self, storage_identifier):
+        storage = self.transport.instruments.get(storage_identifier)
+        if not isinstance(storage, SimulatedStorage):
+            raise IOError(f"storage instrument {storage_identifier} not found")
+        return storage
+
+    # address, length, storage identifier and storage address, all varuints
+    def get_storage_range(self, content):
+        arguments = FDBinary(content)
+        address, length, storage_identifier, storage_address = arguments.get_varuints(4)
+        self.check(arguments)
+        return address, length, self.storage(storage_identifier), storage_address
+
+    def api_write_from_storage(self, content):
+        address, length, storage, storage_address = self.get_storage_range(content)
+        self.write_memory(address, storage.read(storage_address, length))
+        results = FDBinary()
+        results.put_varuint(0)
+        return results.data
+
+    def api_compare_to_storage(self, content):
+        address, length, storage, storage_address = self.get_storage_range(content)
+        expected = storage.read(storage_address, length)
+        results = FDBinary()
+        results.put_varuint(0 if self.read_memory(address, length) == expected else 1)
+        return results.data
+
+    def api_connect(self, content):
+        binary = FDBinary()
+        binary.put_varuint(0)
+        binary.put_uint32(self.dpid)
+        return binary.data
+
+    def api_transfer(self, content):
+        arguments = FDBinary(content)
+        results = FDBinary()
+        count = 0
+        for _ in range(arguments.get_varuint()):
+            type = arguments.get_varuint()
+            if type == SerialWireDebugTransfer.typeReadPort:
+                port = arguments.get_uint8()
+                register = arguments.get_uint8()
+                results.put_varuint(type)
+                results.put_uint8(port)
+                results.put_uint8(register)
+                results.put_uint32(self.read_port(port, register))
+                count += 1
+            elif type == SerialWireDebugTransfer.typeWritePort:
+                port = arguments.get_uint8()
+                register = arguments.get_uint8()
+                self.write_port(port, register, arguments.get_uint32())
+            elif type == SerialWireDebugTransfer.typeSelectAndReadAccessPort:
+                register = arguments.get_uint8()
+                results.put_varuint(type)
+                results.put_uint8(register)
+                results.put_uint32(self.read_access_port(register))
+                count += 1
+            elif type == SerialWireDebugTransfer.typeSelectAndWriteAccessPort:
+                register = arguments.get_uint8()
+                self.write_access_port(register, arguments.get_uint32())
+            elif type == SerialWireDebugTransfer.typeReadRegister:
+                register = arguments.get_varuint()
+                results.put_varuint(type)
+                results.put_varuint(register)
+                results.put_uint32(self.registers.get(register, 0))
+                count += 1
+            elif type == SerialWireDebugTransfer.typeWriteRegister:
+                register = arguments.get_varuint()
+                self.registers[register] = arguments.get_uint32()
+            elif type == SerialWireDebugTransfer.typeReadMemory:
+                address = arguments.get_uint32()
+                results.put_varuint(type)
+                results.put_uint32(address)
+                results.put_uint32(self.read_uint32(address))
+                count += 1
+            elif type == SerialWireDebugTransfer.typeWriteMemory:
+                address = arguments.get_uint32()
+                self.write_uint32(address, arguments.get_uint32())
+            elif type == SerialWireDebugTransfer.typeReadData:
+                address = arguments.get_uint32()
+                length = arguments.get_varuint()
+                # the host reads back one uint32 for a read data transfer
+                data = self.read_memory(address, length)[0:4]
+                results.put_varuint(type)
+                results.put_uint32(address)
+                results.put_uint32(int.from_bytes(bytes(data) + bytes(4 - len(data)), 'little'))
+                count += 1
+            elif type == SerialWireDebugTransfer.typeWriteData:
+                address = arguments.get_uint32()
+                length = arguments.get_varuint()
+                self.write_memory(address, arguments.get_bytes(length))
+            else:
+                raise IOError('unknown transfer type')
+        binary = FDBinary()
+        binary.put_varuints((0, count))
+        binary.put_bytes(results.data)
+        return binary.data
+
+
+# Instruments laid out the way Fixture.setup expects to find them.
+def fixture_instruments():
+    instruments = [
+        SimulatedIndicator(1),
+        SimulatedSerialWire(2),
+        SimulatedSerialWire(3),
+        SimulatedStorage(4),
+        SimulatedVoltage(5),
+        SimulatedVoltage(6),
+    ]
+    instruments += [SimulatedRelay(identifier) for identifier in range(41, 48)]
+    instruments += [SimulatedVoltage(48), SimulatedVoltage(49), SimulatedCurrent(50), SimulatedBattery(51)]
+    instruments += [SimulatedGpio(identifier) for identifier in range(81, 81 + 28)]
+    return instruments
+
+
+# A Transport connected to simulated instruments instead of a USB device.  Reports written by the host are
+# reassembled with Detour and every packet in the frame is dispatched, responses are framed back into reports.
+# latency is the time in seconds each report takes to cross the link, in either direction (the host sleeps for it).
+# Packets are handled in order: a packet's responses are not ready until the fixture has finished the packets before
+# it (see SimulatedInstrument.busy_time), while the host can keep writing reports as if the fixture buffers them all.
+class SimulatedTransport(Transport):
+
+    report_size = 64
+
+    def __init__(self, instruments=None, latency=0.0):
+        self.latency = latency
+        self.instruments = {}
+        for instrument in (instruments if instruments is not None else fixture_instruments()):
+            self.add(instrument)
+        self.detour = Detour()
+        self.condition = threading.Condition()
+        self.reports = deque()
+        self.ready_time = 0.0
+        self.busy_until = 0.0
+        self.reports_written = 0
+        self.reports_read = 0
+        # created by fileno(): holds one byte while reports are queued, so an event loop can watch for reports
+        self.pipe = None
+
+    def add(self, instrument):
+        instrument.transport = self
+        self.instruments[instrument.identifier] = instrument
+
+    def write_report(self, report):
+        if len(report) != SimulatedTransport.report_size:
+            raise IOError('invalid report size')
+        if self.latency > 0:
+            time.sleep(self.latency)
+        self.reports_written += 1
+        self.detour.event(report)
+        if self.detour.state == Detour.state_success:
+            payload = bytes(self.detour.payload())
+            self.detour.clear()
+            self.receive(payload)
+
+    def read_report(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while not self.reports:
+                if deadline is None:
+                    self.condition.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    self.condition.wait(remaining)
+            ready_time, report = self.reports.popleft()
+            self.reports_read += 1
+            if (self.pipe is not None) and not self.reports:
+                os.read(self.pipe[0], 1)
+        delay = ready_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return report
+
+    def identity(self):
+        return 'simulator'
+
+    def fileno(self):
+        with self.condition:
+            if self.pipe is None:
+                self.pipe = os.pipe()
+                if self.reports:
+                    os.write(self.pipe[1], b'\x01')
+            return self.pipe[0]
+
+    def close(self):
+        if self.pipe is not None:
+            os.close(self.pipe[0])
+            os.close(self.pipe[1])
+            self.pipe = None
+
+    def receive(self, payload):
+        index = 0
+        while index < len(payload):
+            (identifier, api, length), index = decode_varuints(payload, index, 3)
+            content = payload[index:index + length]
+            index += length
+            response = self.dispatch(identifier, api, content)
+            if response is not None:
+                self.send(identifier, api, response)
+
+    def dispatch(self, identifier, api, content):
+        if identifier == 0:
+            if api == InstrumentManager.apiTypeResetInstruments:
+                for instrument in self.instruments.values():
+                    instrument.reset()
+                return None
+            if api == InstrumentManager.apiTypeDiscoverInstruments:
+                binary = FDBinary()
+                binary.put_varuint(len(self.instruments))
+                for instrument in self.instruments.values():
+                    binary.put_string(instrument.category)
+                    binary.put_varuint(instrument.identifier)
+                return binary.data
+            if api == InstrumentManager.apiTypeEcho:
+                return content
+            raise IOError(f"manager: unknown api {api}")
+        instrument = self.instruments.get(identifier)
+        if instrument is None:
+            raise IOError(f"instrument {identifier} not found")
+        busy_time = instrument.busy_time(api, content)
+        if busy_time > 0:
+            self.busy_until = max(time.monotonic(), self.busy_until) + busy_time
+        return instrument.handle(api, content)
+
+    # Sends a packet to the host, as a response or unsolicited.
+    def send(self, identifier, api, content):
+        packet = encode_varuints((identifier, api, len(content)))
+        packet += content
+        stream = encode_varuints((len(packet),))
+        stream += packet
+        reports = []
+        sequence_number = 0
+        offset = 0
+        while offset < len(stream):
+            report = encode_varuints((sequence_number,))
+            count = SimulatedTransport.report_size - len(report)
+            report += stream[offset:offset + count]
+            report += bytes(SimulatedTransport.report_size - len(report))
+            reports.append(report)
+            sequence_number += 1
+            offset += count
+        with self.condition:
+            if (self.pipe is not None) and not self.reports:
+                os.write(self.pipe[1], b'\x01')
+            for report in reports:
+                self.ready_time = max(time.monotonic(), self.ready_time, self.busy_until) + self.latency
+                self.reports.append((self.ready_time, report))
+            self.condition.notify_all()
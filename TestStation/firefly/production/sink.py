@@ -0,0 +1,225 @@
+import array
+import mmap
+import struct
+from collections import namedtuple
+from .binary import numpy
+
+
+CaptureWindow = namedtuple('CaptureWindow', ['times', 'minimums', 'maximums', 'means', 'resolution'])
+
+spillRecord = struct.Struct('<dd')
+
+
+# One level of the pyramid: min, max, sum and count for buckets of duration seconds, in a ring of capacity buckets
+# indexed by bucket number (so slots left behind by gaps in the capture are recognised by their bucket number).
+class CaptureTier:
+
+    def __init__(self, duration, capacity):
+        self.duration = duration
+        self.capacity = capacity
+        self.buckets = array.array('q', [-1]) * capacity
+        self.minimums = array.array('d', [0.0]) * capacity
+        self.maximums = array.array('d', [0.0]) * capacity
+        self.sums = array.array('d', [0.0]) * capacity
+        self.counts = array.array('q', [0]) * capacity
+        # the bucket being filled and the last one stored
+        self.bucket = None
+        self.minimum = 0.0
+        self.maximum = 0.0
+        self.sum = 0.0
+        self.count = 0
+        self.last = None
+
+    # Adds to bucket, returning the previous bucket as (bucket, minimum, maximum, sum, count) if this closed it.
+    def add(self, bucket, minimum, maximum, total, count):
+        if bucket == self.bucket:
+            if minimum < self.minimum:
+                self.minimum = minimum
+            if maximum > self.maximum:
+                self.maximum = maximum
+            self.sum += total
+            self.count += count
+            return None
+        closed = self.close()
+        self.bucket = bucket
+        self.minimum = minimum
+        self.maximum = maximum
+        self.sum = total
+        self.count = count
+        return closed
+
+    def close(self):
+        if self.bucket is None:
+            return None
+        bucket = self.bucket
+        index = bucket % self.capacity
+        self.buckets[index] = bucket
+        self.minimums[index] = self.minimum
+        self.maximums[index] = self.maximum
+        self.sums[index] = self.sum
+        self.counts[index] = self.count
+        self.last = bucket
+        self.bucket = None
+        return bucket, self.minimum, self.maximum, self.sum, self.count
+
+    def first(self):
+        if self.last is None:
+            return self.bucket
+        return max(self.last - self.capacity + 1, 0)
+
+    def holds(self, bucket):
+        first = self.first()
+        return (first is not None) and (first <= bucket)
+
+    # Appends (start time, min, max, mean) of the buckets from first to last (inclusive) that are held.
+    def collect(self, origin, first, last, window):
+        times, minimums, maximums, means = window
+        start = max(first, self.first())
+        end = last if self.last is None else min(last, self.last)
+        for bucket in range(start, end + 1):
+            index = bucket % self.capacity
+            if self.buckets[index] == bucket:
+                times.append(origin + bucket * self.duration)
+                minimums.append(self.minimums[index])
+                maximums.append(self.maximums[index])
+                means.append(self.sums[index] / self.counts[index])
+        if (self.bucket is not None) and (first <= self.bucket <= last):
+            times.append(origin + self.bucket * self.duration)
+            minimums.append(self.minimum)
+            maximums.append(self.maximum)
+            means.append(self.sum / self.count)
+
+
+# Keeps a long capture of (time, value) samples in a fixed amount of memory: the last raw_capacity samples in a ring,
+# and tiers of min/max/mean buckets (resolution seconds, then factor times longer at each tier) of tier_capacity
+# buckets each.  With spill_path every raw sample is also written to a memory mapped file.  Samples must be added in
+# time order.  window() answers from the finest data that covers the window at the resolution asked for.
+class CaptureSink:
+
+    spillChunk = 1 << 16
+
+    def __init__(
+        self, resolution=1.0e-3, factor=8, tier_count=6, tier_capacity=4096, raw_capacity=1 << 16, spill_path=None
+    ):
+        self.resolution = resolution
+        self.factor = factor
+        self.tiers = [CaptureTier(resolution * factor ** level, tier_capacity) for level in range(tier_count)]
+        self.raw_capacity = raw_capacity
+        self.raw_times = array.array('d', [0.0]) * raw_capacity
+        self.raw_values = array.array('d', [0.0]) * raw_capacity
+        self.count = 0
+        self.origin = None
+        self.spill_file = None
+        self.spill_map = None
+        self.spill_capacity = 0
+        if spill_path is not None:
+            self.spill_file = open(spill_path, 'w+b')
+            self.grow_spill()
+
+    def grow_spill(self):
+        if self.spill_map is not None:
+            self.spill_map.close()
+        self.spill_capacity += CaptureSink.spillChunk
+        self.spill_file.truncate(self.spill_capacity * spillRecord.size)
+        self.spill_map = mmap.mmap(self.spill_file.fileno(), self.spill_capacity * spillRecord.size)
+
+    def close(self):
+        if self.spill_map is not None:
+            self.spill_map.close()
+            self.spill_map = None
+        if self.spill_file is not None:
+            self.spill_file.truncate(self.count * spillRecord.size)
+            self.spill_file.close()
+            self.spill_file = None
+
+    def add(self, time, value):
+        if self.origin is None:
+            self.origin = time
+        index = self.count % self.raw_capacity
+        self.raw_times[index] = time
+        self.raw_values[index] = value
+        if self.spill_map is not None:
+            if self.count >= self.spill_capacity:
+                self.grow_spill()
+            spillRecord.pack_into(self.spill_map, self.count * spillRecord.size, time, value)
+        self.count += 1
+        tiers = self.tiers
+        closed = tiers[0].add(int((time - self.origin) / self.resolution), value, value, value, 1)
+        level = 1
+        while (closed is not None) and (level < len(tiers)):
+            bucket, minimum, maximum, total, count = closed
+            closed = tiers[level].add(bucket // self.factor, minimum, maximum, total, count)
+            level += 1
+
+    def add_block(self, times, values):
+        for time, value in zip(times, values):
+            self.add(time, value)
+
+    def raw_index(self, time, first, end, get_time):
+        while first < end:
+            middle = (first + end) // 2
+            if get_time(middle) < time:
+                first = middle + 1
+            else:
+                end = middle
+        return first
+
+    def spill_time(self, index):
+        return spillRecord.unpack_from(self.spill_map, index * spillRecord.size)[0]
+
+    def raw_window(self, start, end):
+        times = array.array('d')
+        values = array.array('d')
+        first = max(self.count - self.raw_capacity, 0)
+        if (first > 0) and (self.raw_times[first % self.raw_capacity] > start) and (self.spill_map is not None):
+            index = self.raw_index(start, 0, self.count, self.spill_time)
+            while index < self.count:
+                time, value = spillRecord.unpack_from(self.spill_map, index * spillRecord.size)
+                if time > end:
+                    break
+                times.append(time)
+                values.append(value)
+                index += 1
+            return times, values
+        capacity = self.raw_capacity
+        index = self.raw_index(start, first, self.count, lambda i: self.raw_times[i % capacity])
+        while index < self.count:
+            time = self.raw_times[index % capacity]
+            if time > end:
+                break
+            times.append(time)
+            values.append(self.raw_values[index % capacity])
+            index += 1
+        return times, values
+
+    # Returns the samples (resolution None or finer than the first tier) or the buckets of the coarsest tier no
+    # coarser than resolution that still holds start (a coarser one when it does not) between start and end.
+    def window(self, start, end, resolution=None, as_numpy=False):
+        if self.origin is None:
+            window = (array.array('d'), array.array('d'), array.array('d'), array.array('d'))
+            actual = resolution
+        elif (resolution is None) or (resolution < self.resolution):
+            times, values = self.raw_window(start, end)
+            window = (times, values, values, values)
+            actual = None
+        else:
+            level = 0
+            while (level + 1 < len(self.tiers)) and (self.tiers[level + 1].duration <= resolution):
+                level += 1
+            first = max(int((start - self.origin) // self.resolution), 0)
+            while (level + 1 < len(self.tiers)) and not self.tiers[level].holds(first // self.factor ** level):
+                level += 1
+            tier = self.tiers[level]
+            window = (array.array('d'), array.array('d'), array.array('d'), array.array('d'))
+            tier.collect(
+                self.origin, max(int((start - self.origin) // tier.duration), 0),
+                int((end - self.origin) // tier.duration), window
+            )
+            actual = tier.duration
+        if as_numpy:
+            window = tuple(numpy.array(values) for values in window)
+        return CaptureWindow(*window, actual)
+
+    def memory_size(self):
+        tier_bytes = sum(tier.capacity * 5 * 8 for tier in self.tiers)
+        return tier_bytes + self.raw_capacity * 2 * 8
@@ -0,0 +1,56 @@
+import time
+from collections import namedtuple
+from .instruments import BatteryInstrument
+from .instruments import CurrentInstrument
+from .instruments import GpioInstrument
+from .instruments import VoltageInstrument
+
+
+# The call converting each kind of instrument for a snapshot, and the result field holding the value.
+snapshotConversions = {
+    VoltageInstrument: (VoltageInstrument.apiConvertVoltage, 'voltage'),
+    CurrentInstrument: (CurrentInstrument.apiConvertCurrent, 'current'),
+    BatteryInstrument: (BatteryInstrument.apiConvertCurrent, 'current'),
+    GpioInstrument: (GpioInstrument.apiGetDigitalInput, 'value'),
+}
+
+snapshotAnalogConversion = (GpioInstrument.apiGetAnalogInput, 'value')
+
+
+# Reads a set of channels, each (name, instrument) or (name, instrument, 'analog') for a Gpio analog input, with all
+# the conversions written in one frame.  read() returns a record with time (the host monotonic time halfway through
+# the exchange) and one field per channel name.
+class Snapshot:
+
+    def __init__(self, manager, channels):
+        self.manager = manager
+        self.calls = []
+        self.fields = []
+        names = []
+        for channel in channels:
+            name, instrument = channel[0], channel[1]
+            if (len(channel) > 2) and (channel[2] == 'analog'):
+                api, field = snapshotAnalogConversion
+            else:
+                conversion = snapshotConversions.get(type(instrument))
+                if conversion is None:
+                    raise IOError(f"{name}: no snapshot conversion for {type(instrument).__name__}")
+                api, field = conversion
+            self.calls.append((instrument.identifier, api.type, api.arguments.encode(()), api.results.decode))
+            self.fields.append(field)
+            names.append(name)
+        self.Record = namedtuple('SnapshotRecord', ['time'] + names)
+
+    # Writes the conversions without waiting for them, for finish() to collect later (the fixture converts them in
+    # order with whatever is written after).  The record time is then the time the conversions were written.
+    def start(self):
+        return time.monotonic(), self.manager.call_batch(self.calls)
+
+    def finish(self, started):
+        start, futures = started
+        values = [getattr(future.result(), field) for future, field in zip(futures, self.fields)]
+        return self.Record(start, *values)
+
+    def read(self):
+        record = self.finish(self.start())
+        return record._replace(time=(record.time + time.monotonic()) / 2)
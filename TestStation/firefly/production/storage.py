@@ -73,7 +73,7 @@ class FileSystem:
         for sector in self.sectors:
             if sector.status == Sector.status_metadata:
                 entry = sector.entry
-                digest = self.storage_instrument.digest(sector.address + FileSystem.sectorSize, entry.length)
+                digest = self.storage_instrument.hash(sector.address + FileSystem.sectorSize, entry.length)
                 if digest != entry.digest:
                     print(f"FileSystem.repair: erasing entry with incorrect content digest: {entry.name}")
                     self.erase_sector(sector)
@@ -98,7 +98,7 @@ class FileSystem:
             if marker == 0xf0:
                 # should be metadata
                 data = self.storage_instrument.read(address, FileSystem.pageSize)
-                if self.magic == data[0:len(self.magic)]:
+                if bytes(self.magic) == data[0:len(self.magic)]:
                     try:
                         binary = FDBinary(data)
                         magic = binary.get_bytes(len(self.magic))
@@ -154,7 +154,7 @@ class FileSystem:
 
     def write(self, name, data, date, sector, sector_count):
         length = len(data)
-        digest = hashlib.sha1(data)
+        digest = hashlib.sha1(data).digest()
         entry = Entry(name, sector_count, length, date, digest, sector.address + FileSystem.sectorSize)
         sector_index = sector.address // FileSystem.sectorSize
         self.sectors[sector_index].status = Sector.status_metadata
@@ -250,13 +250,13 @@ class FileSystem:
     def ensure(self, name, data, date):
         entry = self.get(name)
         if entry is not None:
-            digest = hashlib.sha1(data)
+            digest = hashlib.sha1(data).digest()
             if digest != entry.digest:
                 self.erase(name)
                 entry = None
         if entry is None:
             entry = self.allocate(name, data, date)
-            verify = self.storage_instrument.digest(entry.address, entry.length)
+            verify = self.storage_instrument.hash(entry.address, entry.length)
             if verify != entry.digest:
                 raise IOError("corrupt write")
         return entry
@@ -0,0 +1,65 @@
+import queue
+import sys
+
+
+# The report number the host writes output reports with (USBHIDDevice.m and the original Python host used it too).
+outputReportId = 0x81
+
+
+# Moves fixed size reports to and from the fixture.
+# read_report returns None when no report arrives within timeout seconds (None waits forever, 0 does not wait).
+# fileno, when not None, is a file descriptor that is readable while a report is available (for event loops).
+# identity, when not None, names the device the same way each time it is opened (for the discovery cache).
+class Transport:
+
+    def write_report(self, report):
+        raise IOError("unimplemented")
+
+    def read_report(self, timeout=None):
+        raise IOError("unimplemented")
+
+    def fileno(self):
+        return None
+
+    def identity(self):
+        return None
+
+    def close(self):
+        raise IOError("unimplemented")
+
+
+class MacOsHidTransport(Transport):
+
+    def __init__(self, device):
+        self.device = device
+
+    @staticmethod
+    def open(vendor_id, product_id):
+        # usb loads IOKit and CoreFoundation when imported, so only import it when a mac transport is wanted
+        from .usb import MacOsHidDevice
+        return MacOsHidTransport(MacOsHidDevice.open(vendor_id, product_id))
+
+    def write_report(self, report):
+        self.device.Write(report, report_id=outputReportId)
+
+    def identity(self):
+        return f'mac:{self.device.device_path}'
+
+    def read_report(self, timeout=None):
+        try:
+            return self.device.read_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        # the device stops its run loop thread and unregisters its callback when it is deleted
+        self.device = None
+
+
+def open_transport(vendor_id, product_id):
+    if sys.platform.startswith('linux'):
+        from .hidraw import HidrawTransport
+        return HidrawTransport.open(vendor_id, product_id)
+    if sys.platform == 'darwin':
+        return MacOsHidTransport.open(vendor_id, product_id)
+    raise IOError(f"no transport for platform {sys.platform}")
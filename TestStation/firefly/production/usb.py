@@ -239,7 +239,7 @@ def HidReadCallback(read_queue, result, sender, report_type, report_id, report,
     """Handles incoming IN report from HID device."""
     del result, sender, report_type, report_id  # Unused by the callback function
 
-    incoming_bytes = [report[i] for i in range(report_length)]
+    incoming_bytes = ctypes.string_at(report, report_length)
     read_queue.put(incoming_bytes)
 
 
@@ -0,0 +1,30 @@
+import pytest
+from firefly.production.instruments import InstrumentManager
+from firefly.production.simulator import SimulatedTransport
+
+
+@pytest.fixture
+def read_timeout():
+    return 1.0
+
+
+# A simulated fixture, or one of another transport class given with parametrize(..., indirect=True).
+@pytest.fixture
+def transport(request):
+    transport_class = getattr(request, 'param', SimulatedTransport)
+    return transport_class()
+
+
+@pytest.fixture
+def manager(transport, read_timeout):
+    manager = InstrumentManager(transport)
+    manager.open()
+    manager.discover_instruments()
+    manager.read_timeout = read_timeout
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def storage_instrument(manager):
+    return manager.get_instrument(4)
@@ -0,0 +1,37 @@
+import time
+import pytest
+from firefly.production.instruments import ContinuousConversion
+
+
+@pytest.fixture(params=[False, True], ids=['polled', 'reader thread'])
+def battery_instrument(request, transport, manager):
+    transport.instruments[51].current = 0.25
+    if request.param:
+        manager.start_reader_thread()
+    yield manager.get_instrument(51)
+    manager.stop_reader_thread()
+
+
+def test_capture_current(battery_instrument, storage_instrument):
+    capture = battery_instrument.capture_current(storage_instrument, 0x10000, 50, rate=1.0e6, decimation=100)
+    assert list(capture.currents) == [0.25] * 50
+    assert capture.times[1] - capture.times[0] == pytest.approx(100 / 1.0e6)
+
+
+def test_stream_current(battery_instrument, storage_instrument):
+    captures = list(battery_instrument.stream_current(storage_instrument, 0x10000, 20, decimation=100, blocks=3))
+    assert len(captures) == 3
+    assert all(list(capture.currents) == [0.25] * 20 for capture in captures)
+
+
+def test_wait_gives_up_on_a_missing_complete_packet(monkeypatch, transport, battery_instrument):
+    monkeypatch.setattr(ContinuousConversion, 'completeMargin', 0.05)
+    conversion = battery_instrument.convert_continuous(1.0e6, 100, 10, 0x10000)
+    transport.instruments[51].conversion_timer.cancel()
+    start = time.monotonic()
+    with pytest.raises(IOError, match='did not complete'):
+        conversion.wait()
+    assert time.monotonic() - start < 1.0
+    assert not conversion.done()
+    # the manager is still usable, and later calls are not taken for the conversion
+    assert bytes(battery_instrument.manager.echo(b'after')) == b'after'
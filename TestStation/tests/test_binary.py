@@ -0,0 +1,233 @@
+import array
+import pytest
+import struct
+from firefly.production import binary as binary_module
+from firefly.production.binary import FDBinary
+from firefly.production.binary import decode_packet_header
+from firefly.production.binary import decode_varuints
+from firefly.production.binary import encode_packet_header
+from firefly.production.binary import encode_varuints
+
+
+def put_all(binary):
+    binary.put_uint8(0xab)
+    binary.put_uint16(0xbeef)
+    binary.put_uint24(0x123456)
+    binary.put_uint32(0xdeadbeef)
+    binary.put_uint64(0x0123456789abcdef)
+    binary.put_float16(1.5)
+    binary.put_float32(-2.25)
+    binary.put_float64(3.125)
+    binary.put_varuint(300)
+    binary.put_varint(-5)
+    binary.put_string('héllo')
+    binary.put_bytes(b'\x01\x02')
+
+
+def test_put_get_round_trip():
+    binary = FDBinary()
+    put_all(binary)
+    binary = FDBinary(bytes(binary.data))
+    assert binary.get_uint8() == 0xab
+    assert binary.get_uint16() == 0xbeef
+    assert binary.get_uint24() == 0x123456
+    assert binary.get_uint32() == 0xdeadbeef
+    assert binary.get_uint64() == 0x0123456789abcdef
+    assert binary.get_float16() == 1.5
+    assert binary.get_float32() == -2.25
+    assert binary.get_float64() == 3.125
+    assert binary.get_varuint() == 300
+    assert binary.get_varint() == -5
+    assert binary.get_string() == 'héllo'
+    assert binary.get_bytes(2) == b'\x01\x02'
+    assert binary.remaining_length() == 0
+    assert binary.flags == 0
+
+
+def test_little_endian_layout():
+    binary = FDBinary()
+    binary.put_uint16(0x0102)
+    binary.put_uint24(0x030405)
+    binary.put_uint32(0x06070809)
+    assert bytes(binary.data) == bytes([0x02, 0x01, 0x05, 0x04, 0x03, 0x09, 0x08, 0x07, 0x06])
+
+
+@pytest.mark.parametrize('data', [b'\x01\x02', bytearray(b'\x01\x02'), memoryview(b'\x01\x02'), [1, 2]])
+def test_puts_append_to_any_data(data):
+    binary = FDBinary(data)
+    put_all(binary)
+    binary.put_varuints((1, 200))
+    assert isinstance(binary.data, bytearray)
+    assert binary.get_bytes(2) == b'\x01\x02'
+    assert binary.get_uint8() == 0xab
+
+
+@pytest.mark.parametrize('data', [b'\x01\x02\x03', bytearray(b'\x01\x02\x03'), memoryview(b'\x01\x02\x03')])
+def test_get_bytes_returns_read_only_views(data):
+    binary = FDBinary(data)
+    first = binary.get_bytes(2)
+    assert isinstance(first, memoryview)
+    assert first.readonly
+    assert first == b'\x01\x02'
+    # a view of growable data must not stop it growing
+    binary.put_uint8(4)
+    assert binary.get_remaining_data() == b'\x03\x04'
+    assert first == b'\x01\x02'
+
+
+def test_get_overflow():
+    binary = FDBinary(b'\x01')
+    overflow = binary.get_bytes(2)
+    assert isinstance(overflow, memoryview)
+    assert len(overflow) == 0
+    assert binary.flags & FDBinary.FLAG_OVERFLOW
+    assert binary.get_uint32() == 0
+
+
+def test_put_limit():
+    binary = FDBinary(limit=4)
+    binary.put_uint32(1)
+    assert binary.flags == 0
+    binary.put_uint8(1)
+    binary.put_varuint(1)
+    assert binary.flags & FDBinary.FLAG_OVERFLOW
+    assert len(binary.data) == 4
+
+
+def test_string_out_of_bounds():
+    binary = FDBinary(b'\x05ab')
+    assert binary.get_string() == ''
+    assert binary.flags & FDBinary.FLAG_INVALID_REPRESENTATION
+
+
+array_cases = [
+    ('uint16', [0, 1, 0xffff], '<3H'),
+    ('uint32', [0, 1, 0xffffffff], '<3I'),
+    ('float32', [0.0, -1.5, 1.0e10], '<3f'),
+    ('float64', [0.0, -1.5, 1.0e300], '<3d'),
+]
+
+
+@pytest.mark.parametrize('kind, values, format', array_cases)
+def test_array_round_trip(kind, values, format):
+    binary = FDBinary()
+    getattr(binary, f'put_{kind}_array')(values)
+    assert bytes(binary.data) == struct.pack(format, *values)
+    binary.put_uint8(7)
+    binary = FDBinary(bytes(binary.data))
+    got = getattr(binary, f'get_{kind}_array')(len(values))
+    assert isinstance(got, array.array)
+    assert list(got) == pytest.approx(values, rel=1.0e-6)
+    assert binary.get_uint8() == 7
+
+
+@pytest.mark.parametrize('kind, values, format', array_cases)
+def test_array_from_array_round_trip(kind, values, format):
+    binary = FDBinary()
+    typed = FDBinary(struct.pack(format, *values))
+    getattr(binary, f'put_{kind}_array')(getattr(typed, f'get_{kind}_array')(len(values)))
+    assert bytes(binary.data) == struct.pack(format, *values)
+
+
+def test_array_overflow():
+    binary = FDBinary(b'\x01\x00\x02')
+    assert list(binary.get_uint16_array(2)) == []
+    assert binary.flags & FDBinary.FLAG_OVERFLOW
+    binary = FDBinary(limit=4)
+    binary.put_uint32_array([1, 2])
+    assert binary.flags & FDBinary.FLAG_OVERFLOW
+    assert len(binary.data) == 0
+
+
+# On a big endian host arrays are byteswapped to and from the little endian wire format.  Here that is checked by
+# swapping on a little endian host and giving it big endian data.
+def test_array_byteswap(monkeypatch):
+    monkeypatch.setattr(binary_module, 'array_byteswap', True)
+    values = [1, 0x0102, 0xfffe]
+    assert list(FDBinary(struct.pack('>3H', *values)).get_uint16_array(3)) == values
+    binary = FDBinary()
+    binary.put_uint16_array(array.array('H', values))
+    assert bytes(binary.data) == struct.pack('<3H', *values)
+
+
+def test_numpy_arrays():
+    numpy = pytest.importorskip('numpy')
+    data = struct.pack('<3I', 1, 2, 0xffffffff) + struct.pack('<2d', 0.5, -0.5)
+    for source in (data, bytearray(data)):
+        binary = FDBinary(source)
+        values = binary.get_uint32_array(3, as_numpy=True)
+        assert values.dtype == numpy.dtype('<u4')
+        assert list(values) == [1, 2, 0xffffffff]
+        assert list(binary.get_float64_array(2, as_numpy=True)) == [0.5, -0.5]
+        binary.put_uint32_array(numpy.array([3, 4], dtype=numpy.uint32))
+        assert list(binary.get_uint32_array(2)) == [3, 4]
+
+
+def test_numpy_arrays_without_numpy(monkeypatch):
+    monkeypatch.setattr(binary_module, 'numpy', None)
+    with pytest.raises(ImportError):
+        FDBinary(bytes(8)).get_uint32_array(2, as_numpy=True)
+
+
+varuintValues = [0, 1, 0x7f, 0x80, 0x3fff, 0x4000, 0xffffffff, (1 << 63) - 1, (1 << 64) - 1]
+
+
+def test_varuint_round_trip():
+    data = encode_varuints(varuintValues)
+    assert decode_varuints(data, 0, len(varuintValues)) == (varuintValues, len(data))
+    binary = FDBinary()
+    for value in varuintValues:
+        binary.put_varuint(value)
+    assert binary.data == data
+    binary = FDBinary(bytes(data))
+    assert [binary.get_varuint() for _ in varuintValues] == varuintValues
+    assert FDBinary(bytes(data)).get_varuints(len(varuintValues)) == varuintValues
+    assert FDBinary(bytes(data)).flags == 0
+
+
+def test_varuint_layout():
+    assert encode_varuints((0x7f, 0x80, 300)) == b'\x7f\x80\x01\xac\x02'
+    # the largest value takes ten bytes
+    assert encode_varuints(((1 << 64) - 1,)) == b'\xff' * 9 + b'\x01'
+
+
+# more than ten bytes, or a tenth byte with more than the 64th bit
+@pytest.mark.parametrize('data', [b'\xff' * 10 + b'\x01', b'\x80' * 10 + b'\x00', b'\xff' * 9 + b'\x02'])
+def test_varuint_invalid_representation(data):
+    with pytest.raises(IOError):
+        decode_varuints(data, 0, 1)
+    binary = FDBinary(data)
+    assert binary.get_varuint() == 0
+    assert binary.flags & FDBinary.FLAG_INVALID_REPRESENTATION
+
+
+def test_varuint_out_of_bounds():
+    with pytest.raises(IOError):
+        decode_varuints(b'\x01\x80', 0, 2)
+    binary = FDBinary(b'\x80\x80')
+    assert binary.get_varuint() == 0
+    assert binary.flags & FDBinary.FLAG_OUT_OF_BOUNDS
+    binary = FDBinary(b'\x01\x80')
+    assert binary.get_varuints(2) == [0, 0]
+    assert binary.flags & FDBinary.FLAG_OUT_OF_BOUNDS
+
+
+@pytest.mark.parametrize('header', [
+    (0, 0, 0), (4, 2, 0x7f), (4, 2, 0x80), (4, 2, 4101), (4, 2, 0x3fff), (4, 2, 0x4000), (2, 14, 1 << 16),
+    (0x80, 2, 1), (4, 0x80, 1), (300, 70000, 5),
+])
+def test_packet_header_matches_varuints(header):
+    encoded = encode_packet_header(*header)
+    assert bytes(encoded) == bytes(encode_varuints(header))
+    for data in (bytes(encoded), bytes(encoded) + b'\xff\x01', memoryview(b'\x00' + bytes(encoded))[1:]):
+        values, index = decode_packet_header(data, 0)
+        assert tuple(values) == header
+        assert index == len(encoded)
+    values, index = decode_packet_header(b'\x09' + bytes(encoded), 1)
+    assert (tuple(values), index) == (header, len(encoded) + 1)
+
+
+def test_packet_header_out_of_bounds():
+    for data in (b'', b'\x04\x02', b'\x04\x02\x80'):
+        with pytest.raises(IOError):
+            decode_packet_header(data, 0)
@@ -0,0 +1,70 @@
+import pytest
+from firefly.production.capture import RecordingTransport
+from firefly.production.capture import ReplayTransport
+from firefly.production.capture import directionRead
+from firefly.production.capture import directionWrite
+from firefly.production.capture import read_capture
+from firefly.production.instruments import InstrumentManager
+from firefly.production.simulator import SimulatedTransport
+
+
+def session(transport):
+    manager = InstrumentManager(transport)
+    manager.open()
+    manager.discover_instruments()
+    manager.read_timeout = 1.0
+    storage_instrument = manager.get_instrument(4)
+    storage_instrument.write(0x1000, bytes(range(256)) * 40)
+    data = storage_instrument.read(0x1000, 256 * 40)
+    manager.get_instrument(41).set(True)
+    echo = manager.echo(b'replay')
+    manager.close()
+    return bytes(data), bytes(echo)
+
+
+def test_recorded_session_replays(tmp_path):
+    path = str(tmp_path / 'session.cap')
+    recorded = session(RecordingTransport(SimulatedTransport(), path))
+    assert recorded == (bytes(range(256)) * 40, b'replay')
+    records = read_capture(path)
+    assert {direction for direction, _, _ in records} == {directionWrite, directionRead}
+    assert all(len(report) == SimulatedTransport.report_size for _, _, report in records)
+    assert [seconds for _, seconds, _ in records] == sorted(seconds for _, seconds, _ in records)
+    assert session(ReplayTransport(path, scale=0, check=True)) == recorded
+
+
+def test_replay_checks_the_reports_written(tmp_path):
+    path = str(tmp_path / 'session.cap')
+    session(RecordingTransport(SimulatedTransport(), path))
+    replay = ReplayTransport(path, scale=0, check=True)
+    manager = InstrumentManager(replay)
+    manager.open()
+    manager.discover_instruments()
+    with pytest.raises(IOError, match='differs from the capture'):
+        manager.echo(b'other')
+
+
+def test_replay_ends_with_the_capture(tmp_path):
+    path = str(tmp_path / 'session.cap')
+    transport = RecordingTransport(SimulatedTransport(), path)
+    manager = InstrumentManager(transport)
+    manager.echo(b'once')
+    transport.close()
+    manager = InstrumentManager(ReplayTransport(path, scale=0))
+    assert bytes(manager.echo(b'once')) == b'once'
+    with pytest.raises(IOError):
+        manager.echo(b'twice')
+
+
+def test_invalid_captures_are_rejected(tmp_path):
+    path = tmp_path / 'session.cap'
+    path.write_bytes(b'not a capture')
+    with pytest.raises(IOError, match='not a capture file'):
+        read_capture(str(path))
+    recording = tmp_path / 'recording.cap'
+    transport = RecordingTransport(SimulatedTransport(), str(recording))
+    InstrumentManager(transport).echo(b'x')
+    transport.close()
+    path.write_bytes(recording.read_bytes()[:-1])
+    with pytest.raises(IOError, match='truncated capture'):
+        read_capture(str(path))
@@ -0,0 +1,53 @@
+import threading
+import pytest
+
+
+def run_threads(targets):
+    errors = []
+
+    def run(target):
+        try:
+            target()
+        except Exception as exception:
+            errors.append(exception)
+
+    threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert not any(thread.is_alive() for thread in threads)
+    assert errors == []
+
+
+@pytest.mark.parametrize('reader_thread', [False, True])
+def test_threads_share_the_manager(transport, manager, reader_thread):
+    transport.latency = 0.0001
+    if reader_thread:
+        manager.start_reader_thread()
+    for identifier in (2, 3):
+        transport.instruments[identifier].write_memory(0x20000000, bytes([identifier]) * 1024)
+
+    def echoes(index):
+        def run():
+            for count in range(20):
+                data = bytes([index, count]) * (1 + count * 5)
+                assert bytes(manager.echo(data)) == data
+        return run
+
+    def memory(identifier):
+        def run():
+            instrument = manager.get_instrument(identifier)
+            for _ in range(5):
+                assert bytes(instrument.read_memory(0x20000000, 1024)) == bytes([identifier]) * 1024
+        return run
+
+    def voltages():
+        for _ in range(20):
+            manager.get_instrument(48).convert()
+
+    try:
+        run_threads([echoes(index) for index in range(4)] + [memory(2), memory(3), voltages])
+    finally:
+        manager.stop_reader_thread()
+    assert not manager.pending
@@ -0,0 +1,117 @@
+import pytest
+from firefly.production.connectivity import ConnectivityFault
+from firefly.production.connectivity import ConnectivityTest
+from firefly.production.connectivity import connectivity_codes
+from firefly.production.connectivity import connectivity_faults
+from firefly.production.connectivity import connectivity_patterns
+from firefly.production.connectivity import connectivity_signatures
+
+
+gpioNames = [f'IOA{index}' for index in range(8)] + [f'DIO{index}' for index in range(16)]
+
+
+# A DUT whose ios are wired to fixture gpios.  The SOC drives an io by writing memory through the simulated serial
+# wire, and the fixture gpios wired to it see the wired or of the ios driven.
+class WiredSoc:
+
+    ioBase = 0x20000000
+    ioUndriven = 2
+
+    def __init__(self, transport, manager, wiring):
+        self.transport = transport
+        self.serial_wire = manager.get_instrument(2)
+        self.serial_wire_instrument = self
+        self.wiring = wiring
+        self.transfers = 0
+
+    def address(self, io):
+        return WiredSoc.ioBase + 4 * io
+
+    def append_configure_output_transactions(self, transactions, io, value):
+        transactions.write_memory(self.address(io), int(value))
+
+    def append_set_output_transactions(self, transactions, io, value):
+        transactions.write_memory(self.address(io), int(value))
+
+    def append_configure_default_transactions(self, transactions, io):
+        transactions.write_memory(self.address(io), WiredSoc.ioUndriven)
+
+    def transfer(self, transactions):
+        self.transfers += 1
+        self.serial_wire.transfer(transactions)
+        simulated = self.transport.instruments[2]
+        for identifier, ios in self.wiring.items():
+            values = [simulated.read_uint32(self.address(io)) for io in ios]
+            driven = [value for value in values if value != WiredSoc.ioUndriven]
+            self.transport.instruments[identifier].input = any(driven) if driven else None
+
+
+@pytest.fixture
+def connectivity_test(transport, manager):
+    def create(kind='binary', count=6, wiring=None):
+        if wiring is None:
+            wiring = {81 + net: [net] for net in range(count)}
+        soc = WiredSoc(transport, manager, wiring)
+        gpio_instrument_by_name = {name: manager.get_instrument(81 + index) for index, name in enumerate(gpioNames)}
+        nets = [(net, gpioNames[net]) for net in range(count)]
+        return soc, ConnectivityTest(soc, manager, gpio_instrument_by_name, nets, kind)
+    return create
+
+
+@pytest.mark.parametrize('kind', ['binary', 'gray', 'walking'])
+def test_connectivity_passes_when_wired(connectivity_test, kind):
+    soc, test = connectivity_test(kind)
+    result = test.run()
+    assert result.passed
+    assert result.faults == []
+    assert result.observed == test.patterns
+    assert soc.transfers == test.steps + 1
+
+
+def test_connectivity_finds_an_open_net(connectivity_test):
+    _, test = connectivity_test(wiring={81: [0], 82: [1], 83: [], 84: [3]}, count=4)
+    result = test.run()
+    assert not result.passed
+    assert result.faults == [ConnectivityFault('stuck low', ['IOA2'])]
+
+
+def test_connectivity_finds_shorted_nets(connectivity_test):
+    _, test = connectivity_test(wiring={81: [0], 82: [1, 2], 83: [1, 2], 84: [3]}, count=4)
+    result = test.run()
+    assert result.faults == [ConnectivityFault('shorted', ['IOA1', 'IOA2'])]
+
+
+def test_connectivity_finds_swapped_nets(connectivity_test):
+    _, test = connectivity_test(wiring={81: [0], 82: [3], 83: [2], 84: [1]}, count=4)
+    result = test.run()
+    assert result.faults == [ConnectivityFault('swapped', ['IOA1', 'IOA3'])]
+
+
+def test_connectivity_undrives_the_nets_when_done(transport, connectivity_test):
+    _, test = connectivity_test(count=3)
+    test.run()
+    assert all(transport.instruments[81 + net].input is None for net in range(3))
+
+
+@pytest.mark.parametrize('kind', ['binary', 'gray'])
+@pytest.mark.parametrize('count', [1, 2, 7, 30])
+def test_connectivity_codes_decode(kind, count):
+    codes, steps = connectivity_codes(count, kind)
+    assert len(set(codes)) == count
+    ones = (1 << steps) - 1
+    assert all(code not in (0, ones) for code in codes)
+    signatures = connectivity_signatures(connectivity_patterns(codes, steps), count)
+    assert signatures == codes
+    assert connectivity_faults(codes, steps, signatures, list(range(count))) == []
+
+
+def test_connectivity_stuck_high():
+    codes, steps = connectivity_codes(3)
+    signatures = list(codes)
+    signatures[1] = (1 << steps) - 1
+    assert connectivity_faults(codes, steps, signatures, ['a', 'b', 'c']) == [ConnectivityFault('stuck high', ['b'])]
+
+
+def test_connectivity_unknown_kind():
+    with pytest.raises(IOError):
+        connectivity_codes(3, 'random')
@@ -0,0 +1,67 @@
+import pytest
+from firefly.production.binary import decode_varuints
+from firefly.production.binary import encode_packet_header
+from firefly.production.binary import encode_varuints
+from firefly.production.instruments import Detour
+from firefly.production.instruments import DetourSource
+
+
+def frame(content, header=b'', size=64):
+    reports = []
+    source = DetourSource(size)
+    source.write(header, content, lambda report: reports.append(bytes(report)))
+    assert source.report_count == len(reports)
+    return reports
+
+
+def reassemble(reports):
+    detour = Detour()
+    for report in reports:
+        assert detour.state != Detour.state_success
+        detour.event(report)
+    assert detour.state == Detour.state_success
+    return bytes(detour.payload())
+
+
+# lengths around one report, the last one byte sequence number (127) and two byte ones past 128 and 256 reports
+@pytest.mark.parametrize('length', [
+    0, 1, 59, 60, 61, 62, 63, 64, 200, 4096, 63 * 127, 63 * 127 + 1, 63 * 128, 63 * 128 + 5, 8100, 63 * 256, 20000,
+])
+def test_round_trip(length):
+    content = bytes(index % 251 for index in range(length))
+    header = encode_packet_header(4, 2, length)
+    reports = frame(content, header)
+    assert all(len(report) == 64 for report in reports)
+    assert reassemble(reports) == header + content
+
+
+def test_sequence_numbers_are_varuints():
+    reports = frame(bytes(300 * 63))
+    assert len(reports) > 256
+    for sequence_number, report in enumerate(reports):
+        assert decode_varuints(report, 0, 1)[0] == [sequence_number]
+    assert reports[127][0] == 127
+    assert reports[128][0:2] == b'\x80\x01'
+    assert reports[256][0:2] == b'\x80\x02'
+
+
+def test_payload_follows_the_sequence_number():
+    content = bytes(index % 251 for index in range(200 * 63))
+    reports = frame(content)
+    data = b''.join(report[len(encode_varuints((sequence,))):] for sequence, report in enumerate(reports))
+    (length,), index = decode_varuints(data, 0, 1)
+    assert data[index:index + length] == content
+
+
+def test_out_of_sequence():
+    reports = frame(bytes(1000))
+    detour = Detour()
+    detour.event(reports[0])
+    with pytest.raises(IOError):
+        detour.event(reports[2])
+
+
+def test_long_echo_on_the_simulator(manager):
+    for length in (8000, 8100, 20000):
+        data = bytes(index % 253 for index in range(length))
+        assert bytes(manager.echo(data)) == data
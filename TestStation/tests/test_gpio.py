@@ -0,0 +1,71 @@
+import pytest
+from firefly.production.gpio import GpioBank
+from firefly.production.instruments import GpioInstrument
+
+
+gpioNames = [f'IOA{index}' for index in range(8)] + [f'DIO{index}' for index in range(16)]
+
+
+@pytest.fixture
+def bank(manager):
+    instruments = [manager.get_instrument(81 + index) for index in range(len(gpioNames))]
+    return GpioBank(manager, instruments, gpioNames)
+
+
+def test_gpio_bank_output_round_trips(transport, bank):
+    bank.configure(direction=GpioInstrument.Direction.output)
+    for mask in (0, bank.all, 0x5a5a5a, 0xa5a5a5, bank.mask(['IOA3', 'DIO15'])):
+        bank.write(mask)
+        assert bank.read() == mask
+    assert transport.instruments[81 + 3].output
+
+
+def test_gpio_bank_writes_only_the_selected_pins(bank):
+    bank.configure(direction=GpioInstrument.Direction.output)
+    bank.write(bank.all)
+    pins = bank.mask(['IOA0', 'IOA1'])
+    bank.write(0, pins)
+    assert bank.read() == bank.all & ~pins
+
+
+def test_gpio_bank_reads_inputs_and_pulls(transport, bank):
+    bank.configure(pull=GpioInstrument.Pull.up, pins=bank.mask(['DIO0']))
+    transport.instruments[81].input = True
+    transport.instruments[82].input = False
+    assert bank.read() == bank.mask(['IOA0', 'DIO0'])
+    transport.instruments[81].analog_input = 1.5
+    assert bank.read_analog()[0] == pytest.approx(1.5)
+
+
+def test_gpio_bank_port(bank):
+    port = bank.port('DIO')
+    assert len(port) == 16
+    assert port.names[0] == 'DIO0'
+    assert port.instruments[0].identifier == 89
+
+
+def test_gpio_bank_configure_skips_shadowed_pins(transport, manager, bank):
+    manager.set_shadowing(True)
+    bank.configure(direction=GpioInstrument.Direction.output)
+    written = transport.reports_written
+    bank.configure(direction=GpioInstrument.Direction.output)
+    assert transport.reports_written == written
+    bank.reset()
+    assert transport.instruments[81].configuration == (0, 0, 0, 0)
+    bank.configure(direction=GpioInstrument.Direction.output)
+    assert transport.reports_written > written + 1
+
+
+def test_gpio_bank_failed_configure_leaves_the_shadow(monkeypatch, transport, manager, bank):
+    manager.set_shadowing(True)
+    write_batch = manager.write_batch
+
+    def failing_write_batch(packets):
+        raise IOError('write failed')
+    monkeypatch.setattr(manager, 'write_batch', failing_write_batch)
+    with pytest.raises(IOError):
+        bank.configure(direction=GpioInstrument.Direction.output)
+    assert all(GpioInstrument.apiTypeSetConfiguration not in instrument.shadow for instrument in bank.instruments)
+    monkeypatch.setattr(manager, 'write_batch', write_batch)
+    bank.configure(direction=GpioInstrument.Direction.output)
+    assert transport.instruments[81].configuration[1] == GpioInstrument.Direction.output.value
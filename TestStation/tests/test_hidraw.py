@@ -0,0 +1,51 @@
+from firefly.production.hidraw import descriptor_report_ids
+
+
+# the fixture's vendor defined 64 byte input and output reports
+usage = bytes([0x06, 0x00, 0xff, 0x09, 0x01, 0xa1, 0x01])
+fields = bytes([0x15, 0x00, 0x26, 0xff, 0x00, 0x75, 0x08, 0x95, 0x40, 0x09, 0x01])
+inputItem = bytes([0x81, 0x02])
+outputItem = bytes([0x91, 0x02])
+featureItem = bytes([0xb1, 0x02])
+endCollection = bytes([0xc0])
+
+
+def report_id(number):
+    return bytes([0x85, number])
+
+
+def test_without_report_ids():
+    descriptor = usage + fields + inputItem + fields + outputItem + endCollection
+    assert descriptor_report_ids(descriptor) == (0, 0)
+
+
+def test_with_report_ids():
+    descriptor = usage + report_id(1) + fields + inputItem + report_id(0x81) + fields + outputItem + endCollection
+    assert descriptor_report_ids(descriptor) == (1, 0x81)
+
+
+def test_first_input_and_output_reports_count():
+    descriptor = (
+        usage + report_id(2) + fields + featureItem + report_id(3) + fields + outputItem + fields + inputItem +
+        report_id(4) + fields + inputItem + outputItem + endCollection
+    )
+    assert descriptor_report_ids(descriptor) == (3, 3)
+
+
+def test_missing_reports():
+    assert descriptor_report_ids(usage + fields + inputItem + endCollection) == (0, None)
+    assert descriptor_report_ids(usage + report_id(5) + fields + outputItem + endCollection) == (None, 5)
+    assert descriptor_report_ids(b'') == (None, None)
+
+
+def test_long_and_four_byte_items():
+    # a long item whose data looks like a report id, then a four byte logical maximum
+    long_item = bytes([0xfe, 0x02, 0x10, 0x85, 0x09])
+    four_byte = bytes([0x27, 0xff, 0xff, 0x00, 0x00])
+    descriptor = usage + long_item + four_byte + report_id(6) + fields + inputItem + outputItem + endCollection
+    assert descriptor_report_ids(descriptor) == (6, 6)
+
+
+def test_truncated_descriptor():
+    descriptor = usage + report_id(7) + fields + inputItem + bytes([0x26, 0xff])
+    assert descriptor_report_ids(descriptor) == (7, None)
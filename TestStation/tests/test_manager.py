@@ -0,0 +1,177 @@
+import json
+import pytest
+from firefly.production.discovery import DiscoveryCache
+from firefly.production.instruments import InstrumentManager
+from firefly.production.instruments import RelayInstrument
+from firefly.production.simulator import SimulatedRelay
+from firefly.production.simulator import SimulatedTransport
+
+
+def test_coalesced_writes_wait_for_flush(transport, manager):
+    manager.set_coalescing(True, delay=60.0)
+    for identifier in range(41, 48):
+        manager.get_instrument(identifier).set(True)
+    assert manager.batch
+    assert not any(transport.instruments[identifier].state for identifier in range(41, 48))
+    written = transport.reports_written
+    manager.flush()
+    assert not manager.batch
+    assert transport.reports_written == written + 1
+    assert all(transport.instruments[identifier].state for identifier in range(41, 48))
+
+
+def test_coalesced_batch_goes_out_with_the_next_call(transport, manager):
+    manager.set_coalescing(True, delay=60.0)
+    manager.get_instrument(41).set(True)
+    assert bytes(manager.echo(b'ping')) == b'ping'
+    assert not manager.batch
+    assert transport.instruments[41].state
+
+
+def test_coalesced_batch_flushes_after_the_delay(transport, manager):
+    manager.set_coalescing(True, delay=0.01)
+    manager.get_instrument(41).set(True)
+    manager.batch_timer.join(1.0)
+    assert not manager.batch
+    assert transport.instruments[41].state
+
+
+def test_coalesced_batch_flushes_at_the_limit(transport, manager):
+    manager.set_coalescing(True, delay=60.0, limit=16)
+    for identifier in range(41, 48):
+        manager.get_instrument(identifier).set(True)
+    assert len(manager.batch) <= 16
+    assert transport.instruments[41].state
+    manager.flush()
+    assert all(transport.instruments[identifier].state for identifier in range(41, 48))
+
+
+def cached_manager(cache, transport=None):
+    manager = InstrumentManager(transport if transport is not None else SimulatedTransport())
+    manager.open()
+    manager.discover_instruments(cache)
+    manager.read_timeout = 1.0
+    return manager
+
+
+def test_discovery_cache_warm_start(tmp_path):
+    cache = DiscoveryCache(str(tmp_path / 'discovery.json'))
+    cached_manager(cache)
+    entry = cache.get('simulator')
+    assert entry is not None
+    assert ('Relay', 41) in entry.instruments
+
+    transport = SimulatedTransport()
+    manager = cached_manager(DiscoveryCache(cache.path), transport)
+    # the warm start does not wait for the discovery response
+    assert transport.reports_read == 0
+    assert manager.discovery is not None
+    assert manager.get_instrument(41).identifier == 41
+    assert bytes(manager.echo(b'ping')) == b'ping'
+    assert manager.discovery is None
+    assert manager.validate_discovery()
+
+
+def test_stale_discovery_cache_is_refreshed(tmp_path):
+    path = str(tmp_path / 'discovery.json')
+    with open(path, 'w') as file:
+        json.dump({'simulator': {'digest': 'stale', 'instruments': [['Relay', 41]]}}, file)
+    manager = cached_manager(DiscoveryCache(path))
+    with pytest.raises(IOError):
+        manager.get_instrument(42)
+    assert not manager.validate_discovery()
+    assert manager.get_instrument(42).identifier == 42
+    entry = DiscoveryCache(path).get('simulator')
+    assert entry.digest != 'stale'
+    assert ('Relay', 42) in entry.instruments
+    assert bytes(manager.echo(b'ping')) == b'ping'
+
+
+def test_changed_fixture_fails_the_next_call(tmp_path):
+    cache = DiscoveryCache(str(tmp_path / 'discovery.json'))
+    cached_manager(cache)
+    transport = SimulatedTransport()
+    transport.add(SimulatedRelay(60))
+    manager = cached_manager(DiscoveryCache(cache.path), transport)
+    with pytest.raises(IOError, match='discovery cache'):
+        manager.echo(b'ping')
+    assert manager.discovery is None
+    assert manager.get_instrument(60).identifier == 60
+    assert ('Relay', 60) in DiscoveryCache(cache.path).get('simulator').instruments
+    assert bytes(manager.echo(b'ping')) == b'ping'
+    assert manager.validate_discovery()
+
+
+def test_discovery_cache_goes_stale_when_the_fixture_changes(tmp_path):
+    cache = DiscoveryCache(str(tmp_path / 'discovery.json'))
+    cached_manager(cache)
+    transport = SimulatedTransport()
+    transport.add(SimulatedRelay(60))
+    manager = cached_manager(DiscoveryCache(cache.path), transport)
+    assert not manager.validate_discovery()
+    assert manager.get_instrument(60).identifier == 60
+    assert ('Relay', 60) in DiscoveryCache(cache.path).get('simulator').instruments
+    assert bytes(manager.echo(b'ping')) == b'ping'
+
+
+def test_shadowed_writes_are_skipped(transport, manager):
+    manager.set_shadowing(True)
+    relay = manager.get_instrument(41)
+    relay.set(True)
+    written = transport.reports_written
+    relay.set(True)
+    assert transport.reports_written == written
+    relay.set(False)
+    assert transport.reports_written == written + 1
+    assert not transport.instruments[41].state
+
+
+def test_failed_write_leaves_the_shadow_unset(monkeypatch, transport, manager):
+    manager.set_shadowing(True)
+    relay = manager.get_instrument(41)
+    write = manager.write
+
+    def failing_write(identifier, api, content=None, flush=False):
+        raise IOError('write failed')
+    monkeypatch.setattr(manager, 'write', failing_write)
+    with pytest.raises(IOError):
+        relay.set(True)
+    monkeypatch.setattr(manager, 'write', write)
+    relay.set(True)
+    assert transport.instruments[41].state
+
+
+def test_reset_invalidates_the_shadow(transport, manager):
+    manager.set_shadowing(True)
+    relay = manager.get_instrument(41)
+    relay.set(True)
+    relay.reset()
+    assert relay.shadow == {}
+    relay.set(True)
+    assert bytes(manager.echo(b'sync')) == b'sync'
+    assert transport.instruments[41].state
+
+
+def test_reset_instruments_invalidates_every_shadow(transport, manager):
+    manager.set_shadowing(True)
+    relays = [manager.get_instrument(identifier) for identifier in range(41, 44)]
+    for relay in relays:
+        relay.set(True)
+    manager.reset_instruments()
+    assert bytes(manager.echo(b'sync')) == b'sync'
+    assert not any(transport.instruments[relay.identifier].state for relay in relays)
+    assert all(relay.shadow == {} for relay in relays)
+    for relay in relays:
+        relay.set(True)
+    assert bytes(manager.echo(b'sync')) == b'sync'
+    assert all(transport.instruments[relay.identifier].state for relay in relays)
+
+
+def test_shadowing_is_off_by_default(transport, manager):
+    relay = manager.get_instrument(41)
+    assert isinstance(relay, RelayInstrument)
+    assert relay.shadow is None
+    relay.set(True)
+    written = transport.reports_written
+    relay.set(True)
+    assert transport.reports_written == written + 1
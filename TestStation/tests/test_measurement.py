@@ -0,0 +1,64 @@
+import random
+from firefly.production.measurement import AdaptiveMeasurement
+from firefly.production.measurement import measure
+
+
+def run(measurement, values):
+    for value in values:
+        if measurement.add(value):
+            break
+    return measurement.result()
+
+
+def test_noise_after_identical_samples_is_not_rejected():
+    generator = random.Random(1)
+    values = [1.0] * 16 + [1.0 + generator.gauss(0, 0.02) for _ in range(2000)]
+    result = run(AdaptiveMeasurement(outlier_sigma=4, max_samples=300), values)
+    assert result.count == 300
+    assert result.rejected < 10
+
+
+def test_outliers_are_rejected():
+    generator = random.Random(2)
+    measurement = AdaptiveMeasurement(outlier_sigma=4)
+    for _ in range(50):
+        measurement.add(1.0 + generator.gauss(0, 0.02))
+    assert not measurement.accept(3.0)
+    assert measurement.rejected == 1
+
+
+def test_outlier_floor_keeps_small_deviations():
+    measurement = AdaptiveMeasurement(outlier_sigma=1, outlier_floor=0.5, min_samples=4)
+    for value in (1.0, 1.01, 0.99, 1.0):
+        measurement.add(value)
+    assert measurement.accept(1.4)
+    assert not measurement.accept(2.0)
+
+
+def test_rejections_bound_the_measurement():
+    generator = random.Random(3)
+    values = [1.0 + generator.gauss(0, 0.001) for _ in range(16)] + [100.0] * 1000
+    result = run(AdaptiveMeasurement(outlier_sigma=3, max_samples=50), values)
+    assert result.count == 16
+    assert result.rejected == 50
+    assert not result.converged
+
+
+def test_accepted_samples_count_toward_max_samples():
+    generator = random.Random(4)
+    values = [1.0 + generator.gauss(0, 0.02) for _ in range(1000)]
+    result = run(AdaptiveMeasurement(outlier_sigma=2, max_samples=100), values)
+    assert result.count == 100
+
+
+def test_limits_decide_the_measurement():
+    generator = random.Random(5)
+    values = [2.0 + generator.gauss(0, 0.01) for _ in range(1000)]
+    result = run(AdaptiveMeasurement(low=1.0, high=3.0), values)
+    assert result.converged
+    assert result.count == 16
+
+
+def test_measure_a_simulated_instrument(manager):
+    result = measure(manager.get_instrument(48), low=-1.0, high=1.0)
+    assert result.count >= 16
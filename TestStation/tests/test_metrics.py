@@ -0,0 +1,46 @@
+import io
+from firefly.production.metrics import Histogram
+
+
+def test_histogram_percentiles_are_bucket_upper_edges():
+    histogram = Histogram()
+    for _ in range(99):
+        histogram.record(10e-6)
+    histogram.record(1.0)
+    assert 10e-6 <= histogram.percentile(0.50) < 10e-6 * 1.2
+    assert histogram.percentile(0.99) == histogram.percentile(0.50)
+    assert 1.0 <= histogram.percentile(1.0) < 1.2
+    assert Histogram().percentile(0.5) == 0.0
+
+
+def test_metrics_count_calls_and_writes(manager):
+    metrics = manager.enable_metrics()
+    relay = manager.get_instrument(41)
+    relay.set(True)
+    relay.set(False)
+    manager.get_instrument(48).convert()
+    manager.echo(bytes(100))
+    snapshots = {(snapshot.category, snapshot.kind, snapshot.api): snapshot for snapshot in metrics.snapshot()}
+    write = snapshots[('Relay', 'write', 'SetState')]
+    assert (write.count, write.bytes_sent, write.bytes_received, write.reports_sent) == (2, 2, 0, 2)
+    call = snapshots[('Voltage', 'call', 'ConvertVoltage')]
+    assert (call.count, call.bytes_sent, call.bytes_received) == (1, 0, 4)
+    echo = snapshots[('Manager', 'call', 'Echo')]
+    assert (echo.count, echo.bytes_sent, echo.bytes_received, echo.reports_sent, echo.reports_received) == (
+        1, 100, 100, 2, 2
+    )
+    assert abs(sum(snapshot.fraction for snapshot in snapshots.values()) - 1.0) < 1e-9
+    file = io.StringIO()
+    metrics.dump(file)
+    assert 'ConvertVoltage' in file.getvalue()
+    metrics.clear()
+    assert metrics.snapshot() == []
+
+
+def test_metrics_are_off_by_default(manager):
+    assert manager.metrics is None
+    manager.echo(b'x')
+    metrics = manager.enable_metrics()
+    assert manager.enable_metrics() is metrics
+    manager.disable_metrics()
+    assert manager.metrics is None
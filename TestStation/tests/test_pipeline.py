@@ -0,0 +1,88 @@
+import asyncio
+import pytest
+from firefly.production.instruments import InstrumentManager
+from firefly.production.simulator import SimulatedTransport
+
+
+@pytest.fixture
+def read_timeout():
+    return 0.1
+
+
+# Drops all but the first keep reports of the responses queued so far.
+def drop_reports(transport, keep=0):
+    with transport.condition:
+        while len(transport.reports) > keep:
+            transport.reports.pop()
+
+
+def test_pipelined_results_come_back_in_order(manager):
+    futures = [manager.echo_pipelined(bytes([index] * (index + 1))) for index in range(32)]
+    assert [bytes(future.result()) for future in futures] == [bytes([index] * (index + 1)) for index in range(32)]
+    assert not manager.pending
+
+
+def test_dropped_response_does_not_answer_the_next_call(transport, manager):
+    lost = manager.echo_pipelined(b'lost')
+    drop_reports(transport)
+    with pytest.raises(IOError):
+        lost.result()
+    assert not manager.pending
+    assert bytes(manager.echo(b'next')) == b'next'
+    assert bytes(manager.echo(b'after')) == b'after'
+
+
+def test_partial_response_does_not_corrupt_the_next_packet(transport, manager):
+    lost = manager.echo_pipelined(bytes(range(200)))
+    drop_reports(transport, keep=1)
+    with pytest.raises(IOError):
+        lost.result()
+    assert bytes(manager.echo(b'next')) == b'next'
+
+
+def test_dropped_response_fails_every_pending_call(transport, manager):
+    futures = [manager.echo_pipelined(bytes([index])) for index in range(4)]
+    drop_reports(transport)
+    for future in futures:
+        with pytest.raises(IOError):
+            future.result()
+    assert bytes(manager.echo(b'next')) == b'next'
+
+
+# A simulator without a file descriptor, so the event loop reads through the executor fallback.
+class PolledTransport(SimulatedTransport):
+
+    def fileno(self):
+        return None
+
+
+@pytest.mark.parametrize('transport', [SimulatedTransport, PolledTransport], indirect=True)
+def test_async_dropped_response_fails_and_resynchronises(transport, manager):
+    manager.read_timeout = 0.2
+
+    async def run():
+        lost = await manager.call_pipelined_async(manager.identifier, InstrumentManager.apiTypeEcho, b'lost')
+        drop_reports(transport)
+        with pytest.raises(IOError):
+            await asyncio.wait_for(lost.result_async(), 5)
+        assert not manager.pending
+        futures = [
+            await manager.call_pipelined_async(manager.identifier, InstrumentManager.apiTypeEcho, bytes([index]))
+            for index in range(8)
+        ]
+        return [bytes(await future.result_async()) for future in futures]
+
+    try:
+        assert asyncio.run(run()) == [bytes([index]) for index in range(8)]
+    finally:
+        manager.stop_reader()
+
+
+def test_unexpected_response_fails_the_pending_calls(transport, manager):
+    transport.send(41, 0x7f, b'stray')
+    futures = [manager.echo_pipelined(bytes([index])) for index in range(2)]
+    with pytest.raises(IOError, match='unexpected response'):
+        futures[0].result()
+    assert not manager.pending
+    with pytest.raises(IOError, match='unexpected response'):
+        futures[1].result()
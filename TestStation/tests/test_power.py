@@ -0,0 +1,110 @@
+import pytest
+from types import SimpleNamespace
+from firefly.production.instruments import RelayInstrument
+from firefly.production.power import PowerCheck
+from firefly.production.power import PowerPlan
+from firefly.production.power import PowerState
+
+
+relayNames = [
+    'vusb_to_dut', 'dusb_to_dut', 'sense', 'fill_supercap', 'drain_supercap', 'supercap_to_dut', 'battery_to_dut'
+]
+
+
+# The instruments of a Fixture that a PowerPlan uses, without the rest of Fixture.setup.
+@pytest.fixture
+def fixture(manager):
+    fixture = SimpleNamespace(manager=manager)
+    for index, name in enumerate(relayNames):
+        setattr(fixture, f'relay_{name}', manager.get_instrument(41 + index))
+    fixture.voltage_battery_instrument = manager.get_instrument(48)
+    fixture.voltage_supercap_instrument = manager.get_instrument(49)
+    fixture.current_usb_instrument = manager.get_instrument(50)
+    fixture.battery_instrument = manager.get_instrument(51)
+    return fixture
+
+
+def test_power_plan_compiles_states_into_steps(fixture):
+    checks = [PowerCheck('current_usb', 0.0, 0.1)]
+    plan = PowerPlan(fixture, [
+        PowerState.mode('off'),
+        PowerState.mode('usb', settle=0.01, checks=checks),
+        PowerState(battery_voltage=3.8, battery_enabled=True, settle=0.01),
+        PowerState(settle=0.02),
+        PowerState.mode('battery', checks=checks),
+    ])
+    assert len(plan.steps) == 3
+    first, second, third = plan.steps
+    assert len(first.writes) == 6
+    assert first.settle == pytest.approx(0.01)
+    assert first.checks == checks
+    assert len(second.writes) == 2
+    assert second.settle == pytest.approx(0.03)
+    assert second.checks == []
+    assert third.checks == checks
+    # relays are opened before any are closed
+    closed = [write[2] for write in third.writes]
+    assert closed == sorted(closed)
+
+
+def test_power_plan_runs_on_the_fixture(transport, fixture):
+    transport.instruments[50].current = 0.05
+    transport.instruments[48].voltage = 3.8
+    plan = PowerPlan(fixture, [
+        PowerState.mode('usb', settle=0.01, checks=[PowerCheck('current_usb', 0.0, 0.1)]),
+        PowerState.mode(
+            'battery', battery_voltage=3.8, battery_enabled=True, settle=0.01,
+            checks=[PowerCheck('voltage_battery', 3.7, 3.9), PowerCheck('current_battery', None, 0.1)]
+        ),
+    ])
+    result = plan.run()
+    assert result.passed
+    assert len(result.steps) == 2
+    assert result.steps[0].record.current_usb == pytest.approx(0.05)
+    assert result.steps[1].record.voltage_battery == pytest.approx(3.8)
+    assert result.elapsed >= 0.02
+    assert transport.instruments[47].state
+    assert not transport.instruments[41].state
+    assert transport.instruments[51].voltage == pytest.approx(3.8)
+    assert transport.instruments[51].enabled
+
+
+def test_power_plan_reports_failed_checks(transport, fixture):
+    transport.instruments[49].voltage = 1.0
+    check = PowerCheck('voltage_supercap', 2.0, None)
+    result = PowerPlan(fixture, [PowerState.mode('supercap', checks=[check])]).run()
+    assert not result.passed
+    assert result.steps[0].failures == [(check, pytest.approx(1.0))]
+    assert transport.instruments[46].state
+
+
+def test_power_plan_skips_shadowed_relays(transport, fixture):
+    fixture.manager.set_shadowing(True)
+    plan = PowerPlan(fixture, [PowerState.mode('usb')])
+    plan.run()
+    written = transport.reports_written
+    plan.run()
+    assert transport.reports_written == written
+
+
+def test_power_plan_failed_write_leaves_the_shadow(monkeypatch, transport, fixture):
+    manager = fixture.manager
+    manager.set_shadowing(True)
+    plan = PowerPlan(fixture, [PowerState.mode('usb')])
+    write_batch = manager.write_batch
+
+    def failing_write_batch(packets):
+        raise IOError('write failed')
+    monkeypatch.setattr(manager, 'write_batch', failing_write_batch)
+    with pytest.raises(IOError):
+        plan.run()
+    assert fixture.relay_vusb_to_dut.shadow == {}
+    monkeypatch.setattr(manager, 'write_batch', write_batch)
+    plan.run()
+    assert transport.instruments[41].state
+    assert fixture.relay_vusb_to_dut.shadow == {RelayInstrument.apiTypeSetState: (True,)}
+
+
+def test_power_plan_unknown_relay(fixture):
+    with pytest.raises(IOError):
+        PowerPlan(fixture, [PowerState({'missing': True})])
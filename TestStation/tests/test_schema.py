@@ -0,0 +1,141 @@
+import pytest
+from firefly.production import instruments
+from firefly.production import schema
+from firefly.production.binary import FDBinary
+from firefly.production.instruments import SerialWireInstrument
+from firefly.production.instruments import StorageInstrument
+from firefly.production.schema import Api
+
+
+# A value for each field type, and how FDBinary (the way every api was coded by hand before schemas) puts it.
+def sample(type):
+    if type is schema.uint8:
+        return 0xa5, FDBinary.put_uint8
+    if type is schema.uint16:
+        return 0xa5b6, FDBinary.put_uint16
+    if type is schema.uint32:
+        return 0xdeadbeef, FDBinary.put_uint32
+    if type is schema.uint64:
+        return 0x0123456789abcdef, FDBinary.put_uint64
+    if type is schema.float16:
+        return 1.5, FDBinary.put_float16
+    if type is schema.float32:
+        return -2.25, FDBinary.put_float32
+    if type is schema.float64:
+        return 3.125, FDBinary.put_float64
+    if type is schema.boolean:
+        return True, lambda binary, value: binary.put_uint8(int(value))
+    if type is schema.varuint:
+        return 300, FDBinary.put_varuint
+    if type is schema.varint:
+        return -300, FDBinary.put_varint
+    if type is schema.string:
+        return 'firmware.bin', FDBinary.put_string
+    if type is schema.remaining:
+        return b'\x01\x02\x03', FDBinary.put_bytes
+    if isinstance(type, schema.FixedType) and type.format.endswith('s'):
+        return bytes(range(int(type.format[:-1]))), FDBinary.put_bytes
+    if isinstance(type, schema.RepeatedType):
+        records = [sample_record(type.schema.fields)[0] for _ in range(2)]
+
+        def put(binary, records):
+            binary.put_varuint(len(records))
+            for record in records:
+                for (_, field_type), value in zip(type.schema.fields, record):
+                    sample(field_type)[1](binary, value)
+        return records, put
+    raise AssertionError(f'no sample for {type}')
+
+
+def sample_record(fields):
+    values = []
+    binary = FDBinary()
+    for _, type in fields:
+        value, put = sample(type)
+        put(binary, value)
+        values.append(value)
+    return tuple(values), bytes(binary.data)
+
+
+def declared_apis():
+    apis = []
+    for owner in vars(instruments).values():
+        if isinstance(owner, type):
+            for name, value in vars(owner).items():
+                if isinstance(value, Api):
+                    apis.append(pytest.param(value, id=f'{owner.__name__}.{name}'))
+    return apis
+
+
+def plain(value):
+    if isinstance(value, memoryview):
+        return bytes(value)
+    if isinstance(value, list):
+        return [tuple(plain(item) for item in record) for record in value]
+    return value
+
+
+@pytest.mark.parametrize('api', declared_apis())
+def test_api_matches_fdbinary(api):
+    for coder in (api.arguments, api.results):
+        values, expected = sample_record(coder.fields)
+        assert bytes(coder.encode(values)) == expected
+        assert tuple(plain(value) for value in coder.decode(expected)) == values
+
+
+def test_apis_are_declared():
+    assert len(declared_apis()) >= 40
+
+
+# Golden bytes for apis that used to be coded by hand with FDBinary.
+def test_golden_bytes():
+    assert StorageInstrument.apiFileAddress.arguments.encode(('a.bin',)) == b'\x05a.bin'
+    results = StorageInstrument.apiFileAddress.results.decode(b'\x01\x00\x10\x00\x00')
+    assert (results.result, results.address) == (True, 0x1000)
+    encoded = StorageInstrument.apiFileRead.arguments.encode(('f', 0x100, 0x1000))
+    assert encoded == b'\x01f\x00\x01\x00\x00\x00\x10\x00\x00'
+    first = b'\x01a\x03\x00\x00\x00\x04\x00\x00\x00\x05\x00\x00\x00'
+    second = b'\x02bc\x06\x00\x00\x00\x07\x00\x00\x00\x08\x00\x00\x00'
+    files = StorageInstrument.apiFileList.results.decode(b'\x02' + first + second).files
+    assert [tuple(file) for file in files] == [('a', 3, 4, 5), ('bc', 6, 7, 8)]
+    assert StorageInstrument.apiFileList.results.encode(([('a', 3, 4, 5)],)) == b'\x01' + first
+    results = SerialWireInstrument.apiConnect.results.decode(b'\x00\x77\x14\xa0\x2b')
+    assert (results.code, results.dpid) == (0, 0x2ba01477)
+    assert StorageInstrument.apiWrite.arguments.encode((0x1000, 3, b'abc')) == b'\x80\x20\x03abc'
+    assert StorageInstrument.apiRead.arguments.encode((0, 4096, 0, 0)) == b'\x00\x80\x20\x00\x00'
+
+
+def test_short_responses():
+    with pytest.raises(IOError):
+        SerialWireInstrument.apiConnect.results.decode(b'\x00\x77')
+    with pytest.raises(IOError):
+        StorageInstrument.apiFileList.results.decode(b'\x02\x01a\x03\x00\x00\x00\x04\x00\x00\x00\x05\x00\x00\x00')
+
+
+def test_base_type_is_abstract():
+    with pytest.raises(NotImplementedError):
+        schema.Type().encode(bytearray(), 0)
+    with pytest.raises(NotImplementedError):
+        schema.Type().decode(b'', 0)
+
+
+def test_converted_calls_on_the_simulator(transport, manager, storage_instrument):
+    assert storage_instrument.file_mkfs()
+    assert storage_instrument.file_open('a.bin', StorageInstrument.FA_CREATE_ALWAYS)
+    storage_instrument.file_write('a.bin', 0, b'abcdef')
+    assert [(info.name, info.size) for info in storage_instrument.file_list()] == [('a.bin', 6)]
+    address = storage_instrument.file_address('a.bin')
+    assert bytes(storage_instrument.read(address, 6)) == b'abcdef'
+    assert bytes(storage_instrument.file_read('a.bin', 2, 3)) == b'cde'
+    assert manager.get_instrument(2).connect() == transport.instruments[2].dpid
+
+
+# The simulator reads packets in the firmware layout, so a schema that disagrees with it is rejected.
+def test_simulator_rejects_a_mismatched_schema(manager, storage_instrument):
+    expand = Api(StorageInstrument.apiTypeFileExpand, [('name', schema.string), ('size', schema.varuint)])
+    with pytest.raises(IOError):
+        storage_instrument.invoke_api(expand, 'a.bin', 1 << 20)
+    relay = manager.get_instrument(41)
+    wide = Api(instruments.RelayInstrument.apiTypeSetState, [('value', schema.uint32)])
+    with pytest.raises(IOError):
+        relay.invoke_api(wide, 1)
@@ -0,0 +1,148 @@
+import pytest
+from firefly.production.instruments import SerialWireDebugBatch
+from firefly.production.instruments import SerialWireDebugTransfer
+
+
+@pytest.fixture
+def simulated(transport):
+    return transport.instruments[2]
+
+
+@pytest.fixture
+def serial_wire(manager):
+    return manager.get_instrument(2)
+
+
+def test_batch_matches_transfers(simulated, serial_wire):
+    simulated.registers[200] = 0x12345678
+    simulated.write_uint32(0x20000010, 0xcafef00d)
+
+    batch = SerialWireDebugBatch()
+    batch.write_port(SerialWireDebugTransfer.portDebug, 8, 0)
+    reads = [
+        batch.read_port(SerialWireDebugTransfer.portDebug, 0),
+        batch.read_register(200),
+        batch.read_memory(0x20000010),
+    ]
+    batch.write_register(3, 0x55aa55aa)
+    batch.write_memory(0x20000020, 0x01020304)
+    batch.write_data(0x20000030, [1, 2, 3, 4, 5, 6, 7, 8])
+    reads += [
+        batch.read_register(3),
+        batch.read_data(0x20000030, 8),
+        batch.read_memory(0x20000020),
+    ]
+    serial_wire.transfer(batch)
+
+    transfers = [
+        SerialWireDebugTransfer.read_port(SerialWireDebugTransfer.portDebug, 0),
+        SerialWireDebugTransfer.read_register(200),
+        SerialWireDebugTransfer.read_memory(0x20000010),
+        SerialWireDebugTransfer.read_register(3),
+        SerialWireDebugTransfer.read_data(0x20000030, 8),
+        SerialWireDebugTransfer.read_memory(0x20000020),
+    ]
+    serial_wire.transfer(transfers)
+    assert len(batch) == 10
+    assert [batch.data[read] for read in reads] == [transfer.data for transfer in transfers]
+    assert batch.data[reads[0]] == simulated.dpid
+    assert batch.data[reads[1]] == 0x12345678
+    assert batch.data[reads[2]] == 0xcafef00d
+    assert batch.data[reads[3]] == 0x55aa55aa
+    assert batch.data[reads[4]] == 0x04030201
+    assert batch.data[reads[5]] == 0x01020304
+
+
+def test_batch_access_port(simulated, serial_wire):
+    simulated.write_uint32(0x20000040, 0x0badf00d)
+    batch = SerialWireDebugBatch()
+    batch.select_and_write_access_port(4, 0x20000040)
+    read = batch.select_and_read_access_port(0x0c)
+    serial_wire.transfer(batch)
+    assert batch.data[read] == 0x0badf00d
+    batch = SerialWireDebugBatch()
+    read = batch.read_port(SerialWireDebugTransfer.portAccess, 0x0c)
+    serial_wire.transfer(batch)
+    assert batch.data[read] == 0x0badf00d
+
+
+def test_batch_write_data_accepts_bytes_and_lists(simulated, serial_wire):
+    batch = SerialWireDebugBatch()
+    batch.write_data(0x20000000, b'\x01\x02\x03\x04')
+    batch.write_data(0x20000004, bytearray(b'\x05\x06\x07\x08'))
+    batch.write_data(0x20000008, [9, 10, 11, 12])
+    serial_wire.transfer(batch)
+    assert bytes(simulated.read_memory(0x20000000, 12)) == bytes(range(1, 13))
+
+
+def test_batch_without_reads(simulated, serial_wire):
+    batch = SerialWireDebugBatch()
+    batch.write_memory(0x20000000, 7)
+    serial_wire.transfer(batch)
+    assert batch.data == []
+    assert simulated.read_uint32(0x20000000) == 7
+
+
+def test_batch_echo_mismatch(serial_wire):
+    batch = SerialWireDebugBatch()
+    batch.read_memory(0x20000000)
+    # as if the fixture had answered a read of another address
+    batch.echoes[0] = SerialWireDebugBatch.addressStruct.pack(SerialWireDebugTransfer.typeReadMemory, 0x20000004)
+    with pytest.raises(IOError):
+        serial_wire.transfer(batch)
+
+
+def test_batch_response_length_mismatch():
+    batch = SerialWireDebugBatch()
+    batch.read_memory(0x20000000)
+    with pytest.raises(IOError):
+        batch.decode(bytes(16), 0)
+
+
+# Encodes memory transfers one at a time: (address,) reads and (address, data) writes.
+def single_encode(transfers):
+    batch = SerialWireDebugBatch()
+    for transfer in transfers:
+        if len(transfer) == 1:
+            batch.read_memory(*transfer)
+        else:
+            batch.write_memory(*transfer)
+    return batch.encode()
+
+
+def test_bulk_builders_match_single_transfers():
+    addresses = [0x20000000 + 4 * index for index in range(100)]
+    values = [index * 0x01010101 for index in range(100)]
+    single = SerialWireDebugBatch()
+    for address, value in zip(addresses, values):
+        single.write_memory(address, value)
+    single_reads = [single.read_memory(address) for address in addresses]
+    bulk = SerialWireDebugBatch()
+    bulk.write_memories(addresses, values)
+    first = bulk.read_memories(addresses)
+    assert first == single_reads[0] == 0
+    assert (len(bulk), bulk.echoes) == (len(single), single.echoes)
+    assert bulk.encode() == single.encode()
+    cycle = SerialWireDebugBatch()
+    cycle.write_memory(0x50000508, 8)
+    cycle.read_memory(0x20000000)
+    repeated = SerialWireDebugBatch()
+    repeated.read_memory(0x20000004)
+    assert repeated.extend(cycle, 3) == 1
+    assert len(repeated) == 7
+    assert repeated.encode() == single_encode([(0x20000004,)] + [(0x50000508, 8), (0x20000000,)] * 3)
+    with pytest.raises(IOError):
+        bulk.write_memories(addresses, values[1:])
+
+
+def test_thousands_of_transfers_cross_the_transport(simulated, serial_wire):
+    simulated.write_uint32(0x20000000, 0x600df00d)
+    batch = SerialWireDebugBatch()
+    batch.write_memories([0x20001000 + 4 * index for index in range(2000)], list(range(2000)))
+    read = batch.read_memory(0x20000000)
+    reads = batch.read_memories([0x20001000, 0x20001000 + 4 * 1999])
+    serial_wire.transfer(batch)
+    assert len(batch) == 2003
+    assert batch.data[read] == 0x600df00d
+    assert batch.data[reads:reads + 2] == [0, 1999]
+    assert simulated.read_uint32(0x20001000 + 4 * 1234) == 1234
@@ -0,0 +1,78 @@
+import os
+import pytest
+from firefly.production.sink import CaptureSink
+from firefly.production.sink import spillRecord
+
+
+def filled_sink(count, **options):
+    sink = CaptureSink(resolution=1.0, factor=4, tier_count=3, **options)
+    for index in range(count):
+        sink.add(index + 0.5, float(index))
+    return sink
+
+
+def test_raw_window_from_the_ring():
+    sink = filled_sink(100, raw_capacity=64)
+    window = sink.window(60.0, 70.0)
+    assert list(window.times) == [index + 0.5 for index in range(60, 70)]
+    assert list(window.means) == [float(index) for index in range(60, 70)]
+    assert window.resolution is None
+
+
+def test_raw_window_past_the_ring_without_spill():
+    sink = filled_sink(100, raw_capacity=64)
+    window = sink.window(0.0, 40.0)
+    assert window.times[0] == 36.5
+
+
+def test_spilled_samples_answer_old_windows(tmp_path, monkeypatch):
+    monkeypatch.setattr(CaptureSink, 'spillChunk', 16)
+    path = str(tmp_path / 'spill.bin')
+    sink = filled_sink(100, raw_capacity=8, spill_path=path)
+    assert sink.spill_capacity == 112
+    window = sink.window(10.0, 20.0)
+    assert list(window.times) == [index + 0.5 for index in range(10, 20)]
+    assert list(window.minimums) == [float(index) for index in range(10, 20)]
+    window = sink.window(95.0, 200.0)
+    assert list(window.times) == [index + 0.5 for index in range(95, 100)]
+    sink.close()
+    assert os.path.getsize(path) == 100 * spillRecord.size
+    with open(path, 'rb') as file:
+        records = list(spillRecord.iter_unpack(file.read()))
+    assert records == [(index + 0.5, float(index)) for index in range(100)]
+
+
+def test_tier_windows():
+    # a tier sees a sample once the finer bucket holding it closes, so fill past the window
+    sink = filled_sink(80, raw_capacity=8)
+    window = sink.window(0.0, 64.0, resolution=4.0)
+    assert window.resolution == 4.0
+    assert list(window.times) == [4.0 * bucket + 0.5 for bucket in range(16)]
+    assert list(window.minimums) == [4.0 * bucket for bucket in range(16)]
+    assert list(window.maximums) == [4.0 * bucket + 3 for bucket in range(16)]
+    assert list(window.means) == [4.0 * bucket + 1.5 for bucket in range(16)]
+    window = sink.window(0.0, 64.0, resolution=16.0)
+    assert window.resolution == 16.0
+    assert list(window.means) == [16.0 * bucket + 7.5 for bucket in range(4)]
+
+
+def test_tier_window_falls_back_to_a_coarser_tier():
+    sink = CaptureSink(resolution=1.0, factor=4, tier_count=3, tier_capacity=8, raw_capacity=8)
+    for index in range(64):
+        sink.add(index + 0.5, float(index))
+    window = sink.window(0.0, 64.0, resolution=1.0)
+    assert window.resolution == 16.0
+    assert window.minimums[0] == 0.0
+
+
+def test_empty_window():
+    window = CaptureSink(raw_capacity=8).window(0.0, 1.0)
+    assert len(window.times) == 0
+
+
+def test_memory_size_is_fixed():
+    sink = CaptureSink(tier_count=2, tier_capacity=16, raw_capacity=32)
+    size = sink.memory_size()
+    for index in range(1000):
+        sink.add(index * 1.0e-3, 1.0)
+    assert sink.memory_size() == size == pytest.approx(2 * 16 * 5 * 8 + 32 * 2 * 8)
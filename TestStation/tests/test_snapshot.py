@@ -0,0 +1,37 @@
+import pytest
+from firefly.production.snapshot import Snapshot
+
+
+def test_snapshot_reads_every_channel_in_one_exchange(transport, manager):
+    transport.instruments[48].voltage = 3.5
+    transport.instruments[50].current = 0.125
+    transport.instruments[51].current = 0.5
+    transport.instruments[81].input = True
+    transport.instruments[82].analog_input = 1.25
+    snapshot = Snapshot(manager, [
+        ('battery', manager.get_instrument(48)),
+        ('usb', manager.get_instrument(50)),
+        ('battery_current', manager.get_instrument(51)),
+        ('ioa0', manager.get_instrument(81)),
+        ('ioa1', manager.get_instrument(82), 'analog'),
+    ])
+    written = transport.reports_written
+    record = snapshot.read()
+    assert transport.reports_written == written + 1
+    assert record._fields == ('time', 'battery', 'usb', 'battery_current', 'ioa0', 'ioa1')
+    assert tuple(record[1:]) == (3.5, 0.125, 0.5, True, 1.25)
+
+
+def test_started_snapshot_overlaps_other_calls(transport, manager):
+    transport.instruments[48].voltage = 1.5
+    snapshot = Snapshot(manager, [('battery', manager.get_instrument(48))])
+    started = snapshot.start()
+    assert bytes(manager.echo(b'between')) == b'between'
+    record = snapshot.finish(started)
+    assert record.time == started[0]
+    assert record.battery == 1.5
+
+
+def test_snapshot_rejects_instruments_without_a_conversion(manager):
+    with pytest.raises(IOError, match='no snapshot conversion'):
+        Snapshot(manager, [('relay', manager.get_instrument(41))])
@@ -0,0 +1,45 @@
+import time
+import pytest
+from firefly.production.instruments import StorageInstrument
+
+
+def test_write_window_defaults_to_two_chunks(storage_instrument):
+    assert storage_instrument.write_window == 2
+
+
+# With the fixture busy programming each chunk, a window of two overlaps the next chunk with the programming.
+def test_write_window_overlaps_programming(transport, manager, storage_instrument):
+    transport.latency = 0.0002
+    transport.instruments[4].program_time = 0.01 / StorageInstrument.maxTransferLength
+    data = bytes(8 * StorageInstrument.maxTransferLength)
+    elapsed = {}
+    for window in (1, 2):
+        storage_instrument.write_window = window
+        start = time.perf_counter()
+        storage_instrument.write(0, data)
+        elapsed[window] = time.perf_counter() - start
+    assert elapsed[2] < elapsed[1]
+
+
+@pytest.mark.parametrize('window', [1, 2, 4])
+@pytest.mark.parametrize(
+    'length', [1, StorageInstrument.maxTransferLength, 5 * StorageInstrument.maxTransferLength + 7]
+)
+def test_windowed_write_round_trips(transport, manager, storage_instrument, window, length):
+    storage_instrument.write_window = window
+    echo_pipelined = manager.echo_pipelined
+    unacknowledged = []
+
+    def counting_echo_pipelined(data):
+        unacknowledged.append(len(manager.pending))
+        return echo_pipelined(data)
+    manager.echo_pipelined = counting_echo_pipelined
+
+    data = bytes((index * 7) & 0xff for index in range(length))
+    storage_instrument.write(0x1000, data)
+    assert not manager.pending
+    # each chunk's echo is sent with at most window - 1 earlier echoes still outstanding
+    assert max(unacknowledged) <= window - 1
+    assert len(unacknowledged) == -(-length // StorageInstrument.maxTransferLength)
+    assert transport.instruments[4].read(0x1000, length) == data
+    assert storage_instrument.read(0x1000, length) == data